@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Compares payload size and rendering time of chromatogram figures with all data points and
+# downsampled traces (LTTB, src/common/downsample.py), for the full RT range and a zoomed-in range.
+# Chromatograms are synthetic: Gaussian peaks on noise, one scan every 0.1 s.
+# Rendering time is the static image export (needs kaleido), skipped if not available.
+# Usage: python benchmarks/chromatogram-downsampling.py [samples] [gradient length (min)] [max points]
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.common.downsample import MAX_POINTS, downsample
+
+samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+gradient = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+max_points = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_POINTS
+
+try:
+    import kaleido  # noqa: F401 (used by plotly for the image export)
+
+    KALEIDO_AVAILABLE = True
+except ImportError:
+    KALEIDO_AVAILABLE = False
+
+
+def chromatograms(rng):
+    """RT and intensities of the sample chromatograms (same scans for all samples)."""
+    rt = np.arange(0, gradient * 60, 0.1)
+    peaks = rng.uniform(0, rt[-1], 200)
+    heights = rng.lognormal(12, 1.5, len(peaks))
+    intensities = []
+    for _ in range(samples):
+        y = rng.normal(1e3, 2e2, len(rt)).clip(0)
+        for p, h in zip(peaks, heights * rng.uniform(0.5, 1.5, len(peaks))):
+            window = slice(*np.searchsorted(rt, [p - 30, p + 30]))
+            y[window] += h * np.exp(-((rt[window] - p) ** 2) / 18)
+        intensities.append(y)
+    return rt, intensities
+
+
+def figure(rt, intensities, downsampled, rt_range=None):
+    fig = go.Figure()
+    for k, y in enumerate(intensities):
+        if downsampled:
+            i = downsample(rt, y, max_points, rt_range)
+        elif rt_range is not None:
+            i = np.flatnonzero((rt >= rt_range[0]) & (rt <= rt_range[1]))
+        else:
+            i = np.arange(len(rt))
+        fig.add_trace(go.Scattergl(name=f"sample {k}", x=rt[i], y=y[i], mode="lines"))
+    return fig
+
+
+rt, intensities = chromatograms(np.random.default_rng(42))
+print(f"{samples} samples, {len(rt)} points per chromatogram, at most {max_points} points per trace")
+print(f"{'figure':<24}{'points':>12}{'build (s)':>12}{'JSON (MB)':>12}{'JSON (s)':>10}{'render (s)':>12}")
+center = rt[len(rt) // 2]
+for name, downsampled, rt_range in [
+    ("full range, all points", False, None),
+    ("full range, LTTB", True, None),
+    ("2 min, all points", False, (center - 60, center + 60)),
+    ("2 min, LTTB", True, (center - 60, center + 60)),
+]:
+    start = time.perf_counter()
+    fig = figure(rt, intensities, downsampled, rt_range)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    payload = fig.to_json()
+    serialize = time.perf_counter() - start
+    render = "-"
+    if KALEIDO_AVAILABLE:
+        start = time.perf_counter()
+        fig.to_image(format="png")
+        render = f"{time.perf_counter() - start:.2f}"
+    points = sum(len(trace.x) for trace in fig.data)
+    print(
+        f"{name:<24}{points:>12}{build:>12.2f}{len(payload) / 1e6:>12.1f}{serialize:>10.2f}{render:>12}"
+    )
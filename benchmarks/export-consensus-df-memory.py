@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Reports peak memory (RSS) of the consensus dataframe export in record batches against cohort size,
+# compared to the former implementation (ConsensusMap.get_df() plus per-sample ID lists, parquet and tsv).
+# Both load the complete consensus map, only the converted table is written in batches.
+# Each export runs in a fresh process, synthetic consensus maps are generated in a temporary directory.
+# Usage: python benchmarks/export-consensus-df-memory.py [n_features] [n_samples ...]
+from pathlib import Path
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+import numpy as np
+import pyopenms as poms
+
+script = Path(Path(__file__).parent.parent, "src", "python-tools", "export_consensus_df.py")
+
+
+def synthetic_consensus_map(n_features, n_samples, path, seed=42):
+    rng = np.random.default_rng(seed)
+    consensus_map = poms.ConsensusMap()
+    headers = {}
+    for i in range(n_samples):
+        header = poms.ColumnHeader()
+        header.filename = f"sample{i}.mzML"
+        header.size = n_features
+        headers[i] = header
+    consensus_map.setColumnHeaders(headers)
+    consensus_map.setExperimentType("label-free")
+    for _ in range(n_features):
+        cf = poms.ConsensusFeature()
+        cf.setMZ(float(rng.uniform(100, 1500)))
+        cf.setRT(float(rng.uniform(30, 1200)))
+        cf.setCharge(1)
+        cf.setUniqueId(int(rng.integers(1, 2**63)))
+        cf.setMetaValue("best ion", "[M+H]+")
+        for i in np.flatnonzero(rng.random(n_samples) < 0.7):
+            peak = poms.Peak2D()
+            peak.setRT(cf.getRT())
+            peak.setMZ(cf.getMZ())
+            peak.setIntensity(float(rng.uniform(1e3, 1e7)))
+            cf.insert(int(i), peak, int(rng.integers(1, 2**63)))
+        consensus_map.push_back(cf)
+    poms.ConsensusXMLFile().store(str(path), consensus_map)
+
+
+def peak_rss_mb(cmd):
+    """Runs a command and returns its peak resident set size in MB."""
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    if status != 0:
+        raise RuntimeError(f"{' '.join(map(str, cmd))} failed")
+    return rusage.ru_maxrss / 1024  # KB on Linux
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--get-df":
+        # child process for the baseline measurement: the former implementation
+        import pandas as pd
+
+        consensus_map = poms.ConsensusMap()
+        poms.ConsensusXMLFile().load(sys.argv[2], consensus_map)
+        df = consensus_map.get_df().drop(["sequence"], axis=1)
+        df.insert(4, "adduct", [cf.getMetaValue("best ion") for cf in consensus_map])
+        df.insert(
+            0,
+            "metabolite",
+            [
+                f"{round(mz, 4)}@{round(rt, 2)}@{adduct}"
+                for mz, rt, adduct in zip(df["mz"].tolist(), df["RT"].tolist(), df["adduct"].tolist())
+            ],
+        )
+        fnames = [Path(h.filename).name for h in consensus_map.getColumnHeaders().values()]
+        ids = [[] for _ in fnames]
+        for cf in consensus_map:
+            fids = {f.getMapIndex(): f.getUniqueId() for f in cf.getFeatureList()}
+            for i in range(len(fnames)):
+                ids[i].append(str(fids[i]) if i in fids else pd.NA)
+        for i, fname in enumerate(fnames):
+            df[f"{fname}_IDs"] = ids[i]
+        df["re-quantified"] = False
+        df["consensus_feature_id"] = df.index
+        df = df.set_index("metabolite")
+        df.to_parquet(sys.argv[3])
+        df.to_csv(Path(sys.argv[3]).with_suffix(".tsv"), sep="\t")
+        sys.exit()
+
+    n_features = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cohort_sizes = [int(n) for n in sys.argv[2:]] or [10, 50, 100, 250]
+
+    print(f"{n_features} consensus features")
+    print(f"{'samples':>8}{'load only (MB)':>16}{'former (MB)':>14}{'streaming (MB)':>16}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_samples in cohort_sizes:
+            consensusXML = Path(tmp_dir, f"{n_samples}.consensusXML")
+            synthetic_consensus_map(n_features, n_samples, consensusXML)
+            # memory needed to hold the consensus map itself, common to both approaches
+            load_only = peak_rss_mb(
+                [
+                    sys.executable,
+                    "-c",
+                    f"import pyopenms as poms; poms.ConsensusXMLFile().load('{consensusXML}', poms.ConsensusMap())",
+                ]
+            )
+            get_df = peak_rss_mb(
+                [sys.executable, __file__, "--get-df", str(consensusXML), str(Path(tmp_dir, "get-df.parquet"))]
+            )
+            params = Path(tmp_dir, "params.json")
+            with open(params, "w") as f:
+                json.dump({"in": [str(consensusXML)], "out": [str(Path(tmp_dir, "out.parquet"))]}, f)
+            streaming = peak_rss_mb([sys.executable, str(script), str(params)])
+            print(f"{n_samples:>8}{load_only:>16.0f}{get_df:>14.0f}{streaming:>16.0f}")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Compares the MS1 gap filling (src/python-tools/gap_filling.py) with FeatureFinderMetaboIdent
+# on a synthetic LC-MS run with known peak areas: run time and accuracy of the re-quantified intensities.
+# Both methods get the same targets (true m/z, RT with a small random error as from a consensus feature).
+# Usage: python benchmarks/gap-filling.py [n_compounds] [mz_tolerance_ppm] [rt_window_s]
+from pathlib import Path
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(Path(__file__).parent.parent, "src", "python-tools")))
+from gap_filling import ms1_index, integrate_features
+
+PROTON_MASS = 1.007825
+C13_DELTA = 1.003355
+# intensity of the M+1 relative to the monoisotopic trace
+ISOTOPE_RATIO = 0.3
+
+
+def synthetic_mzML(n_compounds, path, seed=42):
+    """LC-MS run (0.5 s cycle time) with gaussian peaks (M and M+1 isotope traces) and noise peaks."""
+    rng = np.random.default_rng(seed)
+    mz = rng.uniform(100, 1000, n_compounds)
+    rt = rng.uniform(60, 1140, n_compounds)
+    sigma = rng.uniform(2, 5, n_compounds)
+    height = 10 ** rng.uniform(4, 7, n_compounds)
+    exp = poms.MSExperiment()
+    for scan_rt in np.arange(0, 1200, 0.5):
+        eluting = np.flatnonzero(np.abs(rt - scan_rt) < 5 * sigma)
+        inty = height[eluting] * np.exp(-0.5 * ((scan_rt - rt[eluting]) / sigma[eluting]) ** 2)
+        mz_error = 1 + rng.normal(0, 2e-6, len(eluting))
+        noise_mz = rng.uniform(100, 1000, 300)
+        peaks_mz = np.concatenate([mz[eluting] * mz_error, (mz[eluting] + C13_DELTA) * mz_error, noise_mz])
+        peaks_inty = np.concatenate([inty, inty * ISOTOPE_RATIO, rng.uniform(100, 1000, len(noise_mz))])
+        order = np.argsort(peaks_mz)
+        spec = poms.MSSpectrum()
+        spec.setMSLevel(1)
+        spec.setRT(float(scan_rt))
+        spec.set_peaks((peaks_mz[order], peaks_inty[order].astype(np.float32)))
+        exp.addSpectrum(spec)
+    poms.MzMLFile().store(str(path), exp)
+    # true area of the M and M+1 traces
+    area = height * sigma * np.sqrt(2 * np.pi) * (1 + ISOTOPE_RATIO)
+    return mz, rt + rng.normal(0, 1, n_compounds), area
+
+
+def run_ffmid(mzML, mz, rt, mz_tolerance, rt_window):
+    exp = poms.MSExperiment()
+    poms.MzMLFile().load(str(mzML), exp)
+    library = [
+        poms.FeatureFinderMetaboIdentCompound(
+            str(i), "", float(m - PROTON_MASS), [1], [float(r)], [0.0], []
+        )
+        for i, (m, r) in enumerate(zip(mz, rt))
+    ]
+    ffmid = poms.FeatureFinderAlgorithmMetaboIdent()
+    params = ffmid.getParameters()
+    params.setValue("extract:mz_window", mz_tolerance)
+    params.setValue("extract:rt_window", rt_window)
+    params.setValue("extract:n_isotopes", 2)
+    ffmid.setParameters(params)
+    ffmid.setMSData(exp)
+    fm = poms.FeatureMap()
+    ffmid.run(library, fm, str(mzML))
+    intensity = np.zeros(len(mz))
+    for f in fm:
+        i = int(f.getMetaValue("label"))
+        intensity[i] = max(intensity[i], f.getIntensity())
+    return intensity
+
+
+def report(name, intensity, area):
+    found = intensity > 0
+    error = np.abs(intensity[found] - area[found]) / area[found]
+    r = np.corrcoef(np.log10(intensity[found]), np.log10(area[found]))[0, 1]
+    print(
+        f"{name:<14}{found.mean() * 100:>10.1f}{np.median(error) * 100:>16.1f}"
+        f"{np.percentile(error, 90) * 100:>16.1f}{r:>14.4f}"
+    )
+
+
+if __name__ == "__main__":
+    n_compounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mz_tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    rt_window = float(sys.argv[3]) if len(sys.argv) > 3 else 30.0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mzML = Path(tmp_dir, "sample.mzML")
+        mz, rt, area = synthetic_mzML(n_compounds, mzML)
+
+        start = time.perf_counter()
+        index = ms1_index(mzML, tmp_dir)
+        t_index = time.perf_counter() - start
+        start = time.perf_counter()
+        index = ms1_index(mzML, tmp_dir)
+        t_cached = time.perf_counter() - start
+        start = time.perf_counter()
+        gap_filled = np.concatenate(
+            [
+                r["intensity"]
+                for r in integrate_features(index, mz, np.ones(len(mz)), rt, mz_tolerance, rt_window)
+            ]
+        )
+        t_integrate = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ffmid = run_ffmid(mzML, mz, rt, mz_tolerance, rt_window)
+        t_ffmid = time.perf_counter() - start
+
+    print(f"{n_compounds} targets, {mz_tolerance} ppm, {rt_window} s RT window")
+    print(f"gap filling: index {t_index:.2f} s (cached {t_cached:.2f} s), integration {t_integrate:.2f} s")
+    print(f"FeatureFinderMetaboIdent (incl. mzML loading): {t_ffmid:.2f} s")
+    print()
+    print(f"{'method':<14}{'found (%)':>10}{'median err (%)':>16}{'90th err (%)':>16}{'r (log10)':>14}")
+    report("gap filling", gap_filled, area)
+    report("FFMID", ffmid, area)
+    both = (gap_filled > 0) & (ffmid > 0)
+    r = np.corrcoef(np.log10(gap_filled[both]), np.log10(ffmid[both]))[0, 1]
+    print(f"\ngap filling vs. FFMID: r (log10) = {r:.4f}, median ratio = {np.median(gap_filled[both] / ffmid[both]):.3f}")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Times local molecular networking (molecular_network.py) for growing numbers of spectra and
+# checks the candidate pruning against scoring all spectrum pairs (for the smallest size).
+# Spectra are synthetic families of analogues: noisy copies of a base spectrum, part of them with
+# a modification shifting the precursor and some of the fragments, all with common fragments.
+# Usage: python benchmarks/molecular-networking.py [sizes (comma separated)] [num_threads]
+from pathlib import Path
+import sys
+import time
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+path = Path(Path(__file__).parent.parent, "src", "python-tools", "molecular_network.py")
+spec = importlib.util.spec_from_file_location(path.stem, path)
+network = importlib.util.module_from_spec(spec)
+sys.modules[path.stem] = network  # worker processes need to find the module
+spec.loader.exec_module(network)
+from src.common.spectrallibrary import MAX_PEAKS, normalized_peaks  # noqa: E402 (path set by the tool)
+
+TOLERANCE, MAX_SHIFT, TOP_PEAKS, MIN_SHARED, MIN_SCORE, MIN_MATCHED_PEAKS = 0.02, 500.0, 10, 3, 0.7, 6
+
+
+def random_spectra(n, rng):
+    """Precursor m/z and padded normalized peaks of n spectra in families of 1 to 20 spectra."""
+    common = rng.uniform(50, 300, 30)
+    pmz, mz, intensity = np.zeros(n), [], []
+    i = 0
+    while i < n:
+        base_pmz = rng.uniform(150, 1200)
+        n_peaks = rng.integers(20, 80)
+        base = np.column_stack([rng.uniform(50, base_pmz, n_peaks), rng.exponential(1e4, n_peaks)])
+        for _ in range(min(rng.integers(1, 21), n - i)):
+            peaks = base.copy()
+            shift = rng.uniform(10, 200) if rng.random() < 0.5 else 0.0
+            # fragments containing the modification are shifted
+            peaks[rng.random(len(peaks)) < 0.4, 0] += shift
+            peaks[:, 0] += rng.normal(0, 0.003, len(peaks))
+            peaks[:, 1] *= rng.uniform(0.5, 1.5, len(peaks))
+            peaks = np.vstack([peaks, np.column_stack([rng.choice(common, 5), rng.exponential(3e3, 5)])])
+            m, x = normalized_peaks(peaks)
+            pmz[i] = base_pmz + shift
+            mz.append(m)
+            intensity.append(x)
+            i += 1
+    padded_mz = np.full((n, MAX_PEAKS), np.nan, dtype=np.float32)
+    padded_intensity = np.zeros((n, MAX_PEAKS), dtype=np.float32)
+    for k, (m, x) in enumerate(zip(mz, intensity)):
+        padded_mz[k, : len(m)] = m
+        padded_intensity[k, : len(x)] = x
+    return pmz, padded_mz, padded_intensity
+
+
+def score(i, j, pmz, mz, intensity, num_threads):
+    shards = [s for s in np.array_split(np.arange(len(i)), num_threads * 4) if len(s)]
+    with ProcessPoolExecutor(
+        num_threads, initializer=network.init_worker, initargs=(pmz, mz, intensity, TOLERANCE)
+    ) as executor:
+        results = list(executor.map(network.score_pairs, [i[s] for s in shards], [j[s] for s in shards]))
+    scores = np.concatenate([r[0] for r in results])
+    matched = np.concatenate([r[1] for r in results])
+    return (scores >= MIN_SCORE) & (matched >= MIN_MATCHED_PEAKS)
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [2000, 10000, 50000]
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    for k, n in enumerate(sizes):
+        pmz, mz, intensity = random_spectra(n, np.random.default_rng(42))
+        start = time.perf_counter()
+        i, j = network.candidate_pairs(
+            pmz, mz, intensity, TOLERANCE, MAX_SHIFT, TOP_PEAKS, MIN_SHARED
+        )
+        t_candidates = time.perf_counter() - start
+        start = time.perf_counter()
+        edges = score(i, j, pmz, mz, intensity, num_threads)
+        t_score = time.perf_counter() - start
+        print(f"{n} spectra: {len(i)} candidate pairs ({len(i) / (n * (n - 1) / 2):.2%} of all pairs), {edges.sum()} edges")
+        print(f"  candidates: {t_candidates:.2f} s, scoring ({num_threads} processes): {t_score:.2f} s")
+
+        if k == 0:
+            # all pairs within the maximum precursor shift, the edges found without pruning
+            a, b = np.triu_indices(n, 1)
+            within = np.abs(pmz[a] - pmz[b]) <= MAX_SHIFT
+            a, b = a[within], b[within]
+            start = time.perf_counter()
+            all_edges = score(a, b, pmz, mz, intensity, num_threads)
+            t_all = time.perf_counter() - start
+            found = set(zip(i[edges], j[edges]))
+            expected = set(zip(a[all_edges], b[all_edges]))
+            print(f"  all {len(a)} pairs within max shift: {t_all:.2f} s, {len(expected)} edges")
+            print(f"  edges found with pruning: {len(found & expected) / max(1, len(expected)):.2%}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Times spectral library matching: the former per spectrum pair cosine loop against the batched
+# (padded array) scoring in match_ms2_library.py, single process and with a process pool.
+# Usage: python benchmarks/ms2-library-matching.py [n_library] [n_queries] [num_threads]
+from pathlib import Path
+import sys
+import time
+import tempfile
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+path = Path(Path(__file__).parent.parent, "src", "python-tools", "match_ms2_library.py")
+spec = importlib.util.spec_from_file_location(path.stem, path)
+matcher = importlib.util.module_from_spec(spec)
+sys.modules[path.stem] = matcher  # worker processes need to find the module
+spec.loader.exec_module(matcher)
+
+
+def cosine_loop(mz1, intensity1, mz2, intensity2, tolerance, shift=None):
+    """Greedy cosine of one spectrum pair (ppm tolerance), the former implementation."""
+    tol = mz1[:, None] * tolerance * 1e-6
+    diff = mz1[:, None] - mz2[None, :]
+    matched = np.abs(diff) <= tol
+    if shift is not None:
+        matched |= np.abs(diff - shift) <= tol
+    products = np.where(matched, intensity1[:, None] * intensity2[None, :], 0)
+    score, used1, used2 = 0.0, set(), set()
+    for flat in np.argsort(products, axis=None, kind="stable")[::-1]:
+        if products.flat[flat] <= 0:
+            break
+        i, j = divmod(int(flat), products.shape[1])
+        if i not in used1 and j not in used2:
+            score += products.flat[flat]
+            used1.add(i)
+            used2.add(j)
+    return score
+
+
+def match_loop(index_dir, pmz, mz, intensity, prec_tolerance, frag_tolerance, modified):
+    """Best score of each query spectrum, one library spectrum at a time."""
+    index = matcher.load_index(index_dir)
+    library_mz = index["precursor_mz"]
+    best = np.zeros(len(pmz))
+    for q in range(len(pmz)):
+        tol = pmz[q] * prec_tolerance * 1e-6
+        lo = np.searchsorted(library_mz, pmz[q] - tol, side="left")
+        hi = np.searchsorted(library_mz, pmz[q] + tol, side="right")
+        n = np.count_nonzero(~np.isnan(mz[q]))
+        for k in range(lo, hi):
+            start, end = index["offsets"][k], index["offsets"][k + 1]
+            best[q] = max(
+                best[q],
+                cosine_loop(
+                    mz[q, :n],
+                    intensity[q, :n],
+                    index["mz"][start:end],
+                    index["intensity"][start:end],
+                    frag_tolerance,
+                    pmz[q] - library_mz[k] if modified else None,
+                ),
+            )
+    return best
+
+
+def random_spectra(n, rng):
+    """Spectra with 20 to 100 peaks, precursor m/z between 100 and 1000."""
+    spectra = []
+    for _ in range(n):
+        n_peaks = rng.integers(20, 100)
+        pmz = rng.uniform(100, 1000)
+        peaks = np.column_stack([rng.uniform(50, pmz, n_peaks), rng.uniform(1, 1e5, n_peaks)])
+        spectra.append((pmz, peaks))
+    return spectra
+
+
+def write_mgf(path, spectra, feature_ids=False):
+    with open(path, "w") as f:
+        for i, (pmz, peaks) in enumerate(spectra):
+            f.write(f"BEGIN IONS\nPEPMASS={pmz}\nNAME=compound {i}\nSCANS={i + 1}\n")
+            if feature_ids:
+                f.write(f"FEATURE_ID=e_{i}\n")
+            f.writelines(f"{mz:.5f} {intensity:.1f}\n" for mz, intensity in peaks)
+            f.write("END IONS\n")
+
+
+def best_scores(df, n):
+    best = np.zeros(n)
+    np.maximum.at(best, df["query"].to_numpy(dtype=int), df["score"].to_numpy())
+    return best
+
+
+if __name__ == "__main__":
+    n_library = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    prec_tolerance, frag_tolerance = 100.0, 500.0
+
+    rng = np.random.default_rng(42)
+    library = random_spectra(n_library, rng)
+    # queries are noisy copies of library spectra, half of them with shifted precursor m/z
+    queries = []
+    for pmz, peaks in (library[i] for i in rng.choice(n_library, n_queries, replace=False)):
+        peaks = peaks * [1 + rng.normal(0, 2e-6), 1] + rng.normal(0, [0, 1e3], peaks.shape).clip(0)
+        queries.append((pmz * (1 + rng.uniform(-5e-5, 5e-5)), np.abs(peaks)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_mgf(Path(tmp_dir, "library.mgf"), library)
+        write_mgf(Path(tmp_dir, "queries.mgf"), queries, feature_ids=True)
+        index_dir = matcher.library_index(Path(tmp_dir, "library.mgf"), Path(tmp_dir, "cache"))
+        spectra, pmz, mz, intensity = matcher.gnps_spectra(Path(tmp_dir, "queries.mgf"))
+
+        for modified in [False, True]:
+            settings = [prec_tolerance, frag_tolerance, True, modified, 1]
+            start = time.perf_counter()
+            reference = match_loop(index_dir, pmz, mz, intensity, prec_tolerance, frag_tolerance, modified)
+            t_loop = time.perf_counter() - start
+
+            start = time.perf_counter()
+            df = matcher.match_library(index_dir, pmz, mz, intensity, *settings)
+            t_batch = time.perf_counter() - start
+
+            start = time.perf_counter()
+            chunks = np.array_split(np.arange(len(pmz)), num_threads * 4)
+            with ProcessPoolExecutor(num_threads) as executor:
+                futures = [
+                    executor.submit(matcher.match_chunk, index_dir, pmz[c], mz[c], intensity[c], c[0], *settings)
+                    for c in chunks
+                ]
+                df_parallel = [f.result() for f in futures]
+            t_parallel = time.perf_counter() - start
+
+            # Both implementations have to find the same best scores
+            assert np.allclose(best_scores(df, len(pmz)), reference, atol=1e-5), "Scores differ"
+            for c, d in zip(chunks, df_parallel):
+                assert np.allclose(best_scores(d, len(pmz))[c], reference[c], atol=1e-5), "Scores differ"
+
+            print(f"{'modified cosine' if modified else 'cosine'}: {n_queries} queries x {n_library} library spectra")
+            print(f"  per pair loop:          {t_loop:.2f} s")
+            print(f"  batched:                {t_batch:.2f} s ({t_loop / t_batch:.1f}x)")
+            print(f"  batched, {num_threads} processes: {t_parallel:.2f} s ({t_loop / t_parallel:.1f}x)")
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# Compares file size and read throughput of the mzML storage encodings.
+# Usage: python benchmarks/mzml-read-throughput.py <file.mzML> [repetitions]
+from pathlib import Path
+import sys
+import time
+import tempfile
+
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.common.mzmlfiles import MZML_ENCODINGS, encode_mzML
+
+mzML_file = Path(sys.argv[1])
+repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+print(f"{'encoding':<18}{'size (MB)':>12}{'read (s)':>12}{'MB/s (raw)':>14}")
+raw_size = mzML_file.stat().st_size / 1e6
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for encoding in MZML_ENCODINGS:
+        encoded = encode_mzML(mzML_file, encoding, tmp_dir)
+        size = encoded.stat().st_size / 1e6
+        times = []
+        for _ in range(repetitions):
+            exp = poms.MSExperiment()
+            start = time.perf_counter()
+            poms.MzMLFile().load(str(encoded), exp)
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        print(f"{encoding:<18}{size:>12.1f}{best:>12.2f}{raw_size / best:>14.1f}")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Times FeatureMap re-construction from feature DataFrames: the former row by row
+# implementation (df.iterrows) against the bulk path in recreate_feature_maps.py.
+# Usage: python benchmarks/recreate-feature-maps.py [n_features] [n_files] [num_threads]
+from pathlib import Path
+import sys
+import time
+import tempfile
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyopenms as poms
+
+path = Path(Path(__file__).parent.parent, "src", "python-tools", "recreate_feature_maps.py")
+spec = importlib.util.spec_from_file_location(path.stem, path)
+recreate = importlib.util.module_from_spec(spec)
+sys.modules[path.stem] = recreate  # worker processes need to find the module
+spec.loader.exec_module(recreate)
+
+
+def feature_map_iterrows(df, mzML_name):
+    fm = poms.FeatureMap()
+    fm.setPrimaryMSRunPath([mzML_name.encode()])
+    for i, row in df.iterrows():
+        f = poms.Feature()
+        f.setRT(row["RT"])
+        f.setMZ(row["mz"])
+        f.setIntensity(row["intensity"])
+        f.setOverallQuality(row["quality"])
+        f.setCharge(row["charge"])
+        if row["adduct"] != "nan":
+            f.setMetaValue("dc_charge_adducts", row["adduct"])
+        f.setMetaValue("num_of_masstraces", row["num_of_masstraces"])
+        f.setUniqueId(int(i))
+        hull = poms.ConvexHull2D()
+        hull.addPoint([row["RTstart"], row["MZstart"]])
+        hull.addPoint([row["RTend"], row["MZend"]])
+        hull.addPoint([row["RTend"], row["MZstart"]])
+        hull.addPoint([row["RTstart"], row["MZend"]])
+        f.setConvexHulls([hull])
+        fm.push_back(f)
+    return fm
+
+
+def random_feature_df(n, rng):
+    rt = rng.uniform(30, 1200, n)
+    mz = rng.uniform(100, 1500, n)
+    return pd.DataFrame(
+        {
+            "RT": rt,
+            "mz": mz,
+            "intensity": rng.uniform(1e3, 1e7, n),
+            "quality": rng.uniform(0, 1, n),
+            "charge": rng.integers(1, 3, n),
+            "adduct": rng.choice(["[M+H]+", "[M+Na]+", "nan"], n),
+            "num_of_masstraces": rng.integers(1, 5, n),
+            "RTstart": rt - 5,
+            "RTend": rt + 5,
+            "MZstart": mz - 0.005,
+            "MZend": mz + 0.005,
+        },
+        index=rng.integers(0, 2**62, n),
+    )
+
+
+if __name__ == "__main__":
+    n_features = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    rng = np.random.default_rng(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i in range(n_files):
+            files.append(Path(tmp_dir, f"sample{i}.parquet"))
+            random_feature_df(n_features, rng).to_parquet(files[-1])
+
+        start = time.perf_counter()
+        for f in files:
+            poms.FeatureXMLFile().store(
+                str(Path(tmp_dir, f.stem + "-iterrows.featureXML")),
+                feature_map_iterrows(pd.read_parquet(f), f.stem + ".mzML"),
+            )
+        t_iterrows = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for f in files:
+            recreate.recreate_feature_map(f, tmp_dir)
+        t_bulk = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(num_threads) as executor:
+            list(executor.map(recreate.recreate_feature_map, files, [tmp_dir] * len(files)))
+        t_parallel = time.perf_counter() - start
+
+        # Both implementations have to produce the same feature maps
+        for f in files:
+            a, b = poms.FeatureMap(), poms.FeatureMap()
+            poms.FeatureXMLFile().load(str(Path(tmp_dir, f.stem + "-iterrows.featureXML")), a)
+            poms.FeatureXMLFile().load(str(Path(tmp_dir, f.stem + ".featureXML")), b)
+            assert a.get_df().equals(b.get_df()), f"Feature maps differ for {f.name}"
+
+    print(f"{n_files} files x {n_features} features")
+    print(f"iterrows:                {t_iterrows:.2f} s")
+    print(f"bulk:                    {t_bulk:.2f} s ({t_iterrows / t_bulk:.1f}x)")
+    print(f"bulk, {num_threads} processes:     {t_parallel:.2f} s ({t_iterrows / t_parallel:.1f}x)")
@@ -2,9 +2,13 @@
 from pathlib import Path
 import os
 import time
+import sys
 import shutil
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).parent))
+from src.common.blobstore import STORE_DIR_NAME, remove_unreferenced
+
 # Define the workspaces directory
 workspaces_directory = Path("/workspaces-streamlit-template")
 
@@ -23,8 +27,8 @@ print(
 remaining_directories = []
 # Iterate through directories in workspaces_directory
 for directory in workspaces_directory.iterdir():
-    # Check if it's a directory
-    if directory.is_dir():
+    # Check if it's a directory (skip shared directories, e.g. the mzML store and caches)
+    if directory.is_dir() and not directory.name.startswith("."):
         # Get the directory's modification time
         modification_time = os.path.getmtime(directory)
 
@@ -43,6 +47,10 @@ for directory in workspaces_directory.iterdir():
         else:
             remaining_directories.append(directory)
 
+# Delete shared mzML files which are not referenced by any remaining workspace
+removed_blobs = remove_unreferenced(Path(workspaces_directory, STORE_DIR_NAME))
+print(f"Deleted {len(removed_blobs)} unreferenced files from shared mzML store.\n")
+
 # Print info on remaining directories
 if remaining_directories:
     print(f"\nRemaining directories in {workspaces_directory.name}:")
@@ -2,6 +2,7 @@ import streamlit as st
 from src.common import *
 from src.eic import *
 from src.masscalculator import get_mass, check_formula
+from src.common.resultcache import file_key
 
 from pathlib import Path
 import pandas as pd
@@ -239,7 +240,7 @@ if path.exists():
             "metabolite"
         )
         # display the feature matrix and it's bar plot
-        fig = get_auc_fig(df_auc)
+        fig = get_auc_fig(df_auc, key=file_key(Path(results_dir, file_name)))
         show_fig(fig, "xic-summary")
         show_table(df_auc, "feature-matrix-xic")
 
@@ -258,8 +259,9 @@ if path.exists():
             df["AUC baseline"] = [baseline] * df.shape[0]
         if not show_bpc:
             df.drop(columns=["BPC"], inplace=True)
-        fig = get_sample_plot(df, file, time_unit)
-        show_fig(fig, file)
+        fig = get_sample_plot(df, file, time_unit, selected_x_range(f"eic-sample-{file}"))
+        show_fig(fig, file, True, f"eic-sample-{file}")
+        st.info("💡 Select a time range (box select) to zoom in at full resolution, double click to reset.")
 
     with tabs[2]:
         # overlayed EICs for each sample
@@ -269,8 +271,17 @@ if path.exists():
                 "metabolite"
             )
         metabolite = st.selectbox("select metabolite", df_auc.index)
-        fig = get_metabolite_fig(df_auc, metabolite, time_unit)
-        show_fig(fig, f"eic-{metabolite}")
+        # cached by the results of the run (summary file) and the selection
+        time_range = selected_x_range(f"eic-metabolite-{metabolite}")
+        fig = get_metabolite_fig(
+            df_auc,
+            metabolite,
+            time_unit,
+            time_range,
+            key=file_key(Path(results_dir, "summary.tsv"), metabolite, time_unit, time_range),
+        )
+        show_fig(fig, f"eic-{metabolite}", True, f"eic-metabolite-{metabolite}")
+        st.info("💡 Select a time range (box select) to zoom in at full resolution, double click to reset.")
 
     with tabs[3]:
         with open(os.path.join(results_dir, "chromatograms.zip"), "rb") as fp:
@@ -4,6 +4,7 @@ import streamlit as st
 
 from src.common.common import *
 from src.fileupload import *
+from src.common.mzmlfiles import MZML_ENCODINGS, SAMPLE_TYPES, strip_compression_suffix
 
 params = page_setup()
 
@@ -11,6 +12,23 @@ st.title("mzML Files")
 df_path = Path(st.session_state.workspace, "mzML-files.tsv")
 mzML_dir = Path(st.session_state.workspace, "mzML-files")
 
+
+def update_encoding():
+    # stored only if changed, not on every rerun
+    params["mzML-encoding"] = st.session_state["mzML-encoding"]
+    save_params(params)
+
+
+encoding = st.columns(3)[0].selectbox(
+    "storage format",
+    MZML_ENCODINGS,
+    MZML_ENCODINGS.index(params.get("mzML-encoding", "mzML")),
+    key="mzML-encoding",
+    on_change=update_encoding,
+    help="Format to store added mzML files in. **numpress** encodes peak data near-lossless and compresses it within a valid mzML file. **mzML.gz** compresses the entire file with gzip. Both are read transparently by all tools and reduce disk usage considerably.",
+)
+params["mzML-encoding"] = encoding
+
 tabs = ["⬆️ File Upload", "Example Data"]
 if st.session_state.location == "local":
     tabs.append("Files from local folder")
@@ -26,7 +44,7 @@ with tabs[0]:
         _, c2, _ = st.columns(3)
         if c2.form_submit_button("Add files to workspace", use_container_width=True, type="primary"):
             if files:
-                save_uploaded_mzML(files)
+                save_uploaded_mzML(files, encoding)
                 update_mzML_df(df_path, mzML_dir).to_csv(df_path, sep="\t", index=False)
                 st.rerun()
             else:
@@ -37,7 +55,7 @@ with tabs[1]:
     st.markdown("Example data set of bacterial cytosolic fractions. Bacillus subtilis cultures were treated with the antibiotic fosfomycin, which inhibits a step in the biosynthesis of petidoglycan (bacterial cell wall). The major accumulation product is UDP-GlcNAc [M+H]+ = 608.088 m/z.")
     _, c2, _ = st.columns(3)
     if c2.button("Load Example Data", type="primary", use_container_width=True):
-        load_example_mzML_files()
+        load_example_mzML_files(encoding)
         update_mzML_df(df_path, mzML_dir).to_csv(df_path, sep="\t", index=False)
         st.rerun()
 
@@ -51,21 +69,17 @@ if st.session_state.location == "local":
         local_mzML_dir = r"{}".format(local_mzML_dir)
         _, c2, _ = st.columns(3)
         if c2.button("Copy files to workspace", type="primary", use_container_width=True, disabled=(local_mzML_dir == "")):
-            copy_local_mzML_files_from_directory(local_mzML_dir)
+            copy_local_mzML_files_from_directory(local_mzML_dir, encoding=encoding)
             update_mzML_df(df_path, mzML_dir).to_csv(df_path, sep="\t", index=False)
             st.rerun()
 elif st.session_state.location == "online":
     with tabs[2]:
         c1, c2 = st.columns(2)
         if c1.button("Get all mzML files in workspace as zip file.", use_container_width=True):
-            zip_buffer = zip_files(Path(st.session_state.workspace, "mzML-files"))
-            c2.download_button(
-                label="⬇️ Download Now",
-                data=zip_buffer,
-                file_name=f"mzML_files-{Path(st.session_state.workspace).stem}.zip",
-                mime="application/zip",
-                type="primary",
-                use_container_width=True
+            download_mzML_files(
+                mzML_dir,
+                f"mzML_files-{Path(st.session_state.workspace).stem}.zip",
+                container=c2,
             )
 
 
@@ -76,7 +90,20 @@ def file_selection_section():
     c1, c2 = st.columns(2)
     # Display all mzML files currently in workspace
     c1.markdown("##### select mzML files for analysis:")
-    edited = st.data_editor(df, hide_index=True, use_container_width=True, disabled=["file name"], key="mzML-files-df")
+    edited = st.data_editor(
+        df,
+        hide_index=True,
+        use_container_width=True,
+        disabled=["file name"],
+        column_config={
+            "sample type": st.column_config.SelectboxColumn(
+                options=SAMPLE_TYPES,
+                required=True,
+                help="Blanks and QC samples are used to remove background and irreproducible features (UmetaFlow feature pruning).",
+            )
+        },
+        key="mzML-files-df",
+    )
     if (st.session_state["mzML-files-df"]["edited_rows"] or st.session_state["mzML-files-df"]["deleted_rows"] or st.session_state["mzML-files-df"]["added_rows"]):
         edited.to_csv(df_path, sep="\t", index=False)
 
@@ -86,7 +113,7 @@ if any(Path(mzML_dir).iterdir()):
     with st.form("remove-mzML-files"):
         st.markdown("🗑️ Remove mzML files")
         to_remove = st.multiselect("select mzML files",
-                                options=[f.stem for f in sorted(mzML_dir.iterdir())])
+                                options=[Path(strip_compression_suffix(f)).stem for f in sorted(mzML_dir.iterdir())])
         c1, c2 = st.columns(2)
         if c2.form_submit_button("Remove **selected**", use_container_width=True):
             remove_selected_mzML_files(to_remove, params)
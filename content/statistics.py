@@ -3,6 +3,7 @@ import pandas as pd
 from pathlib import Path
 from src.common import *
 from src.stats import *
+from src.common.resultcache import file_key
 
 params = page_setup(page="workflow")
 
@@ -45,20 +46,24 @@ if path.exists():
             # show plots
             samples = mean.columns.tolist()
             features = mean.index.tolist()
-            fig = mean_intensity_plot(samples, features, mean, std)
+            # cached by the summary file and the compared samples
+            key = file_key(path, a, b)
+            fig = mean_intensity_plot(samples, features, mean, std, key=key)
             show_fig(fig, "metabolite-intensities")
 
-            fig = fold_change_plot(change)
+            fig = fold_change_plot(change, key=key)
             show_fig(fig, "fold-changes")
 
     with tabs[1]:
+        # cached by the summary file (path and modification time)
+        key = file_key(path)
         df = scale_df(
-            df[[col for col in df.columns if col.endswith(".mzML")]]
+            df[[col for col in df.columns if col.endswith(".mzML")]], key=key
         )
-        fig = dendrogram(df.T)
+        fig = dendrogram(df.T, key=key)
         show_fig(fig, "dendrogram")
 
-        fig = heatmap(df)
+        fig = heatmap(df, key=key)
         show_fig(fig, "heatmap")
     with tabs[2]:
         show_table(df, "feature-matrix")
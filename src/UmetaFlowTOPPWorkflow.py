@@ -3,6 +3,7 @@ from pathlib import Path
 from .workflow.WorkflowManager import WorkflowManager
 
 import pandas as pd
+import pyopenms as poms
 
 import shutil
 import json
@@ -10,6 +11,7 @@ import sys
 
 
 from src.metabolomicsresults import *
+from src.common.mzmlfiles import strip_compression_suffix
 
 
 class Workflow(WorkflowManager):
@@ -154,6 +156,33 @@ class Workflow(WorkflowManager):
                     "adducts_neg",
                     help="Potential adducts in negative mode. Format: adduct:charge:probability.",
                 )
+            st.markdown(
+                "**Feature Linking**",
+                help="Group corresponding features across samples into consensus features.",
+            )
+            cols = st.columns(4)
+            with cols[0]:
+                self.ui.input_widget(
+                    "linking-batch-size",
+                    0,
+                    "batch size",
+                    min_value=0,
+                    step_size=1,
+                    help="Link samples in batches of this size (e.g. per plate) in parallel and link the batch results hierarchically. Recommended for large cohorts. 0 links all samples at once.",
+                )
+            with cols[1]:
+                self.ui.input_widget(
+                    "append-samples",
+                    False,
+                    "append new samples",
+                    help="Process only samples which are not part of the previous results yet and add them to the existing feature matrix: feature detection, alignment to the previous samples and re-quantification of the affected missing values. Keep all other parameters unchanged. Deselecting previous samples runs the workflow for all samples.",
+                )
+            self.ui.input_widget(
+                "prune-features",
+                False,
+                "**Feature Pruning (optional)**",
+                help="Remove features which are background (blank ratio) or not reproducible (QC CV) right after feature linking, so they are neither re-quantified nor annotated. Set the sample type of blanks and QC samples in the mzML file table.",
+            )
             with st.columns(2)[0].container(border=True):
                 st.image(str(Path("assets", "metabolomics-preprocessing.png")))
         with tabs[1]:
@@ -163,9 +192,22 @@ class Workflow(WorkflowManager):
                 "**Re-quantify** features with missing values",
                 help="Re-quantify consensus features in the FeatureMatrix with at least one missing value.",
             )
+            self.ui.input_widget(
+                "requantify-method",
+                "FeatureFinderMetaboIdent",
+                "re-quantification method",
+                options=["FeatureFinderMetaboIdent", "MS1 gap filling"],
+                help="**FeatureFinderMetaboIdent** detects the missing features with targeted feature detection. **MS1 gap filling** integrates the extracted ion chromatograms of the missing features directly from the MS1 data (*m/z* and RT tolerance as above), which is much faster.",
+            )
             with st.columns(2)[0].container(border=True):
                 st.image(str(Path("assets", "requant.png")))
         with tabs[2]:
+            self.ui.input_widget(
+                "cluster-ms2",
+                False,
+                "cluster **replicate MS2 spectra** before annotation",
+                help="Group similar MS2 spectra (precursor *m/z*, RT and cosine similarity) of all samples and annotate one consensus spectrum per cluster with the in-house library, MS2Query and the molecular network. Results apply to all consensus features of a cluster. Faster for many samples.",
+            )
             self.ui.input_widget(
                 "annotate-ms2",
                 False,
@@ -175,7 +217,10 @@ class Workflow(WorkflowManager):
             cols = st.columns([0.75, 0.25])
             with cols[0]:
                 self.ui.simple_file_uploader(
-                    "ms2-library", "mgf", "MS2 library in mgf format"
+                    "ms2-library",
+                    ["mgf", "msp"],
+                    "MS2 libraries in mgf or msp format",
+                    multiple=True,
                 )
 
             with cols[1]:
@@ -224,6 +269,13 @@ class Workflow(WorkflowManager):
                         help="Password from a valid SIRIUS account. **Not encrypted**, will be stored **unencrypted in plain text** in parameters and show up in log files.",
                         widget_type="password",
                     )
+                with cols[2]:
+                    self.ui.input_widget(
+                        "sirius-consensus",
+                        False,
+                        "run once per **consensus feature**",
+                        help="Run SIRIUS once on a merged input file with one compound per consensus feature (MS1 and MS2 spectra from the sample with the highest intensity) instead of once per sample. Much faster for many samples.",
+                    )
                 cols = st.columns(4)
                 with cols[0]:
                     self.ui.input_widget(
@@ -302,6 +354,12 @@ class Workflow(WorkflowManager):
                     "export input files for **GNPS FBMN & IIMN**",
                     help="GNPS (Global Natural Products Social Molecular Networking) is an open-access platform designed for the analysis, sharing, and annotation of MS2 spectra, particularly in natural products research. By leveraging community-contributed spectral libraries, GNPS enables the identification of metabolites and the exploration of related molecules in networks. Feature-based molecular networking (FBMN) builds networks where nodes represent molecular features and edges indicate spectral similarity. This approach provides a visual and interactive way to explore the relationships between metabolites, aiding in the identification of unknown compounds which have identified neighbours. If adduct detection was enabled during pre-processing, Ion identity molecular networking (IIMN) can reduce the complexity in FBMN by collapsing different ion species of the same metabolite, which would have otherwise appeared as separate nodes. UmetaFlow exports all necessary files for GNPS FBMN and IIMN, but these tools must be executed externally. GNPS result files, including a table of library hits and the network graph, can then be used to annotate the FeatureMatrix with library hits and enrich the FBMN network graph with SIRIUS results.",
                 )
+                self.ui.input_widget(
+                    "molecular-networking",
+                    False,
+                    "compute the **molecular network** locally",
+                    help="Compute the spectral similarity network (modified cosine) of the consensus features within UmetaFlow instead of uploading the exported files to GNPS. The network edges are exported as table, the FeatureMatrix is annotated with network components and neighbours.",
+                )
             with cols[1]:
                 st.image(str(Path("assets", "GNPS_logo.png")), width=200)
             st.divider()
@@ -319,6 +377,15 @@ class Workflow(WorkflowManager):
                 st.image(str(Path("assets", "annotations.png")))
 
     def configure_expert(self) -> None:
+        self.ui.input_widget(
+            "num_threads",
+            1,
+            "number of threads",
+            step_size=1,
+            min_value=1,
+            max_value=20,
+            help="Number of parallel processes of the Python tools (e.g. feature map re-creation, gap filling, spectral library matching, molecular networking). Threads of the TOPP tools are set in their parameters.",
+        )
         tabs = st.tabs(
             ["⚙️ **Pre-Processing**", "🔎 **Re-Quantification**", "🏷️ **Annotation**"]
         )
@@ -330,6 +397,7 @@ class Workflow(WorkflowManager):
                     "Adduct Detection",
                     "Map Alignment",
                     "Feature Linking",
+                    "Feature Pruning",
                 ]
             )
             with t[0]:
@@ -379,18 +447,71 @@ class Workflow(WorkflowManager):
                     "MapAlignerPoseClustering", exclude_parameters=["index"]
                 )
             with t[4]:
+                self.ui.input_widget(
+                    "linking-batch-size",
+                    0,
+                    "linking batch size",
+                    min_value=0,
+                    step_size=1,
+                    help="Link samples in batches of this size (e.g. per plate) in parallel and link the batch results hierarchically. Recommended for large cohorts. 0 links all samples at once.",
+                )
+                self.ui.input_widget(
+                    "append-samples",
+                    False,
+                    "append new samples to the previous results",
+                    help="Process only samples which are not part of the previous results yet and add them to the existing feature matrix: feature detection, alignment to the previous samples and re-quantification of the affected missing values. Keep all other parameters unchanged. Deselecting previous samples runs the workflow for all samples.",
+                )
                 self.ui.input_TOPP(
                     "FeatureLinkerUnlabeledKD",
                 )
+            with t[5]:
+                self.ui.input_widget(
+                    "prune-features",
+                    False,
+                    "prune features by blanks, detection frequency and QC CV",
+                    help="Remove features right after feature linking, before re-quantification and annotation (listed in **pruned-features**). Set the sample type of blanks and QC samples in the mzML file table. Features are removed if their mean intensity in the samples is not sufficiently above the blanks, if they are detected in too few samples or if their intensity varies too much in the QC samples.",
+                )
+                self.ui.input_python("prune_features")
         with tabs[1]:
             self.ui.input_widget(
                 "requantify",
                 False,
                 "**re-quantify** features with missing values",
-                help="Re-quantify missing values in consensus features using the OpenMS TOPP tool *FeatureFinderMetaboIdent*.",
+                help="Re-quantify missing values in consensus features using the OpenMS TOPP tool *FeatureFinderMetaboIdent* or MS1 gap filling.",
             )
+            self.ui.input_widget(
+                "requantify-method",
+                "FeatureFinderMetaboIdent",
+                "re-quantification method",
+                options=["FeatureFinderMetaboIdent", "MS1 gap filling"],
+                help="**FeatureFinderMetaboIdent** detects the missing features with targeted feature detection. **MS1 gap filling** integrates the extracted ion chromatograms (monoisotopic and first isotope trace) of the missing features directly from the MS1 data, which is much faster.",
+            )
+            cols = st.columns(4)
+            with cols[0]:
+                self.ui.input_widget(
+                    "gap-filling-mz-tolerance",
+                    10.0,
+                    "gap filling m/z tolerance (ppm)",
+                    min_value=0.1,
+                    help="m/z tolerance in ppm for the extracted ion chromatograms.",
+                )
+            with cols[1]:
+                self.ui.input_widget(
+                    "gap-filling-rt-window",
+                    30.0,
+                    "gap filling RT window (s)",
+                    min_value=1.0,
+                    help="RT window in seconds centered on the consensus feature RT, in which the extracted ion chromatograms are integrated.",
+                )
             self.ui.input_TOPP("FeatureFinderMetaboIdent")
         with tabs[2]:
+            self.ui.input_widget(
+                "cluster-ms2",
+                False,
+                "cluster MS2 spectra before annotation",
+                help="Group the MS2 spectra of all samples by precursor *m/z*, RT and cosine similarity. One consensus spectrum per cluster is annotated by spectral library matching, MS2Query and the molecular network, the results are propagated to all consensus features of the cluster (membership table in **ms2-cluster-membership**). SIRIUS uses its own input files and is not affected. Without GNPS export, *GNPSExport* is skipped.",
+            )
+            self.ui.input_python("cluster_ms2_spectra")
             t = st.tabs(
                 [
                     "In-house MS2 library",
@@ -407,9 +528,27 @@ class Workflow(WorkflowManager):
                     help="Based on MS2 spectrum similarity.",
                 )
                 self.ui.simple_file_uploader(
-                    "ms2-library", "mgf", "MS2 library in mgf format"
+                    "ms2-library",
+                    ["mgf", "msp"],
+                    "MS2 libraries in mgf or msp format",
+                    multiple=True,
+                )
+                self.ui.input_TOPP(
+                    "MetaboliteSpectralMatcher",
+                    include_parameters=[
+                        "prec_mass_error_value",
+                        "frag_mass_error_value",
+                        "mass_error_unit",
+                        "report_mode",
+                    ],
+                )
+                self.ui.input_widget(
+                    "ms2-matching-score",
+                    "cosine",
+                    "similarity score",
+                    options=["cosine", "modified cosine"],
+                    help="**cosine** matches fragment peaks at equal *m/z*. **modified cosine** also matches library peaks shifted by the precursor *m/z* difference, which finds structural analogues (e.g. with a different modification) within the precursor tolerance.",
                 )
-                self.ui.input_TOPP("MetaboliteSpectralMatcher")
             with t[1]:
                 if "SiriusExport-path" not in st.session_state:
                     possible_paths = (
@@ -461,6 +600,12 @@ class Workflow(WorkflowManager):
                         "predict **sum formulas**",
                         help="Generate input files for SIRIUS from raw data and feature information using the OpenMS TOPP tool *SiriusExport*.",
                     )
+                    self.ui.input_widget(
+                        "sirius-consensus",
+                        False,
+                        "run once per **consensus feature**",
+                        help="Run SIRIUS once on a merged input file with one compound per consensus feature (MS1 and MS2 spectra from the sample with the highest intensity) instead of once per sample. Avoids computing the same metabolite for every sample it was detected in. Results are annotated as sample *consensus*.",
+                    )
                     cols = st.columns(4)
                     with cols[0]:
                         self.ui.input_widget(
@@ -614,6 +759,13 @@ class Workflow(WorkflowManager):
                     help="Generate input files for GNPS feature based molecular networking (FBMN) and ion identity molecular networking (IIMN) from raw data and feature information using the OpenMS TOPP tool *GNPSExport*.",
                 )
                 self.ui.input_TOPP("GNPSExport")
+                self.ui.input_widget(
+                    "molecular-networking",
+                    False,
+                    "compute the molecular network locally",
+                    help="Compute the spectral similarity network (modified cosine) of the consensus features from the exported MS2 spectra. Only spectrum pairs sharing some of their most intense fragments or neutral losses are scored. The network edges are exported as table, the FeatureMatrix is annotated with network components and neighbours.",
+                )
+                self.ui.input_python("molecular_network")
             with t[3]:
                 self.ui.input_widget(
                     "run-ms2query",
@@ -689,14 +841,18 @@ class Workflow(WorkflowManager):
         new["FeatureLinkerUnlabeledKD"]["algorithm:link:mz_tol"] = simple[
             "mz_tolerance"
         ]
+        new["linking-batch-size"] = simple.get("linking-batch-size", 0)
+        new["append-samples"] = simple.get("append-samples", False)
+        new["prune-features"] = simple.get("prune-features", False)
 
         new["sirius-ppm-max"] = simple["mz_tolerance"]
         new["sirius-ppm-max-ms2"] = simple["mz_tolerance"]
 
-        new["MetaboliteSpectralMatcher"]["algorithm:merge_spectra"] = "false"
-
         new["FeatureFinderMetaboIdent"]["extract:mz_window"] = simple["mz_tolerance"]
         new["FeatureFinderMetaboIdent"]["extract:rt_window"] = simple["RT_tolerance"]
+        new["requantify-method"] = simple.get("requantify-method", "FeatureFinderMetaboIdent")
+        new["gap-filling-mz-tolerance"] = simple["mz_tolerance"]
+        new["gap-filling-rt-window"] = simple["RT_tolerance"]
 
         # Adduct detection
         new["MetaboliteAdductDecharger"][
@@ -732,6 +888,12 @@ class Workflow(WorkflowManager):
                 "algorithm:MetaboliteFeatureDeconvolution:charge_max"
             ] = -1
 
+        # Options added after the first releases are translated explicitly, expert parameter
+        # files of older workspaces do not have them
+        new["cluster-ms2"] = simple.get("cluster-ms2", False)
+        new["sirius-consensus"] = simple.get("sirius-consensus", False)
+        new["molecular-networking"] = simple.get("molecular-networking", False)
+
         # SIRIUS logic
         if not simple["run-sirius"] and simple["run-fingerid"]:
             new["run-sirius"] = True
@@ -740,9 +902,12 @@ class Workflow(WorkflowManager):
             new["run-canopus"] = True
 
         # threads for each TOPP tool
+        num_threads = simple.get("num_threads", 1)
         for k, v in new.items():
             if isinstance(v, dict):
-                new[k]["threads"] = simple["num_threads"]
+                new[k]["threads"] = num_threads
+        # threads for python tools
+        new["num_threads"] = num_threads
 
         self.parameter_manager.params_file = Path(
             Path(self.parameter_manager.params_file).parent, "params-translated.json"
@@ -751,6 +916,150 @@ class Workflow(WorkflowManager):
             json.dump(new, f, indent=4)
         return new
 
+    def link_features(self, feature_maps: list, name: str) -> list:
+        """
+        Links feature maps into a consensus map with FeatureLinkerUnlabeledKD.
+
+        With a linking batch size, feature maps are linked in batches of that size in parallel and
+        the batch consensus maps are linked hierarchically (again in batches, until a single map is left).
+        Each linked level is flattened back to one column per sample, so the result has the same layout
+        as a consensus map linked from all feature maps at once.
+
+        Args:
+            feature_maps (list): featureXML files, in sample order.
+            name (str): Name of the resulting consensusXML file.
+
+        Returns:
+            list: The consensusXML file.
+        """
+        consensusXML = self.file_manager.get_files(
+            name, "consensusXML", "feature-linker"
+        )
+        maps = self.file_manager.get_files(feature_maps)
+        batch_size = self.params.get("linking-batch-size", 0)
+        level = 0
+        while batch_size > 1 and len(maps) > batch_size:
+            batches = [maps[i : i + batch_size] for i in range(0, len(maps), batch_size)]
+            if len(batches[-1]) == 1:
+                # linking needs at least two maps, add a single remaining map to the previous batch
+                batches[-2] += batches.pop()
+            if len(batches) == 1:
+                break
+            level += 1
+            self.logger.log(
+                f"Linking {len(maps)} maps in {len(batches)} batches (level {level})."
+            )
+            linked = self.file_manager.get_files(
+                [f"{name}-level{level}-batch{i}" for i in range(len(batches))],
+                "consensusXML",
+                "feature-linker-batches",
+            )
+            self.executor.run_topp(
+                "FeatureLinkerUnlabeledKD", {"in": batches, "out": linked}
+            )
+            if level > 1:
+                self.executor.run_python(
+                    "flatten_consensus_maps", {"in": linked, "batches": batches}
+                )
+            maps = linked
+        self.executor.run_topp(
+            "FeatureLinkerUnlabeledKD", {"in": [maps], "out": consensusXML}
+        )
+        if level > 0:
+            self.executor.run_python(
+                "flatten_consensus_maps", {"in": consensusXML, "batches": [maps]}
+            )
+        return consensusXML
+
+    def append_features(self, feature_maps: list, name: str) -> list:
+        """
+        Links the feature maps of new samples into an existing consensus map (in place). Each new
+        sample is converted to a single sample consensus map, these are linked together with the
+        existing consensus map and the result is flattened back to one column per sample.
+
+        Args:
+            feature_maps (list): featureXML files of the new samples.
+            name (str): Name of the existing consensusXML file.
+
+        Returns:
+            list: The consensusXML file.
+        """
+        consensusXML = self.file_manager.get_files(
+            name, "consensusXML", "feature-linker"
+        )
+        previous = self.file_manager.get_files(
+            name + "-previous", "consensusXML", "feature-linker"
+        )
+        shutil.copy(consensusXML[0], previous[0])
+        samples = self.file_manager.get_files(
+            feature_maps, "consensusXML", "feature-linker-samples"
+        )
+        self.executor.run_python(
+            "feature_maps_to_consensus", {"in": feature_maps, "out": samples}
+        )
+        self.executor.run_topp(
+            "FeatureLinkerUnlabeledKD", {"in": [previous + samples], "out": consensusXML}
+        )
+        self.executor.run_python(
+            "flatten_consensus_maps",
+            {"in": consensusXML, "batches": [previous + samples]},
+        )
+        return consensusXML
+
+    def topp_parameter(self, tool: str, key: str, default):
+        """
+        Effective value of a TOPP tool parameter: the configured (non-default) value, a custom
+        default of the workflow or the tool default (from the cached parameter schema).
+        """
+        if key in self.params.get(tool, {}):
+            return self.params[tool][key]
+        value = self.parameter_manager.get_topp_defaults(tool).get(key, default)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def ms2_files(self, mzML: list) -> list:
+        """
+        mzML files with the MS2 spectra for annotation: MS2 only files with corrected precursors
+        if precursor correction is enabled, otherwise the input mzML files.
+        """
+        if self.params["correct-precursor"]:
+            return self.file_manager.get_files(mzML, "mzML", "mzML-ms2")
+        return mzML
+
+    def feature_maps_raw_rt(self, feature_maps: list) -> list:
+        """
+        Copies of feature maps with retention times transformed back to the raw data (inverted map
+        alignment transformation), to match features with the spectra of the mzML files.
+
+        Args:
+            feature_maps (list): featureXML files (aligned).
+
+        Returns:
+            list: The featureXML files at raw data retention times.
+        """
+        if not self.params["map-alignement"]:
+            return feature_maps
+        raw_rt = self.file_manager.get_files(
+            feature_maps, "featureXML", "feature-maps-raw-rt"
+        )
+        self.executor.run_topp(
+            "MapRTTransformer",
+            {
+                "in": feature_maps,
+                "out": raw_rt,
+                "trafo_in": self.file_manager.get_files(
+                    feature_maps, "trafoXML", "trafos"
+                ),
+            },
+            custom_params={"invert": ""},
+        )
+        return raw_rt
+
+    def keep_results(self) -> bool:
+        # Results are kept to append new samples, if there is a consensus map to append to
+        return self.params.get("append-samples", False) and Path(
+            self.workflow_dir, "results", "feature-linker", "feature-matrix-ffm.consensusXML"
+        ).exists()
+
     def execution(self) -> None:
         # Check if run in expert mode, if not paramters need to be formatted to be compatible with this framework.
         if self.expert_mode:
@@ -769,6 +1078,12 @@ class Workflow(WorkflowManager):
             # Filter the DataFrame for files where "use in workflow" is True
             selected_files = df[df["use in workflows"] == True]["file name"].tolist()
 
+            # Sample names (feature matrix columns) of the selected blanks and QC samples
+            selected = df[df["use in workflows"] == True]
+            sample_type = selected.get("sample type", pd.Series("sample", index=selected.index))
+            blanks = selected["file name"][sample_type == "blank"].map(strip_compression_suffix).tolist()
+            qcs = selected["file name"][sample_type == "QC"].map(strip_compression_suffix).tolist()
+
             # Construct full file paths
             mzML = [
                 str(Path(self.workflow_dir, '..', "mzML-files", file_name))
@@ -788,29 +1103,75 @@ class Workflow(WorkflowManager):
         self.logger.log(f"Number of input mzML files: {len(mzML)}")
         self.logger.log(f"mzML files: {[Path(p).name for p in mzML]}")
 
+        # Append mode: only new samples are processed and added to the previous results,
+        # mzML_new are the files to process, mzML (and ffm) always refer to all samples
+        append = self.keep_results()
+        mzML_new = mzML
+        if append:
+            ffm_previous = [
+                str(p)
+                for p in Path(self.workflow_dir, "results", "ffm-featureXML").glob(
+                    "*.featureXML"
+                )
+            ]
+            ffm = self.file_manager.get_files(mzML, "featureXML", "ffm-featureXML")
+            previous = [Path(f).name for f in ffm_previous]
+            mzML_new = [m for m, f in zip(mzML, ffm) if Path(f).name not in previous]
+            if len(ffm) - len(mzML_new) < len(ffm_previous):
+                self.logger.log(
+                    "WARNING: Samples of the previous results are not selected anymore. Running the workflow for all samples."
+                )
+                shutil.rmtree(Path(self.workflow_dir, "results"))
+                Path(self.workflow_dir, "results").mkdir()
+                append = False
+                mzML_new = mzML
+            elif not mzML_new:
+                self.logger.log("No new samples to append to the previous results.")
+                return
+            else:
+                self.logger.log(
+                    f"Appending new samples to the previous results: {[Path(p).name for p in mzML_new]}"
+                )
+
         # Precursor m/z correction to highest intensity MS1 peak
+        # (the mzML files are not re-written: corrections are stored as tables, corrected MS2 spectra in MS2 only files)
         if self.params["correct-precursor"]:
             self.logger.log("Correcting precursor m/z to highest intensity MS1 peak.")
-            mzML_pmc = self.file_manager.get_files(mzML, "mzML", "mzML-pmc")
-            self.executor.run_topp(
-                "HighResPrecursorMassCorrector",
-                {"in": mzML, "out": mzML_pmc},
+            self.executor.run_python(
+                "correct_precursors",
+                {
+                    "in": mzML_new,
+                    "out_csv": self.file_manager.get_files(
+                        mzML_new, "tsv", "precursor-corrections"
+                    ),
+                    "out": self.file_manager.get_files(mzML_new, "mzML", "mzML-ms2"),
+                    "mz_tolerance": self.topp_parameter(
+                        "HighResPrecursorMassCorrector",
+                        "highest_intensity_peak:mz_tolerance",
+                        0.0,
+                    ),
+                    "mz_tolerance_unit": self.topp_parameter(
+                        "HighResPrecursorMassCorrector",
+                        "highest_intensity_peak:mz_tolerance_unit",
+                        "ppm",
+                    ),
+                },
             )
-            mzML = mzML_pmc
 
         # Feature Detection
         self.logger.log("Detecting features.")
-        ffm = self.file_manager.get_files(mzML, "featureXML", "ffm-featureXML")
+        ffm_new = self.file_manager.get_files(mzML_new, "featureXML", "ffm-featureXML")
         self.executor.run_topp(
             "FeatureFinderMetabo",
             input_output={
-                "in": mzML,
-                "out": ffm,
+                "in": mzML_new,
+                "out": ffm_new,
                 "out_chrom": self.file_manager.get_files(
-                    mzML, set_results_dir="ffm-chroms"
+                    mzML_new, "mzML", "ffm-chroms"
                 ),
             },
         )
+        ffm = self.file_manager.get_files(mzML, "featureXML", "ffm-featureXML")
 
         # Adduct Detection
         if self.params["adduct-detection"]:
@@ -818,47 +1179,56 @@ class Workflow(WorkflowManager):
             # Run MetaboliteAdductDecharger for adduct detection, with disabled logs.
             self.executor.run_topp(
                 "MetaboliteAdductDecharger",
-                {"in": ffm, "out_fm": ffm},
+                {"in": ffm_new, "out_fm": ffm_new},
             )
 
         # Map Alignement
         if self.params["map-alignement"]:
             self.logger.log("Aligning feature maps.")
-            trafos = self.file_manager.get_files(
-                ffm, "trafoXML", "trafos", collect=True
+            trafos_new = self.file_manager.get_files(
+                ffm_new, "trafoXML", "trafos", collect=True
+            )
+            # New samples are aligned to the previous samples (already aligned), using the largest feature map as reference
+            reference = (
+                {"reference:file": max(ffm_previous, key=lambda f: Path(f).stat().st_size)}
+                if append
+                else {}
             )
             # Run MapAlignerPoseClustering for map alignement, with disabled logs.
             self.executor.run_topp(
                 "MapAlignerPoseClustering",
                 {
-                    "in": self.file_manager.get_files(ffm, collect=True),
-                    "out": self.file_manager.get_files(ffm, collect=True),
-                    "trafo_out": trafos,
-                },
-            )
-            self.logger.log("Transforming mzML files based on map alignement.")
-            # Transform mzML files
-            self.executor.run_topp(
-                "MapRTTransformer",
-                {
-                    "in": mzML,
-                    "out": mzML,
-                    "trafo_in": self.file_manager.get_files(trafos),
+                    "in": self.file_manager.get_files(ffm_new, collect=True),
+                    "out": self.file_manager.get_files(ffm_new, collect=True),
+                    "trafo_out": trafos_new,
                 },
+                custom_params=reference,
             )
 
+        # RT transformations are applied by the consumers of the (not transformed) mzML files
+        trafos = (
+            self.file_manager.get_files(mzML, "trafoXML", "trafos")
+            if self.params["map-alignement"]
+            else []
+        )
+
         # Export FFM feature maps to dataframes (including chromatograms)
-        self.executor.run_python("export_ffm_df", {"in": ffm})
+        self.executor.run_python(
+            "export_ffm_df",
+            {
+                "in": ffm_new,
+                "trafo": self.file_manager.get_files(ffm_new, "trafoXML", "trafos")
+                if trafos
+                else [],
+            },
+        )
 
         # Feature Linking and Export to pd.DataFrame
         self.logger.log("Linking features.")
-        consensusXML = self.file_manager.get_files(
-            "feature-matrix-ffm", "consensusXML", "feature-linker"
-        )
-        self.executor.run_topp(
-            "FeatureLinkerUnlabeledKD",
-            {"in": self.file_manager.get_files(ffm, collect=True), "out": consensusXML},
-        )
+        if append:
+            consensusXML = self.append_features(ffm_new, "feature-matrix-ffm")
+        else:
+            consensusXML = self.link_features(ffm, "feature-matrix-ffm")
 
         # Export to DataFrame
         consensus_df = self.file_manager.get_files(
@@ -869,73 +1239,104 @@ class Workflow(WorkflowManager):
             "export_consensus_df", {"in": consensusXML, "out": consensus_df}
         )
 
-        # Requantify features with missing values
-        if self.params["requantify"]:
-            self.logger.log("Re-quantifying features with missing values.")
-            # Prepare library
-            ffmid_library = self.file_manager.get_files(
-                "library", "tsv", "ffmid-library"
-            )
-            consensus_df_ffm_complete = self.file_manager.get_files(
-                "consensus-df-ffm-complete", "parquet", "consensus-dfs"
+        # Remove background and irreproducible features, so no downstream step processes them
+        if self.params.get("prune-features", False):
+            self.logger.log("Pruning features by blanks, detection frequency and QC CV.")
+            # re-quantification re-creates the feature maps from the pruned feature matrix
+            ffm_pruned = (
+                []
+                if self.params["requantify"]
+                else self.file_manager.get_files(ffm, "featureXML", "ffm-pruned")
             )
             self.executor.run_python(
-                "generate_FFMID_library",
+                "prune_features",
                 {
                     "in": consensus_df,
-                    "out": ffmid_library,
-                    "out_ffm": consensus_df_ffm_complete,
+                    "in_fm": ffm if ffm_pruned else [],
+                    "out_fm": ffm_pruned,
+                    "out": self.file_manager.get_files(
+                        "pruned-features", "parquet", "pruned-features"
+                    ),
+                    "blanks": blanks,
+                    "qcs": qcs,
+                    "num_threads": self.params.get("num_threads", 1),
                 },
             )
+            if ffm_pruned:
+                ffm = ffm_pruned
+                ffm_new = self.file_manager.get_files(ffm_new, "featureXML", "ffm-pruned")
 
-            # Run FeatureFinderMetaboIdent
-            ffmid = self.file_manager.get_files(mzML, "featureXML", "ffmid-featureXML")
-            self.executor.run_topp(
-                "FeatureFinderMetaboIdent",
-                {"in": mzML, "out": ffmid, "id": ffmid_library},
-            )
-
-            # Perform Adduct detection on re-quantified features
-            if self.params["adduct-detection"]:
-                self.logger.log("Detecting adducts for re-quantified features.")
-                # Run MetaboliteAdductDecharger for adduct detection.
-                self.executor.run_topp(
-                    "MetaboliteAdductDecharger",
-                    {"in": ffmid, "out_fm": ffmid},
+        # Requantify features with missing values
+        if self.params["requantify"]:
+            self.logger.log("Re-quantifying features with missing values.")
+            if self.params.get("requantify-method") == "MS1 gap filling":
+                # Integrate missing features from the (RT aligned) MS1 data directly
+                self.executor.run_python(
+                    "gap_filling",
+                    {
+                        "in": consensus_df,
+                        "in_mzML": mzML,
+                        "trafo": trafos,
+                        "mz-tolerance": self.params.get("gap-filling-mz-tolerance", 10.0),
+                        "rt-window": self.params.get("gap-filling-rt-window", 30.0),
+                        "num_threads": self.params.get("num_threads", 1),
+                    },
                 )
+            else:
+                # Prepare one library per sample with the consensus features missing in that sample
+                ffmid_library = self.file_manager.get_files(mzML, "tsv", "ffmid-library")
+                self.executor.run_python(
+                    "generate_FFMID_library",
+                    {"in": consensus_df, "out": ffmid_library, "trafo": trafos},
+                )
+                # Samples without missing values (or already re-quantified in a previous run) have no library
+                mzML_requantify = [
+                    m for m, library in zip(mzML, ffmid_library) if Path(library).exists()
+                ]
+                if mzML_requantify:
+                    ffmid_library = [f for f in ffmid_library if Path(f).exists()]
+                    ffmid_new = self.file_manager.get_files(
+                        mzML_requantify, "featureXML", "ffmid-featureXML-new"
+                    )
+                    # Run FeatureFinderMetaboIdent (library RTs are transformed to the raw data)
+                    self.executor.run_topp(
+                        "FeatureFinderMetaboIdent",
+                        {"in": mzML_requantify, "out": ffmid_new, "id": ffmid_library},
+                    )
+                    if trafos:
+                        self.executor.run_topp(
+                            "MapRTTransformer",
+                            {
+                                "in": ffmid_new,
+                                "out": ffmid_new,
+                                "trafo_in": self.file_manager.get_files(
+                                    ffmid_new, "trafoXML", "trafos"
+                                ),
+                            },
+                        )
 
-            # Export re-quantified feature maps to dataframes (including chromatograms)
-            self.executor.run_python("export_ffmid_df", {"in": ffmid})
+                    # Perform Adduct detection on re-quantified features
+                    if self.params["adduct-detection"]:
+                        self.logger.log("Detecting adducts for re-quantified features.")
+                        # Run MetaboliteAdductDecharger for adduct detection.
+                        self.executor.run_topp(
+                            "MetaboliteAdductDecharger",
+                            {"in": ffmid_new, "out_fm": ffmid_new},
+                        )
 
-            # Link re-quantified features
-            consensusXML_ffmid = self.file_manager.get_files(
-                "feature-matrix-ffmid", "consensusXML", "feature-linker"
-            )
-            self.executor.run_topp(
-                "FeatureLinkerUnlabeledKD",
-                {
-                    "in": self.file_manager.get_files(ffmid, collect=True),
-                    "out": consensusXML_ffmid,
-                },
-            )
+                    # Add to the re-quantified features of previous runs (append mode)
+                    ffmid = self.file_manager.get_files(
+                        mzML_requantify, "featureXML", "ffmid-featureXML"
+                    )
+                    self.executor.run_python(
+                        "merge_feature_maps", {"in": ffmid, "in_add": ffmid_new}
+                    )
 
-            # Export to DataFrame
-            consensus_df_ffmid = self.file_manager.get_files(
-                "feature-matrix-ffmid", "parquet", "consensus-dfs"
-            )
-            self.executor.run_python(
-                "export_consensus_df",
-                {"in": consensusXML_ffmid, "out": consensus_df_ffmid},
-            )
+                    # Export re-quantified feature maps to dataframes (including chromatograms)
+                    self.executor.run_python("export_ffmid_df", {"in": ffmid})
 
-            # Merge consensus_df and consensus_df_ffmid
-            self.executor.run_python(
-                "merge_consensus_df",
-                {
-                    "in": [consensus_df_ffm_complete, consensus_df_ffmid],
-                    "out": consensus_df,
-                },
-            )
+            # Fill missing values with the re-quantified features (labeled with their consensus feature ID)
+            self.executor.run_python("merge_consensus_df", {"in": consensus_df})
 
             # Merge feature maps from FFM and FFMID from merged consensus table
             self.executor.run_python(
@@ -948,7 +1349,10 @@ class Workflow(WorkflowManager):
             # Re-create feature maps from consensus df
             self.executor.run_python(
                 "recreate_feature_maps",
-                {"in": str(Path(self.file_manager.workflow_dir, "results"))},
+                {
+                    "in": str(Path(self.file_manager.workflow_dir, "results")),
+                    "num_threads": self.params.get("num_threads", 1),
+                },
             )
 
             # Ensure mzML and featureXML file paths are ordered the same for SiriusExport and GNPSExport
@@ -987,8 +1391,8 @@ class Workflow(WorkflowManager):
             self.executor.run_topp(
                 "SiriusExport",
                 {
-                    "in": mzML,
-                    "in_featureinfo": ffm,
+                    "in": self.ms2_files(mzML),
+                    "in_featureinfo": self.feature_maps_raw_rt(ffm),
                     "out": sirius_ms_files,
                 },
             )
@@ -1002,15 +1406,44 @@ class Workflow(WorkflowManager):
                         f"--password={self.params['sirius-user-password']}",
                     ]
                 )
-                sirius_projects = [
-                    Path(
-                        self.workflow_dir, "results", "sirius-projects", Path(file).stem
+                if self.params.get("sirius-consensus", False):
+                    # One compound per consensus feature, consensus features of previous runs are kept in append mode
+                    consensus_dir = Path(self.workflow_dir, "results", "sirius-consensus")
+                    consensus_projects_dir = Path(
+                        self.workflow_dir, "results", "sirius-projects-consensus"
                     )
-                    for file in sirius_ms_files
-                ]
+                    previous = sorted(
+                        str(p)
+                        for p in consensus_dir.glob("*.ms")
+                        if Path(consensus_projects_dir, p.stem).exists()
+                    )
+                    consensus_ms = [
+                        str(Path(consensus_dir, f"consensus-{len(previous) + 1}.ms"))
+                    ]
+                    self.executor.run_python(
+                        "export_sirius_consensus",
+                        {
+                            "in": consensus_df,
+                            "in_ms": sirius_ms_files,
+                            "skip": previous,
+                            "out": consensus_ms,
+                        },
+                    )
+                    sirius_ms_files = consensus_ms
+                    sirius_projects = [
+                        Path(consensus_projects_dir, Path(consensus_ms[0]).stem)
+                    ]
+                else:
+                    sirius_projects = [
+                        Path(
+                            self.workflow_dir, "results", "sirius-projects", Path(file).stem
+                        )
+                        for file in sirius_ms_files
+                    ]
                 commands = []
                 for ms, project in zip(sirius_ms_files, sirius_projects):
-                    if Path(ms).stat().st_size > 0:
+                    # projects of previous samples are kept in append mode
+                    if Path(ms).stat().st_size > 0 and not project.exists():
                         project.mkdir(parents=True)
                         command = [
                             st.session_state["sirius-path"],
@@ -1059,49 +1492,76 @@ class Workflow(WorkflowManager):
                 else:
                     self.logger.log("No MS2 data for SIRIUS to process.")
 
-        if (
-            self.params["export-gnps"]
-            or self.params["annotate-ms2"]
+        ms2_annotation = (
+            self.params["annotate-ms2"]
             or self.params["run-ms2query"]
-        ):
-            self.logger.log("Exporting input files for GNPS.")
-            # Map MS2 specs to features
-            self.executor.run_topp(
-                "IDMapper",
+            or self.params.get("molecular-networking", False)
+        )
+        if self.params["export-gnps"] or ms2_annotation:
+            # Map MS2 specs to features, previous feature maps have been mapped already unless they were re-created
+            if append and not self.params["requantify"]:
+                ffm_ms2, mzML_ms2 = ffm_new, mzML_new
+            else:
+                ffm_ms2, mzML_ms2 = ffm, mzML
+            self.executor.run_python(
+                "map_ms2_spectra",
                 {
-                    "in": ffm,
-                    "spectra:in": mzML,
-                    "out": ffm,
-                    "id": self.file_manager.get_files(
-                        str(Path("assets", "empty.idXML"))
-                    ),
+                    "in": ffm_ms2,
+                    "in_mzML": self.ms2_files(mzML_ms2),
+                    "in_precursors": self.file_manager.get_files(
+                        mzML_ms2, "tsv", "precursor-corrections"
+                    )
+                    if self.params["correct-precursor"]
+                    else [],
+                    "trafo": self.file_manager.get_files(mzML_ms2, "trafoXML", "trafos")
+                    if trafos
+                    else [],
+                    "out": self.file_manager.get_files(ffm_ms2, "parquet", "ms2-mapping"),
+                    "num_threads": self.params.get("num_threads", 1),
                 },
             )
-            # Link features with MS2 info
+            if self.params.get("cluster-ms2", False):
+                # One consensus spectrum per cluster of similar MS2 spectra for all MS2 annotations
+                self.logger.log("Clustering MS2 spectra.")
+                ms2_mgf = self.file_manager.get_files("MS2", "mgf", "ms2-clusters")
+                ms2_clusters = self.file_manager.get_files(
+                    "MS2-clusters", "parquet", "ms2-cluster-membership"
+                )
+                self.executor.run_python(
+                    "cluster_ms2_spectra",
+                    {
+                        "in": consensus_df,
+                        "in_mapping": self.file_manager.get_files(
+                            ffm, "parquet", "ms2-mapping"
+                        ),
+                        "in_mzML": self.ms2_files(mzML),
+                        "out": ms2_mgf,
+                        "out_membership": ms2_clusters,
+                        "num_threads": self.params.get("num_threads", 1),
+                    },
+                )
+            else:
+                ms2_mgf = self.file_manager.get_files("MS2", "mgf", "gnps-export")
+                ms2_clusters = []
+
+        # MS2 annotations use the GNPS export unless MS2 spectra are clustered
+        if self.params["export-gnps"] or (
+            ms2_annotation and not self.params.get("cluster-ms2", False)
+        ):
+            self.logger.log("Exporting input files for GNPS.")
+            # Consensus features with MS2 info from the feature matrix (no re-linking)
             gnps_consensus = self.file_manager.get_files(
                 "feature-matrix-gnps", "consensusXML", "feature-linker"
             )
-            self.executor.run_topp(
-                "FeatureLinkerUnlabeledKD",
-                {
-                    "in": self.file_manager.get_files(ffm, collect=True),
-                    "out": gnps_consensus,
-                },
-            )
-
-            # Filter consensus features which have missing values
-            self.executor.run_topp(
-                "FileFilter",
-                {"in": gnps_consensus, "out": gnps_consensus},
-                custom_params={"id:remove_unannotated_features": ""},
-            )
-
-            # Export to dataframe
             self.executor.run_python(
-                "export_consensus_df",
+                "export_gnps_consensus",
                 {
-                    "in": gnps_consensus,
-                    "out": self.file_manager.get_files(
+                    "in": consensus_df,
+                    "in_cm": consensusXML,
+                    "in_fm": ffm,
+                    "in_ms2": self.file_manager.get_files(ffm, "parquet", "ms2-mapping"),
+                    "out": gnps_consensus,
+                    "out_df": self.file_manager.get_files(
                         "feature-matrix-gnps", "parquet", "consensus-dfs"
                     ),
                 },
@@ -1112,7 +1572,9 @@ class Workflow(WorkflowManager):
                 "GNPSExport",
                 {
                     "in_cm": gnps_consensus,
-                    "in_mzml": self.file_manager.get_files(mzML, collect=True),
+                    "in_mzml": self.file_manager.get_files(
+                        self.ms2_files(mzML), collect=True
+                    ),
                     "out": self.file_manager.get_files("MS2", "mgf", "gnps-export"),
                     "out_quantification": self.file_manager.get_files(
                         "feature-quantification", "txt", "gnps-export"
@@ -1126,56 +1588,58 @@ class Workflow(WorkflowManager):
                 },
             )
 
+        if self.params.get("molecular-networking", False):
+            self.logger.log("Computing the molecular network.")
+            self.executor.run_python(
+                "molecular_network",
+                {
+                    "in_mgf": ms2_mgf,
+                    "in_clusters": ms2_clusters,
+                    "out": consensus_df,
+                    "out_edges": self.file_manager.get_files(
+                        "edges", "parquet", "molecular-network"
+                    ),
+                    "num_threads": self.params.get("num_threads", 1),
+                },
+            )
+
         if self.params["annotate-ms2"]:
             dir_path = Path(self.workflow_dir, "input-files", "ms2-library")
             if dir_path.exists():
-                dir_path = Path(self.workflow_dir, "input-files", "ms2-library")
-                if dir_path.exists():
-                    files = [p for p in dir_path.iterdir()]
-                    if files:
-                        self.logger.log("Annotating consensus features on MS2 level.")
-                        self.executor.run_topp(
-                            "FileConverter",
-                            {
-                                "in": self.file_manager.get_files(
-                                    "MS2", "mgf", "gnps-export"
-                                ),
-                                "out": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                            },
-                        )
-                        self.executor.run_topp(
-                            "MetaboliteSpectralMatcher",
-                            {
-                                "in": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                                "database": self.file_manager.get_files(str(files[0])),
-                                "out": self.file_manager.get_files(
-                                    "MS2-matches", "mzTab", "spectral-matcher"
-                                ),
-                            },
-                            custom_params={"algorithm:merge_spectra": "false"},
-                        )
-                        self.executor.run_python(
-                            "annotate-ms2",
-                            {
-                                "in_mzTab": self.file_manager.get_files(
-                                    "MS2-matches", "mzTab", "spectral-matcher"
-                                ),
-                                "in_mzML": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                                "in_mgf": self.file_manager.get_files(
-                                    "MS2", "mgf", "gnps-export"
-                                ),
-                                "in_gnps_consensus": self.file_manager.get_files(
-                                    "feature-matrix-gnps", "parquet", "consensus-dfs"
-                                ),
-                                "out": consensus_df,
-                            },
-                        )
+                libraries = sorted(str(p) for p in dir_path.iterdir())
+                if libraries:
+                    self.logger.log("Annotating consensus features on MS2 level.")
+                    # libraries are indexed once, cached by content in the workspace for all workflows
+                    self.executor.run_python(
+                        "match_ms2_library",
+                        {
+                            "in_mgf": ms2_mgf,
+                            "in_clusters": ms2_clusters,
+                            "in_lib": libraries,
+                            "cache": str(
+                                Path(self.workflow_dir).parent / "ms2-library-index"
+                            ),
+                            "out": consensus_df,
+                            "prec_mass_error_value": self.topp_parameter(
+                                "MetaboliteSpectralMatcher",
+                                "algorithm:prec_mass_error_value",
+                                100.0,
+                            ),
+                            "frag_mass_error_value": self.topp_parameter(
+                                "MetaboliteSpectralMatcher",
+                                "algorithm:frag_mass_error_value",
+                                500.0,
+                            ),
+                            "mass_error_unit": self.topp_parameter(
+                                "MetaboliteSpectralMatcher", "algorithm:mass_error_unit", "ppm"
+                            ),
+                            "report_mode": self.topp_parameter(
+                                "MetaboliteSpectralMatcher", "algorithm:report_mode", "top3"
+                            ),
+                            "score": self.params.get("ms2-matching-score", "cosine"),
+                            "num_threads": self.params.get("num_threads", 1),
+                        },
+                    )
 
         if st.session_state["sirius-path"]:
             self.executor.run_python("annotate-sirius", {"in": consensus_df})
@@ -1188,7 +1652,8 @@ class Workflow(WorkflowManager):
                 "run_ms2query",
                 {
                     "in": consensus_df,
-                    "in_mgf": self.file_manager.get_files("MS2", "mgf", "gnps-export"),
+                    "in_mgf": ms2_mgf,
+                    "in_clusters": ms2_clusters,
                     "out_ms2query_csv": self.file_manager.get_files(
                         "MS2", "csv", "ms2query"
                     ),
@@ -1196,8 +1661,8 @@ class Workflow(WorkflowManager):
                 },
             )
 
-        # ZIP all relevant files for Download
-        self.executor.run_python("zip-result-files", {"in": consensus_df})
+        # Precompute plot and table data for the results page
+        self.executor.run_python("export_results_bundle", {"in": consensus_df})
 
     def results(self) -> None:
         # Set current results directory
@@ -1252,14 +1717,21 @@ class Workflow(WorkflowManager):
                 ms2query_summary(ms2query)
 
         # Chromatograms and Intensities
-        chrom_data = get_chroms_for_each_sample(metabolite)
-        chrom_fig = get_feature_chromatogram_plot(chrom_data)
-        auc_fig = get_feature_intensity_plot(metabolite)
+        key = metabolite_key(metabolite)
+        chrom_data = get_chroms_for_each_sample(metabolite, key=key)
+        rt_range = selected_x_range(f"chromatograms-selection-{metabolite.name}")
+        chrom_fig = get_feature_chromatogram_plot(chrom_data, rt_range, key=key + (rt_range,))
+        auc_fig = get_feature_intensity_plot(metabolite, key=key)
 
         c1, c2 = st.columns(2)
         with c1:
             with st.expander(f"**📈 Chromatograms**", expanded=True):
-                show_fig(chrom_fig, f"chromatograms_{metabolite.name}")
+                show_fig(
+                    chrom_fig,
+                    f"chromatograms_{metabolite.name}",
+                    True,
+                    f"chromatograms-selection-{metabolite.name}",
+                )
 
         with c2:
             with st.expander(f"**📊 Intensities**", expanded=True):
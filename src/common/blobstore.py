@@ -0,0 +1,176 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Union
+
+# Name of the content-addressed store directory within the workspaces directory
+STORE_DIR_NAME = ".mzML-store"
+
+# Read files in chunks of 8 MB when hashing or copying
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Temporary files older than one day are left overs from interrupted writes
+TMP_MAX_AGE = 86400
+
+
+def get_store_dir(workspaces_dir: Union[str, Path]) -> Path:
+    """
+    Returns the content-addressed blob store shared by all workspaces and makes sure it exists.
+
+    Args:
+        workspaces_dir (Union[str, Path]): Directory containing all workspaces.
+
+    Returns:
+        Path: The blob store directory.
+    """
+    store_dir = Path(workspaces_dir, STORE_DIR_NAME)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    return store_dir
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """
+    Calculates the SHA-256 hex digest of a file, reading it in chunks.
+
+    Args:
+        path (Union[str, Path]): Path to the file.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _blob_path(store_dir: Path, digest: str, suffix: str) -> Path:
+    return Path(store_dir, digest + suffix)
+
+
+def _link_or_copy(blob: Path, dest: Path) -> None:
+    """
+    Hard links the blob to dest. Falls back to a copy if hard links are not supported.
+    Raises FileNotFoundError if the blob does not exist (anymore).
+    """
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(blob, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy(blob, dest)
+
+
+def add_file(
+    path: Union[str, Path],
+    dest: Union[str, Path],
+    store_dir: Union[str, Path],
+    move: bool = False,
+) -> Path:
+    """
+    Adds a file to the blob store (if its content is not stored yet) and creates a
+    reference to it at dest. References are hard links, so the link count of a blob
+    equals the number of workspace files referencing it plus one.
+
+    Args:
+        path (Union[str, Path]): File to add.
+        dest (Union[str, Path]): Path of the reference in the workspace.
+        store_dir (Union[str, Path]): The blob store directory.
+        move (bool): Move instead of copy the file into the store (for temporary files on the same file system). Default is False.
+
+    Returns:
+        Path: Path of the blob in the store.
+    """
+    path, dest, store_dir = Path(path), Path(dest), Path(store_dir)
+    blob = _blob_path(store_dir, file_hash(path), path.suffix)
+    while True:
+        if not blob.exists():
+            # Copy to a temporary file first, so concurrent readers never see a partial blob
+            fd, tmp = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+            os.close(fd)
+            if move:
+                # hard link, the file is removed once the reference exists
+                _link_or_copy(path, Path(tmp))
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, blob)
+        try:
+            _link_or_copy(blob, dest)
+            break
+        except FileNotFoundError:
+            # removed by remove_unreferenced after the check, stored again
+            if blob.exists():
+                raise
+    if move:
+        path.unlink()
+    return blob
+
+
+def add_buffer(
+    buffer: Union[bytes, memoryview],
+    dest: Union[str, Path],
+    store_dir: Union[str, Path],
+) -> Path:
+    """
+    Adds an in-memory file (e.g. from an upload widget) to the blob store and creates
+    a reference to it at dest.
+
+    Args:
+        buffer (Union[bytes, memoryview]): File content.
+        dest (Union[str, Path]): Path of the reference in the workspace.
+        store_dir (Union[str, Path]): The blob store directory.
+
+    Returns:
+        Path: Path of the blob in the store.
+    """
+    dest, store_dir = Path(dest), Path(store_dir)
+    blob = _blob_path(
+        store_dir, hashlib.sha256(buffer).hexdigest(), dest.suffix
+    )
+    while True:
+        if not blob.exists():
+            fd, tmp = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(buffer)
+            os.replace(tmp, blob)
+        try:
+            _link_or_copy(blob, dest)
+            break
+        except FileNotFoundError:
+            # removed by remove_unreferenced after the check, stored again
+            if blob.exists():
+                raise
+    return blob
+
+
+def remove_unreferenced(store_dir: Union[str, Path]) -> list[Path]:
+    """
+    Deletes all blobs which are not referenced by any workspace anymore (link count of one)
+    as well as left over temporary files from interrupted writes.
+
+    Args:
+        store_dir (Union[str, Path]): The blob store directory.
+
+    Returns:
+        list[Path]: The removed blobs.
+    """
+    removed = []
+    store_dir = Path(store_dir)
+    if not store_dir.exists():
+        return removed
+    for blob in store_dir.iterdir():
+        if not blob.is_file():
+            continue
+        if blob.suffix == ".tmp":
+            if time.time() - blob.stat().st_mtime > TMP_MAX_AGE:
+                blob.unlink()
+            continue
+        if blob.stat().st_nlink <= 1:
+            blob.unlink()
+            removed.append(blob)
+    return removed
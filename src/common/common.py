@@ -19,6 +19,9 @@ except ImportError:
     TK_AVAILABLE = False
 
 from src.common.captcha_ import captcha_control
+from src.common.resultcache import cache_result, configure_result_cache
+from src.common.tablewindow import is_scalar_column, row_positions, table_window
+from src.common.zipstream import is_up_to_date, write_zip
 
 # Detect system platform
 OS_PLATFORM = sys.platform
@@ -184,9 +187,6 @@ def page_setup(page: str = "") -> dict[str, Any]:
         ("workspace" in st.query_params)
         and (st.query_params.workspace != st.session_state.workspace.name)
     ):
-        # Clear any previous caches
-        st.cache_data.clear()
-        st.cache_resource.clear()
         # Check location
         if not st.session_state.settings["online_deployment"]:
             st.session_state.location = "local"
@@ -220,6 +220,13 @@ def page_setup(page: str = "") -> dict[str, Any]:
     st.session_state.workspace.mkdir(parents=True, exist_ok=True)
     Path(st.session_state.workspace, "mzML-files").mkdir(parents=True, exist_ok=True)
 
+    # Result views are cached by result file and modification time for all sessions,
+    # nothing needs to be cleared when the workspace changes
+    configure_result_cache(
+        st.session_state.settings.get("result-cache", {}),
+        Path(st.session_state.workspace.parent, ".result-cache"),
+    )
+
     # Render the sidebar
     params = render_sidebar(page)
     
@@ -265,7 +272,9 @@ def render_sidebar(page: str = "") -> None:
 
                 # Get all available workspaces as options
                 options = [
-                    file.name for file in workspaces_dir.iterdir() if file.is_dir()
+                    file.name
+                    for file in workspaces_dir.iterdir()
+                    if file.is_dir() and not file.name.startswith(".")
                 ]
                 # Let user chose an already existing workspace
                 st.selectbox(
@@ -376,6 +385,163 @@ def display_large_dataframe(
     return base_index + rows[0]
 
 
+@cache_result
+def _cached_row_positions(table, search, search_columns, sort_by, descending):
+    return row_positions(table, search, search_columns, sort_by, descending)
+
+
+def display_paginated_table(
+    table,
+    key: str,
+    columns: list[str],
+    cache_key: tuple = None,
+    search_columns: list[str] = None,
+    page_sizes: list[int] = [100, 1_000, 10_000],
+    **kwargs,
+):
+    """
+    Displays a large Arrow table page by page with search, sorting and row selection.
+    The table stays on the server: search and sorting are computed on the Arrow columns
+    and only the visible rows of the requested columns are sent to the browser.
+
+    Args:
+        table: The pyarrow Table to display.
+        key: Unique key of the widgets.
+        columns: Columns to display (in this order), columns not in the table are skipped.
+        cache_key: Result cache key of the table (e.g. from file_key), caches search and sort results.
+        search_columns: Columns to search. Defaults to all scalar columns of columns.
+        page_sizes: A list of page sizes to choose from.
+        ...: Additional keyword arguments to pass to the `st.dataframe` function. See: https://docs.streamlit.io/develop/api-reference/data/st.dataframe
+
+    Returns:
+        Position (in table) of selected row.
+    """
+    # optional columns (e.g. adduct without adduct detection) are not shown
+    columns = [c for c in columns if c in table.schema.names]
+    sortable = [c for c in columns if is_scalar_column(table.schema.field(c))]
+    if search_columns is None:
+        search_columns = sortable
+    else:
+        search_columns = [c for c in search_columns if c in table.schema.names]
+    c1, c2, c3, c4 = st.columns([0.4, 0.25, 0.15, 0.2])
+    search = c1.text_input("Search", key=f"{key}-search", placeholder="🔎 text in any column")
+    sort_by = c2.selectbox(
+        "Sort by",
+        [None] + sortable,
+        format_func=lambda c: "table order" if c is None else c,
+        key=f"{key}-sort",
+    )
+    descending = c3.selectbox("Order", ["ascending", "descending"], key=f"{key}-order") == "descending"
+    page_size = c4.selectbox("Rows per page", page_sizes, key=f"{key}-page-size")
+
+    args = (table, search.strip(), tuple(search_columns), sort_by, descending)
+    if cache_key is None:
+        positions = row_positions(*args)
+    else:
+        positions = _cached_row_positions(*args, key=(cache_key,) + args[1:])
+
+    if len(positions) == 0:
+        st.info("No rows match the search.")
+        return None
+
+    total_pages = (len(positions) + page_size - 1) // page_size
+    if total_pages > 1:
+        page = int(
+            st.number_input(
+                "Select Page", 1, total_pages, 1, step=1, key=f"{key}-page-{total_pages}"
+            )
+        )
+    else:
+        page = 1
+    start = (page - 1) * page_size
+    stop = min(start + page_size, len(positions))
+    df = table_window(table, positions, start, stop, columns)
+
+    kwargs = {"hide_index": True} | kwargs
+    event = st.dataframe(df, on_select="rerun", selection_mode="single-row", **kwargs)
+
+    matching = f" ({len(positions)} of {table.num_rows} match)" if search.strip() else ""
+    st.write(
+        f"Showing rows {start + 1} to {stop} of {len(positions)}{matching} ({get_dataframe_mem_useage(df):.2f} MB)"
+    )
+
+    rows = event["selection"]["rows"]
+    if not rows:
+        return None
+    return int(positions[start + rows[0]])
+
+
+
+def download_archive(
+    members: list,
+    zip_path: Path,
+    file_name: str,
+    keep_archive: bool = True,
+    container=None,
+    **kwargs,
+) -> None:
+    """
+    Writes files to a ZIP archive (chunk by chunk, see write_zip) and shows a download button for it.
+
+    st.download_button holds the data in server memory, so archives larger than the download
+    limit (settings "max-download-size-mb") are not offered for download. Archives which are not
+    kept (e.g. of mzML files, which are stored only once for all workspaces) are deleted once read.
+
+    Args:
+        members (list): File paths and their names in the archive, e.g. from collect_files.
+        zip_path (Path): Path of the archive, kept archives are re-used as long as no member changed.
+        file_name (str): Name of the downloaded file.
+        keep_archive (bool): Keep the archive for later downloads. Defaults to True.
+        container: Streamlit container to show the progress and button in. Defaults to the page.
+        ...: Additional keyword arguments to pass to the `st.download_button` function.
+
+    Returns:
+        None
+    """
+    container = container or st
+    limit = st.session_state.settings.get("max-download-size-mb", 2048) * 1024**2
+    zip_path = Path(zip_path)
+
+    def too_large(size):
+        container.warning(
+            f"⚠️ The archive ({size / 1024**2:.0f} MB) exceeds the download limit of "
+            f"{limit // 1024**2} MB. Please copy the files from the workspace directly."
+        )
+
+    if not keep_archive:
+        # mzML files are hardly compressible, too large archives are not written at all
+        size = sum(path.stat().st_size for path, _ in members)
+        if size > limit:
+            too_large(size)
+            return
+    if not is_up_to_date(zip_path, members):
+        bar = container.progress(0.0, text="Compressing files...")
+        write_zip(
+            members,
+            zip_path,
+            progress=lambda i, n: bar.progress(i / n, text="Compressing files..."),
+        )
+        bar.empty()
+    size = zip_path.stat().st_size
+    if size > limit:
+        too_large(size)
+        data = None
+    else:
+        with open(zip_path, "rb") as fp:
+            data = fp.read()
+    if not keep_archive:
+        zip_path.unlink()
+    if data is not None:
+        container.success("Files are ready.")
+        container.download_button(
+            label="⬇️ Download Now",
+            data=data,
+            file_name=file_name,
+            mime="application/zip",
+            use_container_width=True,
+            **kwargs,
+        )
+
 
 def show_table(df: pd.DataFrame, download_name: str = "") -> None:
     """
@@ -468,6 +634,24 @@ def show_fig(
         )
 
 
+def selected_x_range(selection_session_state_key: str):
+    """
+    x range of the rectangular selection of a figure shown with show_fig (the zoomed-in view
+    of downsampled traces), None if nothing is selected.
+
+    Args:
+        selection_session_state_key (str): The selection_session_state_key passed to show_fig.
+
+    Returns:
+        The (min, max) x range of the selection or None.
+    """
+    if selection_session_state_key in st.session_state:
+        box = st.session_state[selection_session_state_key].selection.box
+        if box:
+            return tuple(sorted(box[0]["x"]))
+    return None
+
+
 def reset_directory(path: Path) -> None:
     """
     Remove the given directory and re-create it.
@@ -0,0 +1,85 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Downsampling of line traces (chromatograms) before figure construction: traces are reduced
+# to a point budget with largest-triangle-three-buckets (LTTB), which keeps the peak shapes,
+# instead of sending every data point to the browser. Zoomed-in views (an x range) are
+# downsampled within the range only, narrow ranges are plotted at full resolution.
+
+# Maximum number of points of a single trace
+MAX_POINTS = 2000
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets: indices of n_out points representing the line (x sorted).
+    First and last point are kept, from each of the n_out - 2 buckets in between the point
+    forming the largest triangle with the previously selected point and the next bucket's mean.
+    Buckets holding the maximum of their own and both neighbouring buckets keep their maximum
+    instead, so peak apexes keep their height (the largest triangle is often next to the apex).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # mean point of each bucket and of the last point (the next bucket of the last bucket)
+    sums_x = np.add.reduceat(x[: n - 1], edges[:-1])
+    sums_y = np.add.reduceat(y[: n - 1], edges[:-1])
+    sizes = np.diff(edges)
+    mean_x = np.append(sums_x / sizes, x[-1])
+    mean_y = np.append(sums_y / sizes, y[-1])
+    # maximum of each bucket, with the first and last point as neighbours of the outer buckets
+    max_y = np.concatenate([[y[0]], np.maximum.reduceat(y[: n - 1], edges[:-1]), [y[-1]]])
+    apex = (max_y[1:-1] >= max_y[:-2]) & (max_y[1:-1] >= max_y[2:])
+    indices = np.zeros(n_out, dtype=np.int64)
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # twice the triangle area with the selected point a and the mean of the next bucket
+        area = np.abs(
+            (x[a] - mean_x[i + 1]) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (mean_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(y[start:stop] if apex[i] else area))
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(
+    x, y, max_points: int = MAX_POINTS, x_range: Optional[tuple] = None
+) -> np.ndarray:
+    """
+    Positions of the points of a trace (x sorted) to plot.
+
+    Args:
+        x: Sorted x values.
+        y: y values (missing values count as 0 for the point selection).
+        max_points (int): Maximum number of points.
+        x_range (Optional[tuple]): Visible x range, points outside (but the neighbours at both ends) are dropped.
+
+    Returns:
+        np.ndarray: Positions of the selected points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    start, stop = 0, len(x)
+    if x_range is not None:
+        # one point beyond the range on each side, lines continue to the plot borders
+        start = max(0, int(np.searchsorted(x, x_range[0], side="left")) - 1)
+        stop = min(len(x), int(np.searchsorted(x, x_range[1], side="right")) + 1)
+    return start + lttb(x[start:stop], y[start:stop], max_points)
+
+
+def downsample_frame(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    max_points: int = MAX_POINTS,
+    x_range: Optional[tuple] = None,
+) -> pd.DataFrame:
+    """Rows of a DataFrame to plot as line of column y over column x (see downsample)."""
+    df = df.sort_values(x, kind="stable")
+    return df.iloc[downsample(df[x], df[y], max_points, x_range)]
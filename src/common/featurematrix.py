@@ -0,0 +1,111 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Feature matrix store: the base table written by the feature linking steps plus one sidecar
+# parquet file per annotation source with only its own columns, keyed by metabolite name.
+# Annotation steps never rewrite the (potentially very wide) base table, readers get a joined view.
+
+
+def annotations_dir(feature_matrix: Union[str, Path]) -> Path:
+    """Directory with the annotation sidecars of a feature matrix (e.g. feature-matrix-annotations)."""
+    feature_matrix = Path(feature_matrix)
+    return Path(feature_matrix.parent, feature_matrix.stem + "-annotations")
+
+
+def sidecars(feature_matrix: Union[str, Path]) -> List[Path]:
+    """
+    Annotation sidecars of a feature matrix. Sidecars older than the base table
+    belong to a previous version of it and are ignored.
+    """
+    directory = annotations_dir(feature_matrix)
+    if not directory.exists():
+        return []
+    base_mtime = Path(feature_matrix).stat().st_mtime
+    return sorted(
+        path
+        for path in directory.glob("*.parquet")
+        if path.stat().st_mtime >= base_mtime
+    )
+
+
+def modification_time(feature_matrix: Union[str, Path]) -> float:
+    """Latest modification time of the base table and its annotation sidecars."""
+    return max(
+        path.stat().st_mtime for path in [Path(feature_matrix)] + sidecars(feature_matrix)
+    )
+
+
+def write_annotations(
+    feature_matrix: Union[str, Path], source: str, df: pd.DataFrame
+) -> Path:
+    """
+    Stores the annotation columns of one source (e.g. "sirius") as sidecar of a feature matrix.
+
+    Args:
+        feature_matrix (Union[str, Path]): The base feature matrix parquet file.
+        source (str): Name of the annotation source, used as file name.
+        df (pd.DataFrame): Annotation columns, indexed by metabolite name.
+
+    Returns:
+        Path: The sidecar parquet file.
+    """
+    directory = annotations_dir(feature_matrix)
+    directory.mkdir(exist_ok=True)
+    path = Path(directory, source + ".parquet")
+    df.to_parquet(path)
+    return path
+
+
+def read_feature_matrix(
+    feature_matrix: Union[str, Path], columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Reads the feature matrix joined with its annotation sidecars. If columns are given,
+    only those columns are read and sidecars without any of them are not opened at all.
+
+    Args:
+        feature_matrix (Union[str, Path]): The base feature matrix parquet file.
+        columns (Optional[List[str]]): Columns to read. Defaults to all columns.
+
+    Returns:
+        pd.DataFrame: The joined feature matrix, indexed by metabolite name.
+    """
+    def selected(path):
+        names = pq.read_schema(path).names
+        return names if columns is None else [c for c in columns if c in names]
+
+    df = pd.read_parquet(feature_matrix, columns=selected(feature_matrix))
+    for path in sidecars(feature_matrix):
+        cols = selected(path)
+        if cols:
+            annotations = pd.read_parquet(path, columns=cols)
+            # sidecars win for columns which also exist in the base table
+            df = df.drop(columns=[c for c in cols if c in df.columns])
+            df = df.join(annotations, how="left")
+    return df
+
+
+def materialize(feature_matrix: Union[str, Path], out_dir: Union[str, Path]) -> List[Path]:
+    """
+    Writes the joined feature matrix in parquet and tsv format to out_dir (for export).
+    Existing files are re-used if they are newer than the base table and all sidecars.
+
+    Args:
+        feature_matrix (Union[str, Path]): The base feature matrix parquet file.
+        out_dir (Union[str, Path]): Output directory.
+
+    Returns:
+        List[Path]: The parquet and tsv files.
+    """
+    Path(out_dir).mkdir(exist_ok=True)
+    parquet = Path(out_dir, Path(feature_matrix).name)
+    tsv = parquet.with_suffix(".tsv")
+    mtime = modification_time(feature_matrix)
+    if not all(p.exists() and p.stat().st_mtime >= mtime for p in (parquet, tsv)):
+        df = read_feature_matrix(feature_matrix)
+        df.to_parquet(parquet)
+        df.to_csv(tsv, sep="\t")
+    return [parquet, tsv]
@@ -0,0 +1,136 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Query layer for feature matrix parquet files (written sorted by m/z in row groups with
+# column statistics): filters are pushed down to the scan and only requested columns are read
+
+
+def index_column(path: Union[str, Path]) -> str:
+    """Name of the column holding the pandas index (the metabolite names)."""
+    index_columns = pq.read_schema(path).pandas_metadata["index_columns"]
+    return index_columns[0] if index_columns else None
+
+
+def column_range(path: Union[str, Path], column: str) -> tuple:
+    """
+    Minimum and maximum value of a column, taken from the row group statistics
+    without reading any data.
+    """
+    metadata = pq.ParquetFile(path).metadata
+    i = metadata.schema.names.index(column)
+    stats = [
+        metadata.row_group(rg).column(i).statistics
+        for rg in range(metadata.num_row_groups)
+    ]
+    stats = [s for s in stats if s is not None and s.has_min_max]
+    if len(stats) != metadata.num_row_groups:
+        # no statistics available, read the column
+        values = pq.read_table(path, columns=[column])[column]
+        min_max = pc.min_max(values)
+        return min_max["min"].as_py(), min_max["max"].as_py()
+    return min(s.min for s in stats), max(s.max for s in stats)
+
+
+def unique_values(path: Union[str, Path], column: str) -> list:
+    """Sorted unique (non-null) values of a single column."""
+    values = pq.read_table(path, columns=[column])[column]
+    return sorted(v for v in pc.unique(values).to_pylist() if v is not None)
+
+
+def build_filter(
+    path: Union[str, Path],
+    mz: Optional[tuple] = None,
+    rt: Optional[tuple] = None,
+    charge: Optional[int] = None,
+    adduct: Optional[str] = None,
+    annotation_prefixes: Optional[List[str]] = None,
+    metabolite: Optional[str] = None,
+) -> Optional[ds.Expression]:
+    """
+    Builds a filter expression for the feature matrix which is pushed down to the parquet scan.
+
+    Args:
+        path (Union[str, Path]): Feature matrix parquet file (used for the schema).
+        mz (Optional[tuple]): Inclusive m/z range.
+        rt (Optional[tuple]): Inclusive RT range.
+        charge (Optional[int]): Charge state.
+        adduct (Optional[str]): Adduct.
+        annotation_prefixes (Optional[List[str]]): Keep features with at least one non-empty value in any column starting with one of the prefixes.
+        metabolite (Optional[str]): Metabolite name (index value).
+
+    Returns:
+        Optional[ds.Expression]: The filter expression or None if no filter is given.
+    """
+    conditions = []
+    if mz is not None:
+        conditions.append((ds.field("mz") >= mz[0]) & (ds.field("mz") <= mz[1]))
+    if rt is not None:
+        conditions.append((ds.field("RT") >= rt[0]) & (ds.field("RT") <= rt[1]))
+    if charge is not None:
+        conditions.append(ds.field("charge") == int(charge))
+    if adduct is not None:
+        conditions.append(ds.field("adduct") == adduct)
+    if metabolite is not None:
+        conditions.append(ds.field(index_column(path)) == metabolite)
+    if annotation_prefixes is not None:
+        annotated = ds.scalar(False)
+        for field in pq.read_schema(path):
+            if any(field.name.startswith(p) for p in annotation_prefixes):
+                if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                    # null values are filtered out as well
+                    annotated = annotated | (ds.field(field.name) != "")
+                else:
+                    annotated = annotated | ds.field(field.name).is_valid()
+        conditions.append(annotated)
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def count(path: Union[str, Path], expression: Optional[ds.Expression] = None) -> int:
+    """Number of features matching the filter expression."""
+    return ds.dataset(path, format="parquet").count_rows(filter=expression)
+
+
+def query_table(
+    path: Union[str, Path],
+    expression: Optional[ds.Expression] = None,
+    columns: Optional[List[str]] = None,
+) -> pa.Table:
+    """
+    Reads the features matching the filter expression as Arrow table. Only the requested
+    columns (and the index) are read, row groups which can not match are skipped.
+
+    Args:
+        path (Union[str, Path]): Feature matrix parquet file.
+        expression (Optional[ds.Expression]): Filter expression, e.g. from build_filter.
+        columns (Optional[List[str]]): Columns to read. Defaults to all columns.
+
+    Returns:
+        pa.Table: The matching features.
+    """
+    dataset = ds.dataset(path, format="parquet")
+    if columns is not None:
+        index = index_column(path)
+        columns = [c for c in columns if c in dataset.schema.names]
+        if index is not None and index not in columns:
+            columns.append(index)
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def query(
+    path: Union[str, Path],
+    expression: Optional[ds.Expression] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Reads the features matching the filter expression as DataFrame (see query_table)."""
+    return query_table(path, expression, columns).to_pandas()
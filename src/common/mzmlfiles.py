@@ -0,0 +1,136 @@
+import gzip
+import shutil
+from pathlib import Path
+from typing import Callable, Union
+
+import numpy as np
+import pyopenms as poms
+
+# File extensions recognized as mzML files (OpenMS reads gzip compressed mzML transparently)
+MZML_EXTENSIONS = (".mzML", ".mzML.gz")
+
+# Compression suffixes which are stripped to get the sample name of a file
+COMPRESSION_SUFFIXES = (".gz", ".bz2")
+
+# Encodings for storing mzML files in the workspace
+MZML_ENCODINGS = ["mzML", "mzML (numpress)", "mzML.gz"]
+
+# Roles of the mzML files in an experiment (blanks and QCs are used to prune features)
+SAMPLE_TYPES = ["sample", "blank", "QC"]
+
+
+def is_mzML_file(path: Union[str, Path]) -> bool:
+    """
+    Checks if a file is a (possibly compressed) mzML file by its extension.
+
+    Args:
+        path (Union[str, Path]): Path or name of the file.
+
+    Returns:
+        bool: True if the file is an mzML file.
+    """
+    return Path(path).name.endswith(MZML_EXTENSIONS)
+
+
+def strip_compression_suffix(path: Union[str, Path]) -> str:
+    """
+    Returns the file name without compression suffix (e.g. sample.mzML.gz -> sample.mzML).
+    Used wherever the file name identifies a sample, so compressed and uncompressed
+    files of the same sample get the same name in result tables.
+
+    Args:
+        path (Union[str, Path]): Path or name of the file.
+
+    Returns:
+        str: The file name without compression suffix.
+    """
+    name = Path(path).name
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def store_numpress(path: Union[str, Path], out: Union[str, Path]) -> None:
+    """
+    Stores an mzML file with numpress encoded (linear for m/z and RT, slof for intensities)
+    and zlib compressed binary data arrays. The result is still a valid mzML file which
+    is read transparently by OpenMS.
+
+    Args:
+        path (Union[str, Path]): Input mzML file.
+        out (Union[str, Path]): Output mzML file.
+    """
+    exp = poms.MSExperiment()
+    poms.MzMLFile().load(str(path), exp)
+    options = poms.PeakFileOptions()
+    for set_config, compression in (
+        (options.setNumpressConfigurationMassTime, "linear"),
+        (options.setNumpressConfigurationIntensity, "slof"),
+    ):
+        config = poms.NumpressConfig()
+        config.estimate_fixed_point = True
+        config.numpressErrorTolerance = -1.0
+        config.setCompression(compression)
+        set_config(config)
+    options.setCompression(True)
+    f = poms.MzMLFile()
+    f.setOptions(options)
+    f.store(str(out), exp)
+
+
+def store_gzip(path: Union[str, Path], out: Union[str, Path]) -> None:
+    """
+    Stores a gzip compressed copy of a file.
+
+    Args:
+        path (Union[str, Path]): Input file.
+        out (Union[str, Path]): Output file (should end with .gz).
+    """
+    with open(path, "rb") as f_in, gzip.open(out, "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out, 8 * 1024 * 1024)
+
+
+def encode_mzML(
+    path: Union[str, Path], encoding: str, out_dir: Union[str, Path]
+) -> Path:
+    """
+    Writes an mzML file in the given encoding to out_dir. Files which are already
+    compressed are returned as they are.
+
+    Args:
+        path (Union[str, Path]): Input mzML file.
+        encoding (str): One of MZML_ENCODINGS.
+        out_dir (Union[str, Path]): Directory for the encoded file.
+
+    Returns:
+        Path: The encoded file, with .mzML.gz extension for gzip encoding.
+    """
+    path = Path(path)
+    if encoding == "mzML" or path.name.endswith(COMPRESSION_SUFFIXES):
+        return path
+    if encoding == "mzML (numpress)":
+        out = Path(out_dir, path.name)
+        store_numpress(path, out)
+    elif encoding == "mzML.gz":
+        out = Path(out_dir, path.name + ".gz")
+        store_gzip(path, out)
+    else:
+        raise ValueError(f"Unknown mzML encoding: {encoding}")
+    return out
+
+
+def load_trafo(trafoXML: Union[str, Path]) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Loads the RT transformation of a map alignment (e.g. to transform spectrum or
+    chromatogram RTs of an mzML file to the aligned RTs of its features).
+
+    Args:
+        trafoXML (Union[str, Path]): trafoXML file.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Vectorized RT transformation function.
+    """
+    trafo = poms.TransformationDescription()
+    poms.TransformationXMLFile().load(str(trafoXML), trafo, True)
+    return np.vectorize(trafo.apply, otypes=[float])
@@ -0,0 +1,196 @@
+import sys
+import pickle
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Result cache for the result views (tables and figures derived from workflow result files).
+# Entries are keyed explicitly by the files they are computed from (path and modification time)
+# and their parameters, so large DataFrames are never hashed and results of changed files are
+# never served. The cache is shared by all sessions and bounded by a byte budget: least recently
+# used entries are evicted, optionally spilled to disk and loaded from there on the next miss.
+
+# Default memory budget of the cache
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+# Spilled entries on disk may use this multiple of the memory budget
+DISK_BUDGET_FACTOR = 4
+
+
+def file_key(path: Union[str, Path], *params) -> tuple:
+    """
+    Cache key of a result computed from a file: the resolved path, its modification time
+    (None if it does not exist) and any further parameters (hashable).
+    """
+    path = Path(path)
+    mtime = path.stat().st_mtime_ns if path.exists() else None
+    return (str(path.resolve()), mtime) + params
+
+
+def sizeof(value: Any) -> int:
+    """Approximate memory size of a cached value in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (np.ndarray, pa.Table)):
+        return value.nbytes
+    try:
+        # e.g. plotly figures
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Thread safe LRU cache with a byte budget, hit/miss counters and optional disk spill.
+
+    Attributes:
+        max_bytes (int): Memory budget.
+        spill_dir (Optional[Path]): Directory for evicted entries, None disables spilling.
+        hits, misses, disk_hits, evictions (int): Counters since the last clear.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, spill_dir: Optional[Path] = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.disk_hits = self.evictions = 0
+
+    def configure(self, max_bytes: int, spill_dir: Optional[Path] = None) -> None:
+        """Sets the memory budget and spill directory, entries over budget are evicted."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.spill_dir = Path(spill_dir) if spill_dir else None
+            self._evict()
+
+    def _spill_path(self, key) -> Path:
+        return Path(self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".pkl")
+
+    def _spill(self, key, value) -> None:
+        """Writes an evicted entry to the spill directory, oldest files are removed over the disk budget."""
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self._spill_path(key)
+        try:
+            with open(path, "wb") as f:
+                pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            path.unlink(missing_ok=True)
+            return
+        files = sorted(self.spill_dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = 0
+        for p in files:
+            total += p.stat().st_size
+            if total > self.max_bytes * DISK_BUDGET_FACTOR:
+                p.unlink(missing_ok=True)
+
+    def _load_spilled(self, key):
+        """Value of a spilled entry or None. The key is stored with the value (hash collisions)."""
+        path = self._spill_path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                stored_key, value = pickle.load(f)
+        except Exception:
+            path.unlink(missing_ok=True)
+            return None
+        return value if stored_key == key else None
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            key, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            if self.spill_dir is not None:
+                self._spill(key, value)
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            size = sizeof(value)
+            self._entries[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def get_or_compute(self, key, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value of key: from memory, from the spill directory or computed
+        (outside the lock, other sessions are not blocked). Cached values are shared, callers must
+        not modify them.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            value = self._load_spilled(key) if self.spill_dir is not None else None
+            if value is not None:
+                self.disk_hits += 1
+                self.put(key, value)
+                return value
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.disk_hits = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Number of entries, used bytes and the hit/miss counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Cache shared by all sessions of the app process
+RESULT_CACHE = ResultCache()
+
+
+def configure_result_cache(settings: dict, spill_dir: Union[str, Path]) -> None:
+    """
+    Configures the shared result cache from the app settings ("result-cache" section with
+    "max-memory-mb" and "spill-to-disk").
+    """
+    RESULT_CACHE.configure(
+        int(settings.get("max-memory-mb", DEFAULT_MAX_BYTES // 1024**2)) * 1024**2,
+        Path(spill_dir) if settings.get("spill-to-disk", False) else None,
+    )
+
+
+def cache_result(func: Callable) -> Callable:
+    """
+    Caches the results of func in the shared result cache under the keyword argument key
+    (e.g. from file_key) instead of hashing the arguments. Other arguments have to be
+    determined by the key.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, key, **kwargs):
+        return RESULT_CACHE.get_or_compute(
+            (func.__module__, func.__qualname__, key), lambda: func(*args, **kwargs)
+        )
+
+    return wrapper
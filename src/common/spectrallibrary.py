@@ -0,0 +1,194 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+# Spectral library index: each library file (mgf or msp) is parsed once into a directory of numpy
+# arrays, named by the content hash of the file. Spectra are sorted by precursor m/z, peaks are
+# stored in flat arrays with offsets per spectrum, intensities normalized for cosine scoring.
+# Arrays are opened memory-mapped, so large libraries are not read into memory for matching.
+
+# Most intense peaks kept per spectrum
+MAX_PEAKS = 100
+
+# Library metadata columns (mgf params or msp fields in lower case are mapped to these)
+METADATA = {
+    "name": ["name", "compound_name", "title"],
+    "smiles": ["smiles"],
+    "inchi": ["inchi"],
+    "adduct": ["adduct", "ion", "precursor_type"],
+}
+
+ARRAYS = ["precursor_mz", "offsets", "mz", "intensity"]
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """SHA-256 of the file content (hex)."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def parse_mgf(path: Union[str, Path]):
+    """Yields (params, peaks) of the spectra in an mgf file, params with lower case keys."""
+    params, peaks, in_spectrum = {}, [], False
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == "BEGIN IONS":
+                params, peaks, in_spectrum = {}, [], True
+            elif line == "END IONS":
+                in_spectrum = False
+                yield params, peaks
+            elif in_spectrum:
+                if line[0].isdigit():
+                    values = line.split()
+                    peaks.append((float(values[0]), float(values[1])))
+                elif "=" in line:
+                    key, value = line.split("=", 1)
+                    params[key.strip().lower()] = value.strip()
+
+
+def parse_msp(path: Union[str, Path]):
+    """Yields (params, peaks) of the spectra in an msp file, params with lower case keys."""
+    params, peaks = {}, []
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                if peaks:
+                    yield params, peaks
+                params, peaks = {}, []
+            elif line[0].isdigit():
+                # peaks separated by new lines or ";", m/z and intensity by white space or ":"
+                for peak in line.split(";"):
+                    values = peak.replace(":", " ").split()
+                    if len(values) >= 2:
+                        peaks.append((float(values[0]), float(values[1])))
+            elif ":" in line:
+                key, value = line.split(":", 1)
+                params[key.strip().lower()] = value.strip()
+    if peaks:
+        yield params, peaks
+
+
+def precursor_mz(params: dict) -> float:
+    """Precursor m/z from mgf (pepmass) or msp (precursormz) fields, NaN if missing."""
+    for key in ["pepmass", "precursormz", "precursor_mz"]:
+        if key in params:
+            try:
+                return float(params[key].split()[0])
+            except (ValueError, IndexError):
+                return np.nan
+    return np.nan
+
+
+def normalized_peaks(peaks: list) -> tuple:
+    """
+    The MAX_PEAKS most intense peaks sorted by m/z with square root intensities scaled to unit
+    length, so the cosine score of two spectra is the sum of products of matched intensities.
+    """
+    peaks = np.array(peaks, dtype=np.float64).reshape(-1, 2)
+    peaks = peaks[peaks[:, 1] > 0]
+    if len(peaks) > MAX_PEAKS:
+        peaks = peaks[np.argsort(peaks[:, 1])[-MAX_PEAKS:]]
+    peaks = peaks[np.argsort(peaks[:, 0])]
+    intensity = np.sqrt(peaks[:, 1])
+    norm = np.linalg.norm(intensity)
+    return peaks[:, 0].astype(np.float32), (intensity / norm if norm else intensity).astype(
+        np.float32
+    )
+
+
+def build_index(spectra, index_dir: Union[str, Path]) -> None:
+    """
+    Writes the index arrays and metadata of spectra ((params, peaks) tuples) to index_dir.
+    Spectra without precursor m/z or peaks are skipped.
+    """
+    rows, mzs, intensities = [], [], []
+    for params, peaks in spectra:
+        pmz = precursor_mz(params)
+        if np.isnan(pmz) or not peaks:
+            continue
+        mz, intensity = normalized_peaks(peaks)
+        if not len(mz):
+            continue
+        rows.append(
+            {
+                column: next((params[k] for k in keys if k in params), "")
+                for column, keys in METADATA.items()
+            }
+            | {"precursor_mz": pmz}
+        )
+        mzs.append(mz)
+        intensities.append(intensity)
+    metadata = pd.DataFrame(rows, columns=list(METADATA) + ["precursor_mz"])
+    order = np.argsort(metadata["precursor_mz"].to_numpy(), kind="stable")
+    metadata = metadata.iloc[order].reset_index(drop=True)
+    lengths = np.array([len(mzs[i]) for i in order], dtype=np.int64)
+    arrays = {
+        "precursor_mz": metadata["precursor_mz"].to_numpy(dtype=np.float64),
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        "mz": np.concatenate([mzs[i] for i in order]) if len(order) else np.zeros(0, np.float32),
+        "intensity": np.concatenate([intensities[i] for i in order])
+        if len(order)
+        else np.zeros(0, np.float32),
+    }
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(Path(index_dir, name + ".npy"), array)
+    metadata.drop(columns=["precursor_mz"]).to_parquet(Path(index_dir, "metadata.parquet"))
+
+
+def library_index(library: Union[str, Path], cache_dir: Union[str, Path]) -> Path:
+    """
+    Index directory of a spectral library file (mgf or msp), built if not cached yet. The cache is
+    keyed by the content hash of the file, hashes are remembered by file path, size and
+    modification time so unchanged files are not hashed again.
+
+    Args:
+        library (Union[str, Path]): The library file.
+        cache_dir (Union[str, Path]): Directory with the cached library indices.
+
+    Returns:
+        Path: The index directory.
+    """
+    library, cache_dir = Path(library), Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    hashes_file = Path(cache_dir, "hashes.json")
+    hashes = json.loads(hashes_file.read_text()) if hashes_file.exists() else {}
+    stat = library.stat()
+    key = f"{library.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    if key not in hashes:
+        hashes[key] = file_hash(library)
+        hashes_file.write_text(json.dumps(hashes, indent=1))
+    index_dir = Path(cache_dir, hashes[key])
+    if not index_dir.exists():
+        parse = parse_msp if library.suffix.lower() == ".msp" else parse_mgf
+        # built in a temporary directory, an index directory is always complete
+        tmp_dir = Path(cache_dir, hashes[key] + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        build_index(parse(library), tmp_dir)
+        tmp_dir.rename(index_dir)
+    return index_dir
+
+
+def load_index(index_dir: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """Memory-mapped index arrays (precursor_mz, offsets, mz, intensity) of a library index."""
+    return {
+        name: np.load(Path(index_dir, name + ".npy"), mmap_mode="r") for name in ARRAYS
+    }
+
+
+def load_metadata(index_dir: Union[str, Path], rows: List[int] = None) -> pd.DataFrame:
+    """Metadata (name, smiles, inchi, adduct) of the library spectra, optionally only some rows."""
+    metadata = pd.read_parquet(Path(index_dir, "metadata.parquet"))
+    return metadata if rows is None else metadata.iloc[rows]
@@ -0,0 +1,189 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.common.spectrallibrary import MAX_PEAKS, normalized_peaks, parse_mgf, precursor_mz
+
+# Cosine similarity of many spectrum pairs at once. Spectra are normalized like the library index
+# (see spectrallibrary) so a cosine score is the sum of the intensity products of matched peaks.
+
+# Peaks of all pairs in a batch are merged in one sorted array, m/z offset by pair * PAIR_OFFSET
+PAIR_OFFSET = 1e5
+
+
+def gnps_spectra(mgf: Union[str, Path]) -> tuple:
+    """
+    Feature IDs, scan numbers, precursor m/z and normalized peaks of the GNPS mgf spectra. Peaks
+    are padded to MAX_PEAKS (m/z NaN, intensity 0).
+    """
+    feature_ids, scans, pmz, mzs, intensities = [], [], [], [], []
+    for params, peaks in parse_mgf(mgf):
+        if peaks:
+            mz, intensity = normalized_peaks(peaks)
+            feature_ids.append(params.get("feature_id", "").replace("e_", ""))
+            scans.append(params.get("scans", ""))
+            pmz.append(precursor_mz(params))
+            mzs.append(mz)
+            intensities.append(intensity)
+    mz, intensity = padded_peaks(list(zip(mzs, intensities)))
+    spectra = pd.DataFrame({"feature_id": feature_ids, "scans": scans})
+    return spectra, np.array(pmz, dtype=np.float64), mz, intensity
+
+
+def padded_peaks(peaks: List[tuple]) -> tuple:
+    """Normalized peaks ((m/z, intensity) arrays) padded to MAX_PEAKS (m/z NaN, intensity 0)."""
+    mz = np.full((len(peaks), MAX_PEAKS), np.nan, dtype=np.float32)
+    intensity = np.zeros((len(peaks), MAX_PEAKS), dtype=np.float32)
+    for i, (m, x) in enumerate(peaks):
+        mz[i, : len(m)] = m
+        intensity[i, : len(x)] = x
+    return mz, intensity
+
+
+def ranges(lo: np.ndarray, hi: np.ndarray) -> tuple:
+    """Owner and position of all elements in the index ranges [lo, hi)."""
+    counts = hi - lo
+    owner = np.repeat(np.arange(len(lo)), counts)
+    position = np.repeat(lo, counts) + (
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    return owner, position
+
+
+def greedy_scores(
+    pair: np.ndarray,
+    query_peak: np.ndarray,
+    library_peak: np.ndarray,
+    product: np.ndarray,
+    n_pairs: int,
+) -> tuple:
+    """
+    Sums of matched peak intensity products and numbers of matched peaks per spectrum pair, peaks
+    assigned greedily by product (each peak matched at most once). All pairs at once: in each round
+    the peak matches which are the best remaining ones of both their peaks are accepted (the greedy
+    order would accept them as well), matches sharing a peak with an accepted one are dropped.
+
+    Args:
+        pair (np.ndarray): Spectrum pair of each possible peak match.
+        query_peak (np.ndarray): Query peak (unique in the batch) of each possible peak match.
+        library_peak (np.ndarray): Library peak (unique in the batch) of each possible peak match.
+        product (np.ndarray): Intensity product of each possible peak match.
+        n_pairs (int): Number of spectrum pairs.
+
+    Returns:
+        tuple: The score and the number of matched peaks of each spectrum pair.
+    """
+    order = np.argsort(-product, kind="stable")
+    pair, query_peak, library_peak, product = (
+        pair[order], query_peak[order], library_peak[order], product[order]
+    )
+    scores, matched = np.zeros(n_pairs), np.zeros(n_pairs, dtype=np.int64)
+    while len(pair):
+        # first occurrence is the best remaining match of a peak
+        best_query = np.zeros(len(pair), dtype=bool)
+        best_query[np.unique(query_peak, return_index=True)[1]] = True
+        best_library = np.zeros(len(pair), dtype=bool)
+        best_library[np.unique(library_peak, return_index=True)[1]] = True
+        accept = best_query & best_library
+        scores += np.bincount(pair[accept], product[accept], minlength=n_pairs)
+        matched += np.bincount(pair[accept], minlength=n_pairs)
+        keep = ~(
+            np.isin(query_peak, query_peak[accept]) | np.isin(library_peak, library_peak[accept])
+        )
+        pair, query_peak, library_peak, product = (
+            pair[keep], query_peak[keep], library_peak[keep], product[keep]
+        )
+    return scores, matched
+
+
+def score_batch(
+    query_mz: np.ndarray,
+    query_intensity: np.ndarray,
+    library: tuple,
+    shift: Optional[np.ndarray],
+    tolerance: float,
+    ppm: bool,
+) -> tuple:
+    """
+    Cosine scores of spectrum pairs. Query peaks are padded arrays (one row per pair), library peaks
+    flat (pair, m/z, intensity) sorted by pair and m/z. Matching peaks are found for all pairs at
+    once by searchsorted on m/z offset by pair. With shift (query minus library precursor m/z)
+    library peaks also match shifted by the precursor difference (modified cosine).
+
+    Returns:
+        tuple: The score and the number of matched peaks of each spectrum pair.
+    """
+    query_pair, i = np.nonzero(~np.isnan(query_mz))
+    mz = query_mz[query_pair, i].astype(np.float64)
+    tol = mz * tolerance * 1e-6 if ppm else np.full(len(mz), tolerance)
+    key = query_pair * PAIR_OFFSET + mz
+    library_pair, library_mz, library_intensity = library
+    matches = []
+    for offset in [0] if shift is None else [0, shift[library_pair]]:
+        library_key = library_pair * PAIR_OFFSET + library_mz + offset
+        matches.append(
+            ranges(
+                np.searchsorted(library_key, key - tol, side="left"),
+                np.searchsorted(library_key, key + tol, side="right"),
+            )
+        )
+    # (query peak, library peak) matches, unshifted and shifted matches of the same peaks only once
+    query_peak = np.concatenate([m[0] for m in matches])
+    library_peak = np.concatenate([m[1] for m in matches])
+    if shift is not None:
+        query_peak, library_peak = np.divmod(
+            np.unique(query_peak * len(library_mz) + library_peak), len(library_mz)
+        )
+    product = query_intensity[query_pair[query_peak], i[query_peak]] * library_intensity[library_peak]
+    return greedy_scores(
+        query_pair[query_peak], query_peak, library_peak, product.astype(np.float64), len(query_mz)
+    )
+
+
+def flat_peaks(mz: np.ndarray, intensity: np.ndarray) -> tuple:
+    """Spectrum (row), m/z and intensity of the peaks in padded peak arrays, sorted by row and m/z."""
+    spectrum, i = np.nonzero(~np.isnan(mz))
+    return spectrum, mz[spectrum, i].astype(np.float64), intensity[spectrum, i]
+
+
+def connected_components(n: int, node_1: np.ndarray, node_2: np.ndarray) -> np.ndarray:
+    """Connected component label (smallest node) of each of n nodes, by label propagation."""
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, node_1, labels[node_2])
+        np.minimum.at(new, node_2, labels[node_1])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def mgf_feature_ids(consensus_id: pd.Series, membership: List[str]) -> pd.Series:
+    """
+    Feature IDs in the annotated mgf file for consensus feature IDs (str). Without MS2 clustering
+    these are the consensus feature IDs. With a cluster membership table (cluster_ms2_spectra) it is
+    the representative consensus feature of the cluster with most spectra of the feature, so
+    annotations of a cluster apply to all its consensus features.
+
+    Args:
+        consensus_id (pd.Series): Consensus feature IDs as strings.
+        membership (List[str]): Cluster membership parquet file (empty without clustering).
+
+    Returns:
+        pd.Series: The mgf feature IDs with the index of consensus_id.
+    """
+    if not membership:
+        return consensus_id
+    df = pd.read_parquet(membership[0], columns=["representative", "consensus_feature_id"])
+    counts = df.groupby(["consensus_feature_id", "representative"]).size().rename("n").reset_index()
+    primary = counts.sort_values("n", ascending=False, kind="stable").drop_duplicates(
+        "consensus_feature_id"
+    )
+    representative = pd.Series(
+        primary["representative"].astype(str).to_numpy(),
+        index=primary["consensus_feature_id"].astype(str).to_numpy(),
+    )
+    return consensus_id.map(representative).fillna(consensus_id)
@@ -0,0 +1,70 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Server-side windows of large Arrow tables for paginated views: search and sorting are
+# computed on the Arrow columns and only the visible rows of the requested columns are
+# converted to pandas (and sent to the browser)
+
+
+def is_scalar_column(field: pa.Field) -> bool:
+    """Whether a column can be searched and sorted (no list or struct values)."""
+    return not pa.types.is_nested(field.type)
+
+
+def row_positions(
+    table: pa.Table,
+    search: str = "",
+    search_columns: Optional[List[str]] = None,
+    sort_by: Optional[str] = None,
+    descending: bool = False,
+) -> np.ndarray:
+    """
+    Positions of the rows matching the search text, in sort order.
+
+    Args:
+        table (pa.Table): The table.
+        search (str): Case insensitive text a row has to contain in any of the search columns, empty matches all rows.
+        search_columns (Optional[List[str]]): Columns to search (values as text). Defaults to all scalar columns.
+        sort_by (Optional[str]): Column to sort by (missing values last), None keeps the table order.
+        descending (bool): Sort in descending order.
+
+    Returns:
+        np.ndarray: Row positions in the table.
+    """
+    if search:
+        if search_columns is None:
+            search_columns = [f.name for f in table.schema if is_scalar_column(f)]
+        mask = pa.chunked_array([pa.array(np.zeros(table.num_rows, dtype=bool))])
+        for name in search_columns:
+            values = table[name]
+            if not (pa.types.is_string(values.type) or pa.types.is_large_string(values.type)):
+                values = pc.cast(values, pa.string())
+            matches = pc.match_substring(values, search, ignore_case=True)
+            mask = pc.or_(mask, pc.fill_null(matches, False))
+        positions = np.flatnonzero(mask.to_numpy())
+    else:
+        positions = np.arange(table.num_rows)
+    if sort_by is not None:
+        order = pc.array_sort_indices(
+            table[sort_by].take(positions),
+            order="descending" if descending else "ascending",
+            null_placement="at_end",
+        )
+        positions = positions[order.to_numpy()]
+    return positions
+
+
+def table_window(
+    table: pa.Table, positions: np.ndarray, start: int, stop: int, columns: List[str]
+) -> pd.DataFrame:
+    """
+    Rows positions[start:stop] of the given columns as DataFrame (with a range index),
+    the other rows and columns are never converted.
+    """
+    window = table.select(columns).take(pa.array(positions[start:stop], type=pa.int64()))
+    # without the pandas metadata, index columns stay regular columns
+    return window.replace_schema_metadata(None).to_pandas()
@@ -0,0 +1,288 @@
+import os
+import time
+import zlib
+import struct
+import tempfile
+import zipfile
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Read and yield data in chunks of 8 MB
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Members with these suffixes are compressed already and stored as they are
+STORED_SUFFIXES = {
+    ".gz",
+    ".bz2",
+    ".xz",
+    ".zip",
+    ".parquet",
+    ".ftr",
+    ".png",
+    ".jpg",
+    ".jpeg",
+}
+
+# Sizes, offsets and entry counts above these limits need ZIP64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+_STORED, _DEFLATED = 0, 8
+_UTF8_FLAG = 0x800
+_MAX32, _MAX16 = 0xFFFFFFFF, 0xFFFF
+
+
+def _clip(value: int, limit: int, sentinel: int) -> int:
+    """Value for a 32 (16) bit header field, or the sentinel if ZIP64 records hold the value."""
+    return value if value < limit else sentinel
+
+
+def collect_files(paths: Iterable[Union[str, Path]]) -> List[Tuple[Path, str]]:
+    """
+    Lists all files to be archived with their names in the archive. Files are added by
+    name, directories recursively with their own name as top level folder.
+
+    Args:
+        paths (Iterable[Union[str, Path]]): Files and directories to archive.
+
+    Returns:
+        List[Tuple[Path, str]]: File paths and their names in the archive.
+    """
+    members = []
+    for path in map(Path, paths):
+        if path.is_file():
+            members.append((path, path.name))
+        elif path.is_dir():
+            for subpath in sorted(path.rglob("*")):
+                if subpath.is_file():
+                    # Use as_posix() to ensure correct path format in ZIP across platforms
+                    members.append(
+                        (subpath, subpath.relative_to(path.parent).as_posix())
+                    )
+    return members
+
+
+def is_up_to_date(
+    archive: Union[str, Path], members: List[Tuple[Path, str]]
+) -> bool:
+    """
+    Checks if an archive exists, contains exactly the given members (by name, files may have
+    been added or removed) and is newer than all of them.
+    """
+    archive = Path(archive)
+    if not archive.exists():
+        return False
+    mtime = archive.stat().st_mtime
+    if any(path.stat().st_mtime > mtime for path, _ in members):
+        return False
+    try:
+        # only the central directory is read
+        with zipfile.ZipFile(archive) as f:
+            names = f.namelist()
+    except zipfile.BadZipFile:
+        return False
+    return sorted(names) == sorted(name for _, name in members)
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def _prepare(path: Path, level: int) -> tuple:
+    """
+    Calculates CRC and sizes of a member. Compressible members are deflated into an
+    anonymous temporary file, so sizes are known before the local header is written.
+    Runs in worker threads, zlib releases the GIL while compressing.
+    """
+    crc, size = 0, 0
+    if path.suffix in STORED_SUFFIXES:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        return _STORED, crc, size, size, None
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    tmp = tempfile.TemporaryFile()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            tmp.write(compressor.compress(chunk))
+    tmp.write(compressor.flush())
+    compressed_size = tmp.tell()
+    if compressed_size >= size:
+        # Compression does not pay off, store the original data instead
+        tmp.close()
+        return _STORED, crc, size, size, None
+    tmp.seek(0)
+    return _DEFLATED, crc, size, compressed_size, tmp
+
+
+def _read_chunks(f) -> Iterator[bytes]:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        yield chunk
+
+
+def stream_zip(
+    members: List[Tuple[Path, str]],
+    num_threads: Optional[int] = None,
+    level: int = 6,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Iterator[bytes]:
+    """
+    Generates a ZIP archive (with ZIP64 support for large files) in chunks without
+    holding it in memory. Members are compressed in parallel threads, a few members
+    ahead of the one currently written. Already compressed members (see STORED_SUFFIXES)
+    are stored without compression.
+
+    Args:
+        members (List[Tuple[Path, str]]): File paths and their names in the archive, e.g. from collect_files.
+        num_threads (Optional[int]): Number of compression threads. Defaults to the number of CPUs.
+        level (int): Deflate compression level. Default is 6.
+        progress (Optional[Callable[[int, int], None]]): Called with the number of written and total members.
+
+    Yields:
+        bytes: Consecutive chunks of the archive.
+    """
+    num_threads = num_threads or os.cpu_count() or 1
+    entries, offset = [], 0
+    with ThreadPoolExecutor(num_threads) as executor:
+        remaining = iter(members)
+        pending = deque(
+            (path, name, executor.submit(_prepare, path, level))
+            for path, name in itertools.islice(remaining, 2 * num_threads)
+        )
+        while pending:
+            path, name, future = pending.popleft()
+            for next_path, next_name in itertools.islice(remaining, 1):
+                pending.append(
+                    (next_path, next_name, executor.submit(_prepare, next_path, level))
+                )
+            method, crc, size, compressed_size, tmp = future.result()
+            name = name.encode("utf-8")
+            stat = path.stat()
+            dostime, dosdate = _dos_time(stat.st_mtime)
+            zip64 = size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT
+            extra = struct.pack("<HHQQ", 1, 16, size, compressed_size) if zip64 else b""
+            yield struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                45 if zip64 else 20,
+                _UTF8_FLAG,
+                method,
+                dostime,
+                dosdate,
+                crc,
+                _MAX32 if zip64 else compressed_size,
+                _MAX32 if zip64 else size,
+                len(name),
+                len(extra),
+            ) + name + extra
+            entries.append(
+                (name, method, dostime, dosdate, crc, size, compressed_size, offset, stat.st_mode)
+            )
+            offset += 30 + len(name) + len(extra) + compressed_size
+            if tmp is None:
+                with open(path, "rb") as f:
+                    yield from _read_chunks(f)
+            else:
+                with tmp:
+                    yield from _read_chunks(tmp)
+            if progress is not None:
+                progress(len(entries), len(members))
+
+    # Central directory
+    cd_offset, cd_size = offset, 0
+    for name, method, dostime, dosdate, crc, size, compressed_size, local_offset, mode in entries:
+        zip64_fields = [
+            value
+            for value in (size, compressed_size, local_offset)
+            if value >= ZIP64_LIMIT
+        ]
+        extra = (
+            struct.pack(f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields)
+            if zip64_fields
+            else b""
+        )
+        record = struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50,
+            (3 << 8) | 45,  # made by UNIX, to preserve file permissions
+            45 if zip64_fields else 20,
+            _UTF8_FLAG,
+            method,
+            dostime,
+            dosdate,
+            crc,
+            _clip(compressed_size, ZIP64_LIMIT, _MAX32),
+            _clip(size, ZIP64_LIMIT, _MAX32),
+            len(name),
+            len(extra),
+            0,
+            0,
+            0,
+            (mode & 0xFFFF) << 16,
+            _clip(local_offset, ZIP64_LIMIT, _MAX32),
+        ) + name + extra
+        cd_size += len(record)
+        yield record
+
+    # End of central directory, with ZIP64 records if any of the limits is exceeded
+    n = len(entries)
+    if n >= ZIP64_COUNT_LIMIT or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+        yield struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, n, n, cd_size, cd_offset
+        )
+        yield struct.pack("<IIQI", 0x07064B50, 0, cd_offset + cd_size, 1)
+    yield struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        _clip(n, ZIP64_COUNT_LIMIT, _MAX16),
+        _clip(n, ZIP64_COUNT_LIMIT, _MAX16),
+        _clip(cd_size, ZIP64_LIMIT, _MAX32),
+        _clip(cd_offset, ZIP64_LIMIT, _MAX32),
+        0,
+    )
+
+
+def write_zip(
+    members: List[Tuple[Path, str]],
+    out: Union[str, Path],
+    num_threads: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Path:
+    """
+    Writes a ZIP archive chunk by chunk to out (see stream_zip). The archive is
+    written to a temporary file next to out first, so it is never seen incomplete.
+
+    Args:
+        members (List[Tuple[Path, str]]): File paths and their names in the archive, e.g. from collect_files.
+        out (Union[str, Path]): Path of the archive.
+        num_threads (Optional[int]): Number of compression threads. Defaults to the number of CPUs.
+        progress (Optional[Callable[[int, int], None]]): Called with the number of written and total members.
+
+    Returns:
+        Path: Path of the archive.
+    """
+    out = Path(out)
+    fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in stream_zip(members, num_threads, progress=progress):
+                f.write(chunk)
+        os.replace(tmp, out)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return out
@@ -4,6 +4,10 @@ from src.common.common import *
 
 from pathlib import Path
 
+from src.common.mzmlfiles import strip_compression_suffix
+from src.common.resultcache import cache_result
+from src.common.downsample import downsample
+
 import pyopenms as oms
 
 import pandas as pd
@@ -77,7 +81,7 @@ def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz
 
         # Create an empty df for AUCs with filenames as columns and mass names as indexes
         df_auc = pd.DataFrame(
-            columns=[Path(file).name for file in mzML_files], index=df_input["name"]
+            columns=[strip_compression_suffix(file) for file in mzML_files], index=df_input["name"]
         )
 
         # Iterate over the files and extract chromatograms in a single dataframe per file
@@ -174,13 +178,16 @@ def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz
                 # Add intensity values to df
                 df[metabolite_name] = ints
                 # also insert the AUC in the auc dataframe
-                df_auc.loc[metabolite_name, Path(file).name] = np.trapz(ints, df["time"])
+                df_auc.loc[metabolite_name, strip_compression_suffix(file)] = np.trapz(ints, df["time"])
 
             # Save to feather dataframe for quick access
-            df.to_feather(Path(results_dir, Path(file).stem + ".ftr"))
+            df.to_feather(
+                Path(results_dir, Path(strip_compression_suffix(file)).stem + ".ftr")
+            )
             # Save as tsv for download option
             df.to_csv(
-                Path(tsv_dir, Path(file).stem + ".tsv"), sep="\t", index=False
+                Path(tsv_dir, Path(strip_compression_suffix(file)).stem + ".tsv"),
+                sep="\t", index=False
             )
 
         # once all files are processed, zip the tsv files and delete their directory
@@ -227,7 +234,7 @@ def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz
     st.rerun()
 
 
-@st.cache_resource
+@cache_result
 def get_auc_fig(df_auc):
     for col in df_auc.columns:
         df_auc = df_auc.rename(columns={col: col[:-5]})
@@ -243,17 +250,20 @@ def get_auc_fig(df_auc):
     return fig
 
 
-@st.cache_resource
-def get_metabolite_fig(df_auc, metabolite, time_unit):
+@cache_result
+def get_metabolite_fig(df_auc, metabolite, time_unit, time_range=None):
     fig = go.Figure()
     for sample in df_auc.columns:
         df = pd.read_feather(Path(st.session_state.workspace,
-                             "extracted-ion-chromatograms", sample[:-4] + "ftr"))
+                             "extracted-ion-chromatograms", sample[:-4] + "ftr"),
+                             columns=["time", metabolite])
+        # downsampled, within the selected time range if zoomed in
+        df = df.iloc[downsample(df["time"], df[metabolite], x_range=time_range)]
         fig.add_trace(
             go.Scattergl(
                 name=sample[:-5],
                 x=df["time"],
-                y=df[[metabolite][0]],
+                y=df[metabolite],
             )
         )
     fig.update_layout(
@@ -267,8 +277,14 @@ def get_metabolite_fig(df_auc, metabolite, time_unit):
     return fig
 
 
-def get_sample_plot(df, sample, time_unit):
-    fig = px.line(df, x="time", y=df.columns)
+def get_sample_plot(df, sample, time_unit, time_range=None):
+    fig = go.Figure()
+    # one downsampled trace per chromatogram, within the selected time range if zoomed in
+    for col in df.columns.drop("time"):
+        i = downsample(df["time"], df[col], x_range=time_range)
+        fig.add_trace(
+            go.Scattergl(name=col, x=df["time"].iloc[i], y=df[col].iloc[i], mode="lines")
+        )
     fig.update_layout(
         title=sample[:-5],
         xaxis_title=f"time ({time_unit})",
@@ -1,60 +1,121 @@
 import shutil
-import zipfile
+import tempfile
 from pathlib import Path
-from io import BytesIO
 
 import streamlit as st
 import pandas as pd
 
-from src.common.common import reset_directory
+from src.common.common import reset_directory, download_archive
+from src.common.blobstore import get_store_dir, add_file, add_buffer
+from src.common.mzmlfiles import is_mzML_file, strip_compression_suffix, encode_mzML
+from src.common.zipstream import collect_files
 
 
-def save_uploaded_mzML(uploaded_files: list[bytes]) -> None:
+def _add_mzML_file(path: Path, mzML_dir: Path, store_dir: Path, encoding: str) -> None:
+    """
+    Encodes an mzML file (if required) and references it from the shared store in the workspace mzML directory.
+
+    Args:
+        path (Path): mzML file to add.
+        mzML_dir (Path): Workspace mzML directory.
+        store_dir (Path): Shared mzML store directory.
+        encoding (str): Encoding to store the file in, one of MZML_ENCODINGS.
+
+    Returns:
+        None
+    """
+    # Encode in a temporary directory within the store, encoded files can be moved into the store without copy
+    with tempfile.TemporaryDirectory(suffix=".tmp", dir=store_dir) as tmp_dir:
+        encoded = encode_mzML(path, encoding, tmp_dir)
+        add_file(
+            encoded, Path(mzML_dir, encoded.name), store_dir, move=(encoded != path)
+        )
+
+
+def _existing_samples(mzML_dir: Path) -> set[str]:
+    """Names of samples in the mzML directory (including external files), independent of compression."""
+    samples = set(strip_compression_suffix(f) for f in mzML_dir.iterdir() if is_mzML_file(f))
+    external_files = Path(mzML_dir, "external_files.txt")
+    if external_files.exists():
+        with open(external_files, "r") as f_handle:
+            samples |= set(strip_compression_suffix(f.strip()) for f in f_handle if f.strip())
+    return samples
+
+
+def _is_new_sample(name: str, existing: set[str]) -> bool:
+    """
+    Checks if a file adds a new sample and registers it in existing. Files of a sample which exists
+    already (also compressed or uncompressed) are skipped with a warning, they would share all
+    result files and the same feature matrix column.
+    """
+    sample = strip_compression_suffix(name)
+    if sample in existing:
+        st.warning(f"Skipped **{Path(name).name}**, sample **{sample}** exists already.")
+        return False
+    existing.add(sample)
+    return True
+
+
+def save_uploaded_mzML(uploaded_files: list[bytes], encoding: str = "mzML") -> None:
     """
     Saves uploaded mzML files to the mzML directory.
 
     Args:
         uploaded_files (List[bytes]): List of uploaded mzML files.
+        encoding (str): Encoding to store the files in, one of MZML_ENCODINGS. Default is "mzML".
 
     Returns:
         None
     """
     mzML_dir = Path(st.session_state.workspace, "mzML-files")
+    store_dir = get_store_dir(Path(st.session_state.workspace).parent)
     # If no files are uploaded, exit early
     if not uploaded_files:
         st.warning("Upload some files first.")
         return
-    # Write files from buffer to workspace mzML directory, add to selected files
+    # Write files from buffer to shared store and reference in workspace mzML directory, add to selected files
+    existing = _existing_samples(mzML_dir)
     for f in uploaded_files:
-        if f.name not in [f.name for f in mzML_dir.iterdir()] and f.name.endswith(
-            "mzML"
-        ):
-            with open(Path(mzML_dir, f.name), "wb") as fh:
-                fh.write(f.getbuffer())
+        if is_mzML_file(f.name) and _is_new_sample(f.name, existing):
+            if encoding == "mzML":
+                add_buffer(f.getbuffer(), Path(mzML_dir, f.name), store_dir)
+            else:
+                with tempfile.TemporaryDirectory(suffix=".tmp", dir=store_dir) as tmp_dir:
+                    path = Path(tmp_dir, f.name)
+                    with open(path, "wb") as fh:
+                        fh.write(f.getbuffer())
+                    _add_mzML_file(path, mzML_dir, store_dir, encoding)
     st.success("Successfully added uploaded files!")
 
 
-def copy_local_mzML_files_from_directory(local_mzML_directory: str, make_copy: bool=True) -> None:
+def copy_local_mzML_files_from_directory(local_mzML_directory: str, make_copy: bool=True, encoding: str = "mzML") -> None:
     """
     Copies local mzML files from a specified directory to the mzML directory.
+    Files are added to the content-addressed store shared by all workspaces and
+    referenced from the workspace, identical files are stored only once.
 
     Args:
         local_mzML_directory (str): Path to the directory containing the mzML files.
         make_copy (bool): Whether to make a copy of the files in the workspace. Default is True. If False, local file paths will be written to an external_files.txt file.
+        encoding (str): Encoding to store copied files in, one of MZML_ENCODINGS. Default is "mzML".
 
     Returns:
         None
     """
     mzML_dir = Path(st.session_state.workspace, "mzML-files")
+    store_dir = get_store_dir(Path(st.session_state.workspace).parent)
+    files = [f for f in Path(local_mzML_directory).iterdir() if is_mzML_file(f)]
     # Check if local directory contains mzML files, if not exit early
-    if not any(Path(local_mzML_directory).glob("*.mzML")):
+    if not files:
         st.warning("No mzML files found in specified folder.")
         return
     # Copy all mzML files to workspace mzML directory, add to selected files
-    files = Path(local_mzML_directory).glob("*.mzML")
+    existing = _existing_samples(mzML_dir)
     for f in files:
+        if not _is_new_sample(f.name, existing):
+            continue
         if make_copy:
-            shutil.copy(f, Path(mzML_dir, f.name))
+            _add_mzML_file(f, mzML_dir, store_dir, encoding)
         else:
             # Create a temporary file to store the path to the local directories
             external_files = Path(mzML_dir, "external_files.txt")
@@ -68,20 +129,23 @@ def copy_local_mzML_files_from_directory(local_mzML_directory: str, make_copy: b
     st.success("Successfully added local files!")
 
 
-def load_example_mzML_files() -> None:
+def load_example_mzML_files(encoding: str = "mzML") -> None:
     """
-    Copies example mzML files to the mzML directory.
+    Copies example mzML files to the mzML directory (referencing the shared content-addressed store).
 
     Args:
-        None
+        encoding (str): Encoding to store the files in, one of MZML_ENCODINGS. Default is "mzML".
 
     Returns:
         None
     """
     mzML_dir = Path(st.session_state.workspace, "mzML-files")
-    # Copy files from example-data/mzML to workspace mzML directory, add to selected files
+    store_dir = get_store_dir(Path(st.session_state.workspace).parent)
+    # Reference files from example-data/mzML in workspace mzML directory, add to selected files
+    existing = _existing_samples(mzML_dir)
     for f in Path("example-data", "mzML").glob("*.mzML"):
-        shutil.copy(f, mzML_dir)
+        if _is_new_sample(f.name, existing):
+            _add_mzML_file(f, mzML_dir, store_dir, encoding)
     st.success("Example mzML files loaded!")
 
 
@@ -100,7 +164,9 @@ def remove_selected_mzML_files(to_remove: list[str], params: dict) -> dict:
     mzML_dir = Path(st.session_state.workspace, "mzML-files")
     # remove all given files from mzML workspace directory and selected files
     for f in to_remove:
-        Path(mzML_dir, f + ".mzML").unlink()
+        for path in mzML_dir.iterdir():
+            if strip_compression_suffix(path) == f + ".mzML":
+                path.unlink()
     for k, v in params.items():
         if isinstance(v, list):
             if f in v:
@@ -133,7 +199,7 @@ def remove_all_mzML_files(params: dict) -> dict:
 def update_mzML_df(df_path, mzML_dir):
     if not df_path.exists():
         files = [f.name for f in Path(mzML_dir).iterdir() if f.is_file()]
-        df = pd.DataFrame({"file name": files, "use in workflows": [True] * len(files)})
+        df = pd.DataFrame({"file name": files, "use in workflows": [True] * len(files), "sample type": "sample"})
     else:
         df = pd.read_csv(df_path, sep="\t")
 
@@ -147,29 +213,32 @@ def update_mzML_df(df_path, mzML_dir):
         existing_files = set(df["file name"])
 
         # Iterate through mzML_dir and check for new .mzML files
-        new_files = [f.name for f in Path(mzML_dir).iterdir() if f.is_file() and f.suffix == ".mzML" and f.name not in existing_files]
+        new_files = [f.name for f in Path(mzML_dir).iterdir() if f.is_file() and is_mzML_file(f) and f.name not in existing_files]
 
         # Add new files to the DataFrame
         if new_files:
-            new_df = pd.DataFrame({"file name": new_files, "use in workflows": [True] * len(new_files)})
+            new_df = pd.DataFrame({"file name": new_files, "use in workflows": [True] * len(new_files), "sample type": "sample"})
             df = pd.concat([df, new_df])
+        # Tables of previous versions have no sample types
+        if "sample type" not in df.columns:
+            df["sample type"] = "sample"
+        df["sample type"] = df["sample type"].fillna("sample")
     # Sort the DataFrame alphabetically by file name
     return df.sort_values(by="file name").reset_index(drop=True)
 
-def zip_files(directory):
+def download_mzML_files(directory, file_name, container=None):
     directory = Path(directory)  # Ensure directory is a Path object
-    bytes_io = BytesIO()
-    my_bar = st.progress(0, text="Compressing mzML files...")
 
     # List all files in the directory (ignoring subdirectories)
     files = [file for file in directory.iterdir() if file.is_file()]
-    n_files = len(files) - 1
-
-    with zipfile.ZipFile(bytes_io, 'w') as zip_file:
-        for i, file_path in enumerate(files):
-            zip_file.write(file_path, file_path.name)
-            my_bar.progress(i / n_files)
-    
-    my_bar.empty()
-    bytes_io.seek(0)
-    return bytes_io
+
+    # The archive is written chunk by chunk next to the directory and deleted once read,
+    # the mzML files themselves are stored only once for all workspaces (see blobstore).
+    download_archive(
+        collect_files(files),
+        Path(directory.parent, directory.name + ".zip"),
+        file_name,
+        keep_archive=False,
+        container=container,
+        type="primary",
+    )
@@ -1,16 +1,38 @@
 import streamlit as st
 from pathlib import Path
+import importlib.util
+import json
 
 from rdkit import Chem
 from rdkit.Chem import Draw
 
 import pandas as pd
+import pyarrow.parquet as pq
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from itertools import cycle
 
-from src.common.common import show_fig, load_parquet
+from src.common.common import (
+    show_fig,
+    load_parquet,
+    display_paginated_table,
+    selected_x_range,
+    download_archive,
+)
+from src.common.downsample import downsample
+from src.common.featurematrix import materialize, modification_time
+from src.common.resultcache import cache_result, file_key
+from src.common.zipstream import collect_files
+from src.common.featurequery import (
+    build_filter,
+    column_range,
+    count,
+    index_column,
+    query,
+    query_table,
+    unique_values,
+)
 
 COLOR_SCALE = [
     (0.00, "rgba(233, 233, 233, 1.0)"),
@@ -29,42 +51,35 @@ def add_color_column(df):
 
 
 @st.dialog("🔎 Filter Feature Matrix")
-def filter_dialog(df):
-    len_unfiltered = len(df)
-    mz = st.slider(
-        "*m/z* range",
-        df["mz"].min(),
-        df["mz"].max(),
-        value=(df["mz"].min(), df["mz"].max()),
-    )
-    rt = st.slider(
-        "RT range",
-        df["RT"].min(),
-        df["RT"].max(),
-        value=(df["RT"].min(), df["RT"].max()),
-    )
+def filter_dialog(path):
+    # Value ranges come from the parquet column statistics, no feature data is loaded
+    mz_min, mz_max = column_range(path, "mz")
+    rt_min, rt_max = column_range(path, "RT")
+    mz = st.slider("*m/z* range", mz_min, mz_max, value=(mz_min, mz_max))
+    rt = st.slider("RT range", rt_min, rt_max, value=(rt_min, rt_max))
     c1, c2 = st.columns(2)
-    charge = c1.selectbox(
-        "charge state", ["all"] + sorted(df["charge"].unique().tolist())
-    )
+    charge = c1.selectbox("charge state", ["all"] + unique_values(path, "charge"))
     adduct = "all"
-    if "adduct" in df.columns:
-        adduct = c2.selectbox(
-            "adduct", ["all"] + sorted(df["adduct"].unique().tolist())
-        )
+    if "adduct" in pq.read_schema(path).names:
+        adduct = c2.selectbox("adduct", ["all"] + unique_values(path, "adduct"))
     c1, c2 = st.columns(2)
     filter_annotation = c1.toggle("filter for annotation", False)
     filter_annotation_type = c2.selectbox("annotation type", ["all", "Spectral Matcher", "SIRIUS", "MS2Query"], 0)
-    # filter text
+    # filter text and query parameters
     filter_text = ""
-    if rt[0] > df["RT"].min():
+    fm_filter = {}
+    if rt[0] > rt_min:
         filter_text += f" **RT** min = {rt[0]};"
-    if rt[1] < df["RT"].max():
+    if rt[1] < rt_max:
         filter_text += f" **RT** max = {rt[1]};"
-    if mz[0] > df["mz"].min():
+    if rt != (rt_min, rt_max):
+        fm_filter["rt"] = rt
+    if mz[0] > mz_min:
         filter_text += f" ***m/z*** min = {mz[0]};"
-    if mz[1] < df["mz"].max():
+    if mz[1] < mz_max:
         filter_text += f" ***m/z*** max = {mz[1]};"
+    if mz != (mz_min, mz_max):
+        fm_filter["mz"] = mz
     if filter_annotation:
         filter_text += f" **Annotations:** {filter_annotation_type};"
         cols = ["SpectralMatch", "SIRIUS_", "CSI:FingerID", "CANOPUS", "MS2Query"]
@@ -76,19 +91,15 @@ def filter_dialog(df):
             mask = cols[1:4]
         elif filter_annotation_type == "MS2Query":
             mask = [cols[-1]]
-        df_annotation = df[
-            [c for c in df.columns if any([c.startswith(k) for k in mask])]
-        ].replace('', pd.NA).dropna(how="all")
-        df = df.loc[df_annotation.index, :]
+        fm_filter["annotation_prefixes"] = mask
     if charge != "all":
         filter_text += f" **charge** = {charge};"
-        df = df[df["charge"] == int(charge)]
+        fm_filter["charge"] = int(charge)
     if adduct != "all":
         filter_text += f" **adduct** = {adduct};"
-        df = df[df["adduct"] == adduct]
-    df = df[(df["mz"] >= mz[0]) & (df["mz"] <= mz[1])]
-    df = df[(df["RT"] >= rt[0]) & (df["RT"] <= rt[1])]
-    if df.empty:
+        fm_filter["adduct"] = adduct
+    n_features = count(path, build_filter(path, **fm_filter))
+    if n_features == 0:
         st.warning(
             "⚠️ Feature Matrix is empty after filtering. Filter will not be applied."
         )
@@ -97,75 +108,96 @@ def filter_dialog(df):
         st.rerun()
 
     if c2.button("Apply", type="primary", use_container_width=True):
-        if len(df) != len_unfiltered and not df.empty:
-            st.session_state["feature-matrix-filtered"] = df
+        if fm_filter and n_features > 0:
+            st.session_state["fm-filter"] = fm_filter
             st.session_state["fm-filter-info"] = filter_text.rstrip(";")
         st.rerun()
 
 
+def build_results_bundle(feature_matrix):
+    """Builds the results bundle with the export_results_bundle script (for results of older workflow runs)."""
+    path = Path("src", "python-tools", "export_results_bundle.py")
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.build_results_bundle(feature_matrix)
+
+
+# Columns of the results bundle shown in the table and consensus map
+VIEW_COLUMNS = ["intensity", "RT", "mz", "charge", "adduct", "mean", "hover"]
+
+
+@cache_result
+def load_results_bundle(path, fm_filter=None):
+    """
+    Loads the view columns of the results bundle (filtered, if a filter is given as JSON string)
+    as Arrow table once per file modification time (key), reruns are served from memory.
+    """
+    expression = build_filter(path, **json.loads(fm_filter)) if fm_filter else None
+    return query_table(path, expression, VIEW_COLUMNS)
+
+
+@cache_result
+def load_metabolite(path, metabolite):
+    """Reads all columns of a single metabolite from the results bundle."""
+    return query(path, build_filter(path, metabolite=metabolite)).iloc[0]
+
+
 def metabolite_selection():
-    df = load_parquet(
-        Path(st.session_state.results_dir, "consensus-dfs", "feature-matrix.parquet")
+    feature_matrix = Path(
+        st.session_state.results_dir, "consensus-dfs", "feature-matrix.parquet"
     )
-
-    if df.empty:
+    if not feature_matrix.exists():
         st.error("FeatureMatrix is empty.")
         return None
+    path = Path(feature_matrix.parent, "feature-matrix-view.parquet")
+    if not path.exists() or path.stat().st_mtime < modification_time(feature_matrix):
+        build_results_bundle(feature_matrix)
+    samples = json.loads(pq.read_schema(path).metadata[b"samples"])
 
-    sample_cols = sorted([col for col in df.columns if col.endswith(".mzML")])
+    if count(path) == 0:
+        st.error("FeatureMatrix is empty.")
+        return None
 
-    # Insert a column with normalized intensity values to display as barchart column in dataframe
-    df.insert(
-        1,
-        "intensity",
-        df.apply(lambda row: [int(row[col]) for col in sample_cols], axis=1),
-    )
-    df["intensity"] = df["intensity"].apply(
-        lambda intensities: [i / max(intensities) for i in intensities]
-    )
     c1, c2, c3 = st.columns([0.5, 0.25, 0.25])
-    if "feature-matrix-filtered" in st.session_state:
+    if "fm-filter" in st.session_state:
         if c2.button("❌ Reset", use_container_width=True):
-            del st.session_state["feature-matrix-filtered"]
+            del st.session_state["fm-filter"]
             del st.session_state["fm-filter-info"]
             st.rerun()
         st.success(st.session_state["fm-filter-info"])
     if c3.button("🔎 Filter", use_container_width=True):
-        filter_dialog(df)
-    if "feature-matrix-filtered" in st.session_state:
-        if not st.session_state["feature-matrix-filtered"].empty:
-            df = st.session_state["feature-matrix-filtered"]
-    c1.markdown(f"**Feature Matrix** ({df.shape[0]} metabolites)")
+        filter_dialog(str(path))
+    fm_filter = None
+    if "fm-filter" in st.session_state:
+        fm_filter = json.dumps(st.session_state["fm-filter"], sort_keys=True)
+    table = load_results_bundle(str(path), fm_filter, key=file_key(path, fm_filter))
+    c1.markdown(f"**Feature Matrix** ({table.num_rows} metabolites)")
 
     tab1, tab2 = st.tabs(["✅ **Selection**", "👀 View"])
     with tab2:
-        fig = plot_consensus_map(df)
+        fig = plot_consensus_map(table, key=file_key(path, fm_filter))
         show_fig(fig, "consensus-map")
     with tab1:
-        event = st.dataframe(
-            df,
-            column_order=["intensity", "RT", "mz", "charge", "adduct"],
-            hide_index=False,
+        # only the rows of the current page are sent to the browser
+        metabolite = index_column(path)
+        row = display_paginated_table(
+            table,
+            "feature-matrix",
+            [metabolite, "intensity", "RT", "mz", "charge", "adduct"],
+            cache_key=file_key(path, fm_filter),
             column_config={
                 "intensity": st.column_config.BarChartColumn(
                     width="small",
-                    help=", ".join(
-                        [
-                            str(Path(col).stem)
-                            for col in sorted(df.columns)
-                            if col.endswith(".mzML")
-                        ]
-                    ),
+                    help=", ".join([str(Path(col).stem) for col in samples]),
                 ),
             },
             height=300,
             use_container_width=True,
-            on_select="rerun",
-            selection_mode="single-row",
         )
-        rows = event.selection.rows
-        if rows:
-            return df.iloc[rows[0], :]
+        if row is not None:
+            name = table[metabolite][row].as_py()
+            return load_metabolite(str(path), name, key=file_key(path, name))
         st.info(
             "💡 Select a row (metabolite) in the feature matrix for more information."
         )
@@ -183,11 +215,20 @@ def metabolite_metrics(metabolite):
     with cols[3]:
         st.metric("re-quantified", metabolite["re-quantified"])
     with cols[4]:
-        if "adduct" in metabolite:
+        # adducts are only available with adduct detection
+        if "adduct" in metabolite.index and pd.notna(metabolite["adduct"]):
             st.metric("adduct", metabolite["adduct"])
 
 
-@st.cache_data
+def metabolite_key(metabolite):
+    """Result cache key of a metabolite (row of the results bundle): bundle file, modification time and name."""
+    return file_key(
+        Path(st.session_state.results_dir, "consensus-dfs", "feature-matrix-view.parquet"),
+        metabolite.name,
+    )
+
+
+@cache_result
 def get_chroms_for_each_sample(metabolite):
     # Get index of row in df where "metabolite" is equal to metabolite
     all_samples = [
@@ -197,16 +238,16 @@ def get_chroms_for_each_sample(metabolite):
     for sample in all_samples:
         # Get feature ID for sample
         fid = metabolite[sample + ".mzML_IDs"]
-        path = Path(
-            st.session_state.results_dir,
-            "ffmid-df" if metabolite["re-quantified"] else "ffm-df",
-            sample + ".parquet",
-        )
-        f_df = load_parquet(path)
-        if fid in f_df.index:
-            f_df = f_df.loc[[fid]]
-            f_df["sample"] = [sample]
-            dfs.append(f_df.loc[[fid]])
+        # detected (ffm-df) or, for missing values only, re-quantified (ffmid-df) feature
+        for name in ["ffm-df", "ffmid-df"]:
+            path = Path(st.session_state.results_dir, name, sample + ".parquet")
+            if path.exists():
+                f_df = load_parquet(path)
+                if fid in f_df.index:
+                    f_df = f_df.loc[[fid]]
+                    f_df["sample"] = [sample]
+                    dfs.append(f_df)
+                    break
         else:
             dfs.append(pd.DataFrame({"sample": [sample], "chrom_RT": [None], "chrom_intensity": [None]}))
 
@@ -216,8 +257,8 @@ def get_chroms_for_each_sample(metabolite):
     return df
 
 
-@st.cache_resource
-def get_feature_chromatogram_plot(df):
+@cache_result
+def get_feature_chromatogram_plot(df, rt_range=None):
     df = df.sort_values("sample")
     df = add_color_column(df)
     # Create an empty figure
@@ -225,12 +266,15 @@ def get_feature_chromatogram_plot(df):
     # Loop through each row in the DataFrame and add a line trace for each
     for _, row in df.iterrows():
         if row["chrom_RT"] is not None:
+            # downsampled, within the selected RT range if zoomed in
+            order = np.argsort(row["chrom_RT"], kind="stable")
+            rt = np.asarray(row["chrom_RT"])[order]
+            intensity = np.asarray(row["chrom_intensity"])[order]
+            i = downsample(rt, intensity, x_range=rt_range)
             fig.add_trace(
                 go.Scatter(
-                    x=row["chrom_RT"],  # Assuming chrom_RT is a list of values
-                    y=row[
-                        "chrom_intensity"
-                    ],  # Assuming chrom_intensity is a list of values
+                    x=rt[i],
+                    y=intensity[i],
                     mode="lines",  # Line plot
                     name=row["sample"],  # Giving each line a name based on its index
                     marker=dict(color=row["color"]),
@@ -249,7 +293,7 @@ def get_feature_chromatogram_plot(df):
     return fig
 
 
-@st.cache_resource
+@cache_result
 def get_feature_intensity_plot(metabolite):
     df = pd.DataFrame(
         {
@@ -350,43 +394,12 @@ def ms2query_summary(s):
             st.image(img, use_container_width=True)
 
 
-@st.cache_resource
-def plot_consensus_map(df):
+@cache_result
+def plot_consensus_map(table):
+    """Consensus map from the precomputed results bundle columns, cached by bundle and filter (key)."""
     fig = go.Figure()
 
-    df["mean"] = df.loc[:, [c for c in df.columns if c.endswith(".mzML")]].mean(axis=1)
-    df = df.sort_values("mean")
-
-    # define custom data for hovering
-    meta_values = [
-        df.index,
-        df["mz"].round(5),
-        df["RT"].round(),
-        df["mean"],
-        df["charge"],
-        df["quality"],
-    ]
-
-    hovertemplate = """
-<b>name: %{customdata[0]}<br>
-mz: %{customdata[1]}<br>
-RT: %{customdata[2]}<br>
-intensity: %{customdata[3]}<br>
-charge: %{customdata[4]}<br>
-quality: %{customdata[5]}<br>
-"""
-
-    if "adduct" in df.columns:
-        meta_values.append(df["adduct"])
-        hovertemplate += "adduct: %{customdata[6]}<br>"
-
-    for s in [col for col in df.columns if col.endswith("mzML")]:
-        meta_values.append(df[s])
-        hovertemplate += (
-            s[:-5] + ": %{customdata[" + str(len(meta_values) - 1) + "]}<br>"
-        )
-
-    customdata = np.stack(meta_values, axis=-1)
+    df = table.select(["RT", "mz", "mean", "hover"]).to_pandas().sort_values("mean")
 
     fig.add_trace(
         go.Scattergl(
@@ -397,8 +410,8 @@ quality: %{customdata[5]}<br>
             marker_color=df["mean"],
             marker_symbol="square",
             marker_size=12,
-            customdata=customdata,
-            hovertemplate=hovertemplate,
+            text=df["hover"],
+            hovertemplate="%{text}",
         )
     )
     fig.update_layout(
@@ -416,22 +429,40 @@ quality: %{customdata[5]}<br>
 
     return fig
 
+def result_files(results_dir):
+    """Files and directories of a workflow run which are included in the results download."""
+    feature_matrix = Path(results_dir, "consensus-dfs", "feature-matrix.parquet")
+    # the feature matrix joined with all annotations, tsv is only created here
+    paths = materialize(feature_matrix, Path(results_dir, "export"))
+    # create meta value template dataframe
+    path = Path(results_dir, "meta-value-template.tsv")
+    if not path.exists() or path.stat().st_mtime < modification_time(feature_matrix):
+        columns = pq.read_schema(feature_matrix).names
+        df = pd.DataFrame(
+            {"Sample_Type": ""}, index=[col for col in columns if col.endswith(".mzML")]
+        )
+        df.index.name = "filename"
+        df.to_csv(path, sep="\t")
+    paths.append(path)
+    for name in ["ffm-df", "ffmid-df", "sirius-export", "sirius-consensus", "gnps-export", "molecular-network", "ms2-clusters", "ms2-cluster-membership", "pruned-features"]:
+        path = Path(results_dir, name)
+        if path.exists():
+            paths.append(path)
+    return paths
+
+
 def download_section(workflow_dir):
     with st.popover("⬇️ Downloads", use_container_width=True):
         if st.button(
             "Prepare files for download", use_container_width=True
         ):
-            with open(
-                Path(workflow_dir, "results", "results.zip"), "rb"
-            ) as fp:
-                st.success("Files are ready.")
-                st.download_button(
-                    label="⬇️ Download Now",
-                    data=fp,
-                    file_name="UmetaFlow-results.zip",
-                    mime="application/zip",
-                    use_container_width=True,
-                )
+            # The archive is only created on request and re-used as long as no result file changed
+            results_dir = Path(workflow_dir, "results")
+            download_archive(
+                collect_files(result_files(results_dir)),
+                Path(results_dir, "results.zip"),
+                "UmetaFlow-results.zip",
+            )
         st.markdown("""**Feature Matrix**:
                         
 The main result file with consensus feature meta data (*m/z*, retention time, charge, adduct), intensities, annotations and additional information such as original & consensus feature IDs (for mapping with sample feature map data) and re-quantification status. In **tsv** and **parquet** format.
@@ -446,11 +477,23 @@ Dataframes for feature information on sample level. Containing meta data, intens
                         
 **SIRIUS Input Files**
                         
-Input files for SIRIUS in the **sirius-export** directory. Useful to run SIRIUS independently for instance in the GUI app. In **.ms** file format.
+Input files for SIRIUS in the **sirius-export** directory. Useful to run SIRIUS independently for instance in the GUI app. In **.ms** file format. If SIRIUS was run per consensus feature, the merged input files are in the **sirius-consensus** directory.
 
 **GNPS Input Files**
 
-Input files for GNPS FBMN and IIMN in the **gnps-export** directory.                 
+Input files for GNPS FBMN and IIMN in the **gnps-export** directory.
+
+**Pruned Features**
+
+Consensus features removed after feature linking with the reason (blank, frequency or QC CV), their sample/blank ratio, detection frequency and QC CV in the **pruned-features** directory. In **parquet** file format.
+
+**MS2 Clusters**
+
+Consensus spectra of the MS2 spectrum clusters in the **ms2-clusters** directory (**mgf** format) and the cluster of each MS2 spectrum with its sample, feature and consensus feature in the **ms2-cluster-membership** directory (**parquet** format), if MS2 spectra were clustered.
+
+**Molecular Network**
+
+Edges of the locally computed molecular network (modified cosine, matched peaks, *m/z* difference and component) in the **molecular-network** directory. In **parquet** file format.                 
 """)
         
 def help_section():
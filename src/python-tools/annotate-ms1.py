@@ -4,6 +4,9 @@ from pathlib import Path
 import zipfile
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix, write_annotations
+
 ############################
 # default paramter values #
 ###########################
@@ -40,9 +43,10 @@ def get_params():
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
-    df = pd.read_parquet(params["in"][0])
+    # Only m/z and RT are needed, annotations are stored as sidecar of the feature matrix
+    df = read_feature_matrix(params["in"][0], columns=["mz", "RT"])
     library = pd.read_csv(params["in_lib"], sep="\t")
-    df.insert(2, "MS1 annotation", "")
+    annotations = pd.Series("", index=df.index, name="MS1 annotation")
 
     df["mz"] = df["mz"].astype(float)
 
@@ -55,16 +59,10 @@ if __name__ == "__main__":
         match = df.query(
             "mz > @mz_lower and mz < @mz_upper and RT > @rt_lower and RT < @rt_upper"
         )
-        if not match.empty:
-            for _, row in match.iterrows():
-                if len(df.loc[df["metabolite"] == row["metabolite"], "MS1 annotation"]) > 1:
-                    df.loc[df["metabolite"] == row["metabolite"], "MS1 annotation"] += (
-                        ";" + std["name"]
-                    )
-                else:
-                    df.loc[df["metabolite"] == row["metabolite"],
-                            "MS1 annotation"] += std["name"]
-
+        for metabolite in match.index:
+            if annotations[metabolite]:
+                annotations[metabolite] += ";" + std["name"]
+            else:
+                annotations[metabolite] += std["name"]
 
-    df.to_parquet(params["in"][0])
-    df.to_csv(Path(params["in"][0]).with_suffix(".tsv"), sep="\t")
\ No newline at end of file
+    write_annotations(params["in"][0], "ms1", annotations.to_frame())
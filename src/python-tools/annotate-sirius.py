@@ -2,6 +2,10 @@ import json
 import sys
 from pathlib import Path
 import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix, write_annotations
 
 ############################
 # default paramter values #
@@ -33,44 +37,85 @@ def get_params():
     else:
         return {}
 
+# tool, summary file and columns of SIRIUS project results
+SUMMARIES = [
+    (
+        "CSI:FingerID",
+        "compound_identifications.tsv",
+        ["molecularFormula", "name", "InChI", "smiles"],
+    ),
+    ("SIRIUS", "formula_identifications.tsv", ["molecularFormula"]),
+    (
+        "CANOPUS",
+        "canopus_compound_summary.tsv",
+        [
+            "NPC#pathway",
+            "NPC#superclass",
+            "NPC#class",
+            "ClassyFire#most specific class",
+        ],
+    ),
+]
+
+def project_results(project_dir, compound_id):
+    """
+    Results of a SIRIUS project for each tool and column.
+
+    Args:
+        project_dir (Path): SIRIUS project directory.
+        compound_id (function): Feature ID from the SIRIUS compound ID.
+
+    Returns:
+        dict: (tool, column) -> dict feature ID -> value.
+    """
+    results = {}
+    for tool, annotation_file, cols in SUMMARIES:
+        file = Path(project_dir, annotation_file)
+        if file.exists():
+            df_tmp = pd.read_csv(file, sep="\t")
+            df_tmp["id"] = df_tmp["id"].apply(compound_id)
+            for col in cols:
+                results[(tool, col)] = df_tmp.set_index("id")[col].to_dict()
+    return results
+
+def column_name(tool, name, col):
+    return f"{tool}_{name}_{col.replace('NPC#', '').replace('ClassyFire#', '')}"
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
-    df = pd.read_parquet(params["in"][0])
-    sirius_projects_dir = Path(Path(params["in"][0]).parent.parent, "sirius-projects")
+    # Only the feature ID columns are needed, annotations are stored as sidecar of the feature matrix
+    df = read_feature_matrix(
+        params["in"][0],
+        [c for c in pq.read_schema(params["in"][0]).names if c.endswith(".mzML_IDs")]
+        + ["consensus_feature_id"],
+    )
+    annotations = pd.DataFrame(index=df.index)
+    results_dir = Path(params["in"][0]).parent.parent
+    # projects of each sample, compound IDs from SiriusExport contain the sample feature ID
+    sirius_projects_dir = Path(results_dir, "sirius-projects")
     if sirius_projects_dir.exists():
         for result_directory in sirius_projects_dir.iterdir():
             if result_directory.is_dir():
-                for tool, annotation_file, cols in zip(
-                    ["CSI:FingerID", "SIRIUS", "CANOPUS"],
-                    [
-                        "compound_identifications.tsv",
-                        "formula_identifications.tsv",
-                        "canopus_compound_summary.tsv",
-                    ],
-                    [
-                        ["molecularFormula", "name", "InChI", "smiles"],
-                        ["molecularFormula"],
-                        [
-                            "NPC#pathway",
-                            "NPC#superclass",
-                            "NPC#class",
-                            "ClassyFire#most specific class",
-                        ],
-                    ],
-                ):
-                    file = Path(result_directory, annotation_file)
-                    if file.exists():
-                        df_tmp = pd.read_csv(file, sep="\t")
-                        df_tmp["id"] = df_tmp["id"].apply(
-                            lambda x: x.split("_0_")[1].split("-")[0]
-                        )
-                        for col in cols:
-                            df[
-                                f"{tool}_{result_directory.name}_{col.replace('NPC#', '').replace('ClassyFire#', '')}"
-                            ] = df[f"{result_directory.name}.mzML_IDs"].map(
-                                df_tmp.set_index("id")[col].to_dict()
-                            )
+                results = project_results(
+                    result_directory, lambda x: x.split("_0_")[1].split("-")[0]
+                )
+                for (tool, col), values in results.items():
+                    annotations[column_name(tool, result_directory.name, col)] = df[
+                        f"{result_directory.name}.mzML_IDs"
+                    ].map(values)
+    # projects of consensus features (one per run), compound names are consensus feature IDs
+    consensus_projects_dir = Path(results_dir, "sirius-projects-consensus")
+    if consensus_projects_dir.exists():
+        consensus_id = df["consensus_feature_id"].astype(str)
+        for result_directory in sorted(consensus_projects_dir.iterdir()):
+            if result_directory.is_dir():
+                results = project_results(result_directory, lambda x: x.rsplit("_", 1)[1])
+                for (tool, col), values in results.items():
+                    name = column_name(tool, "consensus", col)
+                    values = consensus_id.map(values)
+                    annotations[name] = (
+                        annotations[name].fillna(values) if name in annotations else values
+                    )
 
-        df.to_parquet(params["in"][0])
-        df.to_csv(Path(params["in"][0]).with_suffix(".tsv"), sep="\t")
\ No newline at end of file
+    write_annotations(params["in"][0], "sirius", annotations)
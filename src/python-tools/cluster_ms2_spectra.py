@@ -0,0 +1,244 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.spectrallibrary import MAX_PEAKS, normalized_peaks
+from src.common.spectralsimilarity import (
+    connected_components,
+    flat_peaks,
+    padded_peaks,
+    ranges,
+    score_batch,
+)
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "feature matrix parquet", "hide": True},
+    {"key": "in_mapping", "value": [], "help": "MS2 spectrum to feature assignments (parquet) of the samples", "hide": True},
+    {"key": "in_mzML", "value": [], "help": "mzML files with the MS2 spectra (same order as in_mapping)", "hide": True},
+    {"key": "out", "value": [], "help": "mgf file with one consensus spectrum per cluster", "hide": True},
+    {"key": "out_membership", "value": [], "help": "cluster membership of the MS2 spectra (parquet)", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of files read in parallel", "hide": True},
+    {
+        "key": "mz_tolerance",
+        "name": "precursor m/z tolerance (ppm)",
+        "value": 10.0,
+        "min": 0.0,
+        "help": "Maximum precursor m/z difference of spectra in a cluster.",
+    },
+    {
+        "key": "rt_tolerance",
+        "name": "RT tolerance (s)",
+        "value": 10.0,
+        "min": 0.0,
+        "help": "Maximum retention time difference (after map alignment) of spectra in a cluster.",
+    },
+    {
+        "key": "min_score",
+        "name": "minimum cosine",
+        "value": 0.9,
+        "min": 0.0,
+        "max": 1.0,
+        "step_size": 0.05,
+        "help": "Minimum cosine score of spectra in a cluster.",
+    },
+    {
+        "key": "fragment_tolerance",
+        "name": "fragment tolerance (Da)",
+        "value": 0.02,
+        "min": 0.001,
+        "step_size": 0.005,
+        "help": "Fragment m/z tolerance for scoring and merging peaks.",
+    },
+]
+
+# Spectrum pairs scored at once
+BATCH_SIZE = 4096
+
+# Each spectrum is compared to the next spectra (by precursor m/z) within the tolerances,
+# replicate spectra are linked in chains, so a few neighbours are enough
+NEIGHBOURS = 20
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def sample_spectra(mapping, mzML):
+    """
+    MS2 spectra assigned to features of a sample with their normalized peaks.
+
+    Returns:
+        tuple: The assignments (pd.DataFrame) and a list of (m/z, intensity) peak arrays.
+    """
+    df = pd.read_parquet(mapping)
+    exp = poms.OnDiscMSExperiment()
+    if not exp.openFile(str(mzML)):
+        # mzML without index
+        exp = poms.MSExperiment()
+        poms.MzMLFile().load(str(mzML), exp)
+    peaks = []
+    for i in df["spectrum_index"]:
+        mz, intensity = exp.getSpectrum(int(i)).get_peaks()
+        peaks.append(normalized_peaks(np.column_stack([mz, intensity])))
+    return df, peaks
+
+def candidate_pairs(pmz, rt, mz_tolerance, rt_tolerance):
+    """Spectrum pairs within the precursor m/z (ppm) and RT tolerances, the next NEIGHBOURS by m/z."""
+    order = np.argsort(pmz, kind="stable")
+    hi = np.minimum(
+        np.searchsorted(pmz[order], pmz[order] * (1 + mz_tolerance * 1e-6), side="right"),
+        np.arange(len(pmz)) + NEIGHBOURS + 1,
+    )
+    a, b = ranges(np.arange(len(pmz)) + 1, np.maximum(hi, np.arange(len(pmz)) + 1))
+    a, b = order[a], order[b]
+    within = np.abs(rt[a] - rt[b]) <= rt_tolerance
+    return a[within], b[within]
+
+def consensus_spectra(cluster, mz, intensity, tolerance):
+    """
+    Consensus spectrum of each cluster: peaks of all spectra merged within tolerance (intensity
+    weighted m/z, mean intensity), the MAX_PEAKS most intense ones.
+
+    Returns:
+        tuple: Cluster, m/z and intensity of the consensus peaks, sorted by cluster and m/z.
+    """
+    spectrum, peak_mz, peak_intensity = flat_peaks(mz, intensity)
+    peak_cluster = cluster[spectrum]
+    order = np.lexsort((peak_mz, peak_cluster))
+    peak_cluster, peak_mz, peak_intensity = (
+        peak_cluster[order], peak_mz[order], peak_intensity[order].astype(np.float64)
+    )
+    new = np.ones(len(peak_mz), dtype=bool)
+    new[1:] = (np.diff(peak_mz) > tolerance) | (np.diff(peak_cluster) != 0)
+    group = np.cumsum(new) - 1
+    summed = np.bincount(group, peak_intensity)
+    merged_mz = np.bincount(group, peak_mz * peak_intensity) / np.where(summed > 0, summed, 1)
+    merged_cluster = peak_cluster[new]
+    merged_intensity = summed / np.bincount(cluster)[merged_cluster]
+    # most intense peaks of each cluster
+    order = np.lexsort((-merged_intensity, merged_cluster))
+    starts = np.searchsorted(merged_cluster[order], merged_cluster[order], side="left")
+    keep = order[np.arange(len(order)) - starts < MAX_PEAKS]
+    keep = keep[np.lexsort((merged_mz[keep], merged_cluster[keep]))]
+    return merged_cluster[keep], merged_mz[keep], merged_intensity[keep]
+
+def write_mgf(path, clusters, peak_cluster, peak_mz, peak_intensity):
+    """GNPS style mgf with one spectrum per cluster, feature ID of the representative consensus feature."""
+    starts = np.searchsorted(peak_cluster, np.arange(len(clusters) + 1))
+    with open(path, "w") as f:
+        for c, row in enumerate(clusters.itertuples()):
+            f.write(
+                f"BEGIN IONS\nOUTPUT=cluster_consensus\nSCANS={c + 1}\n"
+                f"FEATURE_ID=e_{row.representative}\nMSLEVEL=2\nCHARGE={row.charge}+\n"
+                f"PEPMASS={row.mz}\nRTINSECONDS={row.RT}\n"
+            )
+            # merged intensities are square root scaled (normalized peaks), written on linear scale
+            intensity = peak_intensity[starts[c] : starts[c + 1]] ** 2
+            intensity = intensity / intensity.max() * 1e4 if len(intensity) else intensity
+            f.writelines(
+                f"{m:.5f} {x:.1f}\n" for m, x in zip(peak_mz[starts[c] : starts[c + 1]], intensity)
+            )
+            f.write("END IONS\n\n")
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    in_path = params["in"][0]
+    columns = pq.read_schema(in_path).names
+    # MS2 spectra of all samples, files are read in parallel worker processes
+    num_threads = max(1, min(int(params["num_threads"]), len(params["in_mapping"])))
+    with ProcessPoolExecutor(num_threads) as executor:
+        results = list(executor.map(sample_spectra, params["in_mapping"], params["in_mzML"]))
+    matrix = pd.read_parquet(
+        in_path,
+        columns=["consensus_feature_id", "charge"]
+        + [
+            Path(m).stem + ".mzML_IDs"
+            for m in params["in_mapping"]
+            if Path(m).stem + ".mzML_IDs" in columns
+        ],
+    )
+    spectra, peaks = [], []
+    for mapping, (df, sample_peaks) in zip(params["in_mapping"], results):
+        id_column = Path(mapping).stem + ".mzML_IDs"
+        if id_column not in matrix.columns:
+            continue
+        # sample feature -> consensus feature
+        ids = matrix[id_column].notna().to_numpy()
+        consensus = pd.Series(
+            matrix["consensus_feature_id"].to_numpy()[ids],
+            index=matrix[id_column].to_numpy()[ids].astype(str),
+        )
+        df["consensus_feature_id"] = df["feature_id"].astype(str).map(consensus)
+        df["sample"] = Path(mapping).stem + ".mzML"
+        linked = df["consensus_feature_id"].notna().to_numpy()
+        spectra.append(df[linked])
+        peaks += [p for p, keep in zip(sample_peaks, linked) if keep]
+    spectra = pd.concat(spectra, ignore_index=True) if spectra else pd.DataFrame(
+        columns=["feature_id", "spectrum_index", "native_id", "RT", "mz", "consensus_feature_id", "sample"]
+    )
+    spectra["consensus_feature_id"] = spectra["consensus_feature_id"].astype("uint64")
+    mz, intensity = padded_peaks(peaks)
+    pmz, rt = spectra["mz"].to_numpy(dtype=float), spectra["RT"].to_numpy(dtype=float)
+
+    # clusters are the connected components of the similar spectrum pairs
+    tolerance = float(params["fragment_tolerance"])
+    a, b = candidate_pairs(pmz, rt, float(params["mz_tolerance"]), float(params["rt_tolerance"]))
+    scores = np.zeros(len(a))
+    for start in range(0, len(a), BATCH_SIZE):
+        i, j = a[start : start + BATCH_SIZE], b[start : start + BATCH_SIZE]
+        scores[start : start + BATCH_SIZE] = score_batch(
+            mz[i], intensity[i], flat_peaks(mz[j], intensity[j]), None, tolerance, False
+        )[0]
+    similar = scores >= float(params["min_score"])
+    labels = connected_components(len(spectra), a[similar], b[similar])
+    spectra["cluster"] = np.unique(labels, return_inverse=True)[1]
+
+    # representative of a cluster: the consensus feature with most spectra in it
+    counts = spectra.groupby(["cluster", "consensus_feature_id"]).size().rename("n").reset_index()
+    representative = counts.sort_values("n", ascending=False, kind="stable").drop_duplicates("cluster")
+    spectra["representative"] = spectra["cluster"].map(
+        representative.set_index("cluster")["consensus_feature_id"]
+    )
+    charge = pd.Series(matrix["charge"].to_numpy(), index=matrix["consensus_feature_id"].to_numpy())
+    clusters = spectra.groupby("cluster").agg(
+        representative=("representative", "first"), mz=("mz", "mean"), RT=("RT", "median")
+    )
+    clusters["charge"] = clusters["representative"].map(charge).fillna(0).abs().astype(int)
+    peak_cluster, peak_mz, peak_intensity = consensus_spectra(
+        spectra["cluster"].to_numpy(), mz, intensity, tolerance
+    )
+    Path(params["out"][0]).parent.mkdir(parents=True, exist_ok=True)
+    write_mgf(params["out"][0], clusters, peak_cluster, peak_mz, peak_intensity)
+    Path(params["out_membership"][0]).parent.mkdir(parents=True, exist_ok=True)
+    spectra[
+        ["cluster", "representative", "consensus_feature_id", "sample", "feature_id", "native_id", "RT", "mz"]
+    ].to_parquet(params["out_membership"][0], index=False)
+    print(f"{len(spectra)} MS2 spectra in {len(clusters)} clusters")
@@ -0,0 +1,85 @@
+import json
+import sys
+from pathlib import Path
+import pandas as pd
+import pyopenms as poms
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "mzML files", "hide": True},
+    {"key": "out_csv", "value": [], "help": "precursor correction tables (tsv), one per mzML file", "hide": True},
+    {"key": "out", "value": [], "help": "mzML files with the MS2 spectra only (corrected precursors)", "hide": True},
+    {"key": "mz_tolerance", "value": 100.0, "help": "m/z tolerance for the highest intensity MS1 peak", "hide": True},
+    {"key": "mz_tolerance_unit", "value": "ppm", "help": "unit of the m/z tolerance (ppm or Da)", "hide": True},
+]
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def correct_precursors(exp, mz_tolerance, ppm):
+    """
+    Corrects the precursor m/z of MS2 spectra to the highest intensity peak in the preceding MS1
+    spectrum (like HighResPrecursorMassCorrector) in place.
+
+    Returns:
+        pd.DataFrame: Index (in the MS2 only mzML file), native ID, RT, uncorrected and corrected
+        precursor m/z of each MS2 spectrum.
+    """
+    uncorrected = [
+        spec.getPrecursors()[0].getMZ()
+        for spec in exp
+        if spec.getMSLevel() == 2 and spec.getPrecursors()
+    ]
+    if mz_tolerance > 0:
+        poms.PrecursorCorrection.correctToHighestIntensityMS1Peak(exp, mz_tolerance, ppm, [], [], [])
+    ms2 = [spec for spec in exp if spec.getMSLevel() == 2]
+    spectrum_index = [i for i, spec in enumerate(ms2) if spec.getPrecursors()]
+    ms2 = [ms2[i] for i in spectrum_index]
+    return pd.DataFrame(
+        {
+            "spectrum_index": spectrum_index,
+            "native_id": [spec.getNativeID() for spec in ms2],
+            "RT": [spec.getRT() for spec in ms2],
+            "precursor_mz": uncorrected,
+            "corrected_mz": [spec.getPrecursors()[0].getMZ() for spec in ms2],
+        }
+    )
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    # the raw data is not re-written, corrections are stored as small tables and applied to an MS2 only copy
+    for i, mzML in enumerate(params["in"]):
+        exp = poms.MSExperiment()
+        poms.MzMLFile().load(mzML, exp)
+        df = correct_precursors(
+            exp, float(params["mz_tolerance"]), params["mz_tolerance_unit"] == "ppm"
+        )
+        Path(params["out_csv"][i]).parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(params["out_csv"][i], sep="\t", index=False)
+        if params["out"]:
+            exp.setSpectra([spec for spec in exp if spec.getMSLevel() == 2])
+            Path(params["out"][i]).parent.mkdir(parents=True, exist_ok=True)
+            poms.MzMLFile().store(params["out"][i], exp)
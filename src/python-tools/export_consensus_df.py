@@ -2,8 +2,12 @@ import json
 import sys
 import pyopenms as poms
 from pathlib import Path
-import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.mzmlfiles import strip_compression_suffix
 
 ############################
 # default paramter values #
@@ -29,6 +33,9 @@ DEFAULTS = [
     {"key": "out", "value": [], "help": "consensus df parquet file", "hide": True}
 ]
 
+# Number of consensus features per record batch, bounds memory usage independent of cohort size
+BATCH_SIZE = 5000
+
 def get_params():
     if len(sys.argv) > 1:
         with open(sys.argv[1], "r") as f:
@@ -36,72 +43,108 @@ def get_params():
     else:
         return {}
 
-if __name__ == "__main__":
-    params = get_params()
-    # Add code here:
-    consensus_map = poms.ConsensusMap()
-    poms.ConsensusXMLFile().load(params["in"][0], consensus_map)
-    df = consensus_map.get_df().drop(["sequence"], axis=1)
-    for cf in consensus_map:
-        if cf.metaValueExists("best ion"):
-            df.insert(
-                4, "adduct", [cf.getMetaValue(
-                    "best ion") for cf in consensus_map]
-            )
-            break
+def existing_meta_values(consensus_map, keys):
+    """Keys of the meta values present in any consensus feature (stops once all are found)."""
+    found = set()
     for cf in consensus_map:
-        if cf.metaValueExists("label"):
-            df["name"] = [cf.getMetaValue("label") for cf in consensus_map]
+        found.update(key for key in keys if cf.metaValueExists(key))
+        if len(found) == len(keys):
             break
-    if "adduct" in df.columns:
-        df.insert(
-            0,
-            "metabolite",
-            [
-                f"{round(mz, 4)}@{round(rt, 2)}@{adduct}"
-                for mz, rt, adduct in zip(
-                    df["mz"].tolist(), df["RT"].tolist(), df["adduct"].tolist()
-                )
-            ],
-        )
-    else:
-        df.insert(
-            0,
-            "metabolite",
-            [
-                f"{round(mz, 4)}@{round(rt, 2)}"
-                for mz, rt in zip(df["mz"].tolist(), df["RT"].tolist())
-            ],
-        )
-    # annotate original feature IDs
-    fnames = [Path(value.filename).name for value in consensus_map.getColumnHeaders().values()]
+    return found
 
-    ids = [[] for _ in fnames]
+def export_consensus_df(consensus_map, path, requantified, batch_size=BATCH_SIZE):
+    """
+    Writes the consensus dataframe to parquet in record batches, so the converted table never
+    is in memory at once (the consensus map itself is, it is loaded completely). Optional columns
+    need one additional walk over the map (until the meta values are found) to set up the schema.
+    Columns: metabolite (index), charge, RT, mz, quality, adduct (optional), sample intensities,
+    name (optional), sample feature IDs (nullable strings), re-quantified and consensus_feature_id.
+    """
+    meta_values = existing_meta_values(consensus_map, ["best ion", "label"])
+    has_adduct = "best ion" in meta_values
+    has_label = "label" in meta_values
 
-    for cf in consensus_map:
-        fids = {f.getMapIndex(): f.getUniqueId() for f in cf.getFeatureList()}
-        for i, fname in enumerate(fnames):
-            if i in fids.keys():
-                ids[i].append(str(fids[i]))
-            else:
-                ids[i].append(pd.NA)
+    # sample columns in column header order, map index -> sample column
+    headers = consensus_map.getColumnHeaders()
+    samples = list(dict.fromkeys(strip_compression_suffix(h.filename) for h in headers.values()))
+    sample_index = {i: samples.index(strip_compression_suffix(h.filename)) for i, h in headers.items()}
 
-    for i, f in enumerate(fnames):
-        df[f"{fnames[i]}_IDs"] = ids[i]
+    fields = [
+        pa.field("metabolite", pa.string()),
+        pa.field("charge", pa.int32()),
+        pa.field("RT", pa.float64()),
+        pa.field("mz", pa.float64()),
+        pa.field("quality", pa.float32()),
+    ]
+    if has_adduct:
+        fields.append(pa.field("adduct", pa.string()))
+    fields += [pa.field(s, pa.float32()) for s in samples]
+    if has_label:
+        fields.append(pa.field("name", pa.string()))
+    fields += [pa.field(f"{s}_IDs", pa.string()) for s in samples]
+    fields += [
+        pa.field("re-quantified", pa.bool_()),
+        pa.field("consensus_feature_id", pa.uint64()),
+    ]
+    schema = pa.schema(fields)
+    # pandas metadata, so the metabolite column is read back as index
+    schema = schema.with_metadata(
+        pa.Schema.from_pandas(
+            schema.empty_table().to_pandas().set_index("metabolite")
+        ).metadata
+    )
 
-    # set re-quantified
-    if "ffmid" in params["out"][0]:
-        df["re-quantified"] = True
-    else:
-        df["re-quantified"] = False
+    def batches():
+        for start in range(0, consensus_map.size(), batch_size):
+            n = min(batch_size, consensus_map.size() - start)
+            cols = {k: [] for k in ["metabolite", "charge", "RT", "mz", "quality", "adduct", "name", "consensus_feature_id"]}
+            intensities = np.zeros((len(samples), n), dtype=np.float32)
+            ids = np.zeros((len(samples), n), dtype=np.uint64)
+            found = np.zeros((len(samples), n), dtype=bool)
+            for row in range(n):
+                cf = consensus_map[start + row]
+                mz, rt = cf.getMZ(), cf.getRT()
+                if has_adduct:
+                    adduct = cf.getMetaValue("best ion")
+                    cols["adduct"].append(adduct)
+                    cols["metabolite"].append(f"{round(mz, 4)}@{round(rt, 2)}@{adduct}")
+                else:
+                    cols["metabolite"].append(f"{round(mz, 4)}@{round(rt, 2)}")
+                if has_label:
+                    cols["name"].append(cf.getMetaValue("label"))
+                cols["charge"].append(cf.getCharge())
+                cols["RT"].append(rt)
+                cols["mz"].append(mz)
+                cols["quality"].append(cf.getQuality())
+                cols["consensus_feature_id"].append(cf.getUniqueId())
+                for fh in cf.getFeatureList():
+                    i = sample_index[fh.getMapIndex()]
+                    intensities[i, row] = fh.getIntensity()
+                    ids[i, row] = fh.getUniqueId()
+                    found[i, row] = True
+            arrays = {k: v for k, v in cols.items() if k in schema.names}
+            arrays.update({s: intensities[i] for i, s in enumerate(samples)})
+            # feature IDs as strings, null if the sample has no feature
+            arrays.update(
+                {
+                    f"{s}_IDs": pa.array(ids[i], mask=~found[i]).cast(pa.string())
+                    for i, s in enumerate(samples)
+                }
+            )
+            arrays["re-quantified"] = [requantified] * n
+            yield pa.record_batch([arrays[name] for name in schema.names], schema=schema)
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches():
+            writer.write_batch(batch)
 
-    # Rename columns to not show full file path
-    df = df.rename(columns={col: Path(col).name for col in df.columns if Path(col).exists()})
-    
-    df["consensus_feature_id"] = df.index
-    df = df.set_index("metabolite")
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    consensus_map = poms.ConsensusMap()
+    poms.ConsensusXMLFile().load(params["in"][0], consensus_map)
 
-    path = Path(params["out"][0])
-    df.to_parquet(path)
-    # save additionally as tsv file
-    df.to_csv(path.with_suffix(".tsv"), sep="\t")
\ No newline at end of file
+    # the tsv file is only written on export (with annotations)
+    export_consensus_df(
+        consensus_map, Path(params["out"][0]), "ffmid" in params["out"][0]
+    )
@@ -4,6 +4,9 @@ import pyopenms as poms
 from pathlib import Path
 import numpy as np
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.mzmlfiles import load_trafo
+
 ############################
 # default paramter values #
 ###########################
@@ -25,6 +28,7 @@ import numpy as np
 
 DEFAULTS = [
     {"key": "in", "value": [], "help": "ffm featureXML dir", "hide": True},
+    {"key": "trafo", "value": [], "help": "trafoXML files for the chromatogram RTs (same order as in, optional)", "hide": True},
 ]
 
 def get_params():
@@ -40,7 +44,7 @@ if __name__ == "__main__":
     out_path = Path(Path(params["in"][0]).parent.parent, "ffm-df")
     if not out_path.exists():
         out_path.mkdir(exist_ok=True)
-    for file in Path(params["in"][0]).parent.glob("*.featureXML"):
+    for i, file in enumerate(map(Path, params["in"])):
         fm = poms.FeatureMap()
         poms.FeatureXMLFile().load(str(file), fm)
         # Get DataFrame with meta values
@@ -68,6 +72,10 @@ if __name__ == "__main__":
                     rts.append(chrom_rts)
                     intys.append(chrom_intys)
 
+        # chromatograms are extracted from the raw data, RTs are transformed like the aligned features
+        if params["trafo"]:
+            transform = load_trafo(params["trafo"][i])
+            rts = [transform(chrom_rts) if len(chrom_rts) else chrom_rts for chrom_rts in rts]
         df["chrom_RT"] = rts
         df["chrom_intensity"] = [[int(i) for i in chrom_int] for chrom_int in intys]
         
@@ -40,7 +40,7 @@ if __name__ == "__main__":
     out_path = Path(Path(params["in"][0]).parent.parent, "ffmid-df")
     if not out_path.exists():
         out_path.mkdir(exist_ok=True)
-    for file in Path(params["in"][0]).parent.glob("*.featureXML"):
+    for file in map(Path, params["in"]):
         fm = poms.FeatureMap()
         poms.FeatureXMLFile().load(str(file), fm)
         # Get DataFrame with meta values
@@ -59,13 +59,16 @@ if __name__ == "__main__":
         df["chrom_RT"] = rts
         df["chrom_intensity"] = [[int(i) for i in chrom_int] for chrom_int in intys]
 
+        # features are labeled with the consensus feature they re-quantify (FFMID library compound name)
         df = df.rename(columns={
             "model_FWHM": "FWHM",
             "dc_charge_adducts": "adduct",
-            "label": "metabolite"
+            "label": "consensus_feature_id"
         })
         
         df["FWHM"] = df["FWHM"].astype(float)
+
+        df.insert(12, "metabolite", df.apply(lambda x: f"{round(x['mz'], 4)}@{round(x['RT'], 2)}@{x['adduct']}", axis=1))
         
         df["re-quantified"] = True
         
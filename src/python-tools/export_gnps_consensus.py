@@ -0,0 +1,166 @@
+import json
+import sys
+from pathlib import Path
+import pandas as pd
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.mzmlfiles import strip_compression_suffix
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "feature matrix parquet", "hide": True},
+    {"key": "in_cm", "value": [], "help": "consensusXML file the feature matrix was exported from", "hide": True},
+    {"key": "in_fm", "value": [], "help": "featureXML files, in the order of the GNPSExport mzML files", "hide": True},
+    {"key": "in_ms2", "value": [], "help": "MS2 spectrum to feature assignments (parquet) of the featureXML files (same order)", "hide": True},
+    {"key": "out", "value": [], "help": "consensusXML file for GNPSExport", "hide": True},
+    {"key": "out_df", "value": [], "help": "feature matrix parquet with the consensus features which have MS2 spectra", "hide": True},
+]
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def peptide_identifications(ms2_df, identifier):
+    """
+    Empty peptide identifications (as from IDMapper) of the MS2 spectra assigned to features.
+
+    Returns:
+        dict: Feature ID -> list of poms.PeptideIdentification.
+    """
+    peptide_ids = {}
+    for fid, spectrum_index, native_id, rt, mz in zip(
+        ms2_df["feature_id"],
+        ms2_df["spectrum_index"],
+        ms2_df["native_id"],
+        ms2_df["RT"],
+        ms2_df["mz"],
+    ):
+        peptide_id = poms.PeptideIdentification()
+        peptide_id.setIdentifier(identifier)
+        peptide_id.setRT(float(rt))
+        peptide_id.setMZ(float(mz))
+        peptide_id.setMetaValue("spectrum_index", int(spectrum_index))
+        peptide_id.setMetaValue("spectrum_reference", str(native_id))
+        peptide_ids.setdefault(str(fid), []).append(peptide_id)
+    return peptide_ids
+
+def gnps_consensus_map(consensus_map, df, feature_maps, filenames, ms2_dfs):
+    """
+    Consensus map for GNPSExport from an existing consensus map: consensus features are grouped
+    as in the feature matrix (sample feature IDs, including re-quantified features) and annotated
+    with the MS2 spectra assigned to their features, like linking the feature maps again would.
+    Consensus features without MS2 spectra are removed.
+
+    Args:
+        consensus_map (poms.ConsensusMap): Consensus map the feature matrix was exported from.
+        df (pd.DataFrame): Feature matrix with consensus_feature_id and <sample>_IDs columns.
+        feature_maps (list[poms.FeatureMap]): Feature maps with mapped MS2 spectra (peptide IDs).
+        filenames (list[str]): mzML file of each feature map (column headers).
+        ms2_dfs (list[pd.DataFrame]): MS2 spectra assigned to the features of each feature map.
+
+    Returns:
+        poms.ConsensusMap: The consensus map.
+    """
+    gnps = poms.ConsensusMap()
+    headers = {}
+    for i, (fm, filename) in enumerate(zip(feature_maps, filenames)):
+        header = poms.ColumnHeader()
+        header.filename = filename
+        header.size = fm.size()
+        headers[i] = header
+    gnps.setColumnHeaders(headers)
+    gnps.setExperimentType("label-free")
+    gnps.setUniqueId(consensus_map.getUniqueId())
+    protein_id = poms.ProteinIdentification()
+    protein_id.setIdentifier("MS2")
+    gnps.setProteinIdentifications([protein_id])
+    ms2 = [peptide_identifications(ms2_df, "MS2") for ms2_df in ms2_dfs]
+    # sample feature ID -> feature, per map
+    features = [{str(f.getUniqueId()): f for f in fm} for fm in feature_maps]
+    id_columns = [strip_compression_suffix(filename) + "_IDs" for filename in filenames]
+    rows = dict(zip(df["consensus_feature_id"].astype(str), df[id_columns].to_numpy()))
+    for cf in consensus_map:
+        fids = rows.get(str(cf.getUniqueId()))
+        if fids is None:
+            continue
+        handles = [
+            (i, features[i][fid]) for i, fid in enumerate(fids) if fid in features[i]
+        ]
+        peptide_ids = []
+        for i, f in handles:
+            for peptide_id in ms2[i].get(str(f.getUniqueId()), []):
+                peptide_id.setMetaValue("map_index", i)
+                peptide_ids.append(peptide_id)
+        # consensus features without MS2 spectra are not exported to GNPS
+        if not peptide_ids:
+            continue
+        gnps_cf = poms.ConsensusFeature()
+        for i, f in handles:
+            feature = poms.BaseFeature()
+            feature.setRT(f.getRT())
+            feature.setMZ(f.getMZ())
+            feature.setIntensity(f.getIntensity())
+            feature.setCharge(f.getCharge())
+            feature.setWidth(f.getWidth())
+            feature.setUniqueId(f.getUniqueId())
+            gnps_cf.insert(i, feature)
+        gnps_cf.setRT(cf.getRT())
+        gnps_cf.setMZ(cf.getMZ())
+        gnps_cf.setIntensity(cf.getIntensity())
+        gnps_cf.setQuality(cf.getQuality())
+        gnps_cf.setCharge(cf.getCharge())
+        gnps_cf.setUniqueId(cf.getUniqueId())
+        if cf.metaValueExists("best ion"):
+            gnps_cf.setMetaValue("best ion", cf.getMetaValue("best ion"))
+        if cf.metaValueExists("LinkedGroups"):
+            gnps_cf.setMetaValue("LinkedGroups", cf.getMetaValue("LinkedGroups"))
+        gnps_cf.setPeptideIdentifications(peptide_ids)
+        gnps.push_back(gnps_cf)
+    return gnps
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    consensus_map = poms.ConsensusMap()
+    poms.ConsensusXMLFile().load(params["in_cm"][0], consensus_map)
+    feature_maps, filenames = [], []
+    for featureXML in params["in_fm"]:
+        fm = poms.FeatureMap()
+        poms.FeatureXMLFile().load(featureXML, fm)
+        feature_maps.append(fm)
+        # same file names as the column headers of the linked consensus map
+        runs = []
+        fm.getPrimaryMSRunPath(runs)
+        filenames.append(
+            Path(runs[0].decode()).name if runs else Path(featureXML).stem + ".mzML"
+        )
+    df = pd.read_parquet(params["in"][0])
+    ms2_dfs = [pd.read_parquet(path) for path in params["in_ms2"]]
+    gnps = gnps_consensus_map(consensus_map, df, feature_maps, filenames, ms2_dfs)
+    poms.ConsensusXMLFile().store(params["out"][0], gnps)
+    # feature matrix of the exported consensus features (same metabolites and IDs as the full feature matrix)
+    df[df["consensus_feature_id"].isin([cf.getUniqueId() for cf in gnps])].to_parquet(
+        params["out_df"][0]
+    )
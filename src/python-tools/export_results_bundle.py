@@ -0,0 +1,109 @@
+import json
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "Feature Matrix parquet file", "hide": True},
+]
+
+# Name of the results bundle next to the feature matrix
+BUNDLE_NAME = "feature-matrix-view.parquet"
+
+# Number of features per row group in the results bundle
+ROW_GROUP_SIZE = 10000
+
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+def build_results_bundle(feature_matrix):
+    """
+    Adds everything the results page needs on top of the feature matrix (joined with its
+    annotation sidecars) and stores it next to it:
+    normalized intensities for the bar chart column, mean intensities for the consensus map
+    colors and the hover text for each feature. Sample order is stored in the schema metadata.
+    Features are sorted by m/z.
+    """
+    df = read_feature_matrix(feature_matrix)
+    samples = sorted([col for col in df.columns if col.endswith(".mzML")])
+
+    # Intensities normalized to the maximum intensity per feature
+    intensities = np.floor(np.nan_to_num(df[samples].to_numpy(dtype=float)))
+    max_intensities = intensities.max(axis=1, initial=0, keepdims=True)
+    normalized = np.divide(
+        intensities,
+        max_intensities,
+        out=np.zeros_like(intensities),
+        where=max_intensities > 0,
+    )
+    df.insert(0, "intensity", list(normalized))
+    df["mean"] = df[samples].mean(axis=1)
+
+    # Hover text for the consensus map
+    hover = (
+        "<b>name: "
+        + pd.Series(df.index.astype(str), index=df.index)
+        + "<br>mz: "
+        + df["mz"].round(5).astype(str)
+        + "<br>RT: "
+        + df["RT"].round().astype(str)
+        + "<br>intensity: "
+        + df["mean"].astype(str)
+        + "<br>charge: "
+        + df["charge"].astype(str)
+        + "<br>quality: "
+        + df["quality"].astype(str)
+        + "<br>"
+    )
+    if "adduct" in df.columns:
+        hover += "adduct: " + df["adduct"].astype(str) + "<br>"
+    for sample in [col for col in df.columns if col.endswith("mzML")]:
+        hover += sample[:-5] + ": " + df[sample].astype(str) + "<br>"
+    df["hover"] = hover
+
+    # Sorted by m/z in row groups with column statistics, so filters on m/z (and other
+    # columns) are pushed down to the parquet scan and skip non-matching row groups
+    table = pa.Table.from_pandas(df.sort_values("mz"))
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, b"samples": json.dumps(samples).encode()}
+    )
+    path = Path(Path(feature_matrix).parent, BUNDLE_NAME)
+    pq.write_table(table, path, row_group_size=ROW_GROUP_SIZE, write_statistics=True)
+    return path
+
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    build_results_bundle(params["in"][0])
@@ -0,0 +1,133 @@
+import json
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "feature matrix parquet", "hide": True},
+    {"key": "in_ms", "value": [], "help": "SIRIUS .ms files of the samples (SiriusExport), file name as sample", "hide": True},
+    {"key": "skip", "value": [], "help": "consensus .ms files of previous runs, their consensus features are not exported again", "hide": True},
+    {"key": "out", "value": [], "help": "SIRIUS .ms file with one compound per consensus feature", "hide": True},
+]
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def ms_entries(path, feature_ids=None):
+    """
+    Compounds of a SIRIUS .ms file by sample feature ID (##fid), the first compound of each feature.
+    Only the feature IDs are collected if feature_ids is None, otherwise the compound text of
+    the given feature IDs.
+    """
+    entries, lines, fid = {}, [], None
+
+    def add():
+        if fid is not None and fid not in entries:
+            entries[fid] = "".join(lines) if feature_ids is not None else None
+
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith(">compound"):
+                add()
+                lines, fid = [], None
+            if line.startswith("##fid "):
+                fid = line[6:].strip()
+                if feature_ids is not None and fid not in feature_ids:
+                    fid = None
+            if feature_ids is not None:
+                lines.append(line)
+    add()
+    return entries
+
+def consensus_ids(path):
+    """Consensus feature IDs (compound names) of a consensus .ms file."""
+    with open(path, "r") as f:
+        return {line.split()[1] for line in f if line.startswith(">compound ")}
+
+def best_samples(df, samples, feature_ids):
+    """
+    Sample with the highest intensity among the samples which have a compound for the consensus
+    feature (-1 if none).
+
+    Args:
+        df (pd.DataFrame): Feature matrix with sample intensity and <sample>_IDs columns.
+        samples (list[str]): Sample columns.
+        feature_ids (list[set]): Sample feature IDs with a compound in the .ms file of each sample.
+
+    Returns:
+        np.ndarray: Sample index for each consensus feature.
+    """
+    has_compound = np.column_stack(
+        [df[f"{s}_IDs"].isin(ids).to_numpy() for s, ids in zip(samples, feature_ids)]
+    )
+    intensity = np.where(has_compound, df[samples].fillna(0).to_numpy(), -1)
+    best = np.argmax(intensity, axis=1)
+    best[~has_compound.any(axis=1)] = -1
+    return best
+
+def renamed_compound(text, consensus_id):
+    """Compound text with the consensus feature ID as compound name."""
+    rest = text.split("\n", 1)[1]
+    return f">compound {consensus_id}\n##cid {consensus_id}\n{rest}"
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    in_path = params["in"][0]
+    columns = pq.read_schema(in_path).names
+    ms_files = [
+        ms
+        for ms in params["in_ms"]
+        if Path(ms).stem + ".mzML" in columns and Path(ms).stat().st_size > 0
+    ]
+    samples = [Path(ms).stem + ".mzML" for ms in ms_files]
+    df = pd.read_parquet(
+        in_path, columns=["consensus_feature_id"] + samples + [f"{s}_IDs" for s in samples]
+    )
+    # consensus features of previous runs are already annotated
+    skip = set()
+    for path in params["skip"]:
+        skip |= consensus_ids(path)
+    df = df[~df["consensus_feature_id"].astype(str).isin(skip)]
+
+    best = best_samples(df, samples, [set(ms_entries(ms)) for ms in ms_files])
+    consensus_id = df["consensus_feature_id"].astype(str).to_numpy()
+    n = 0
+    Path(params["out"][0]).parent.mkdir(parents=True, exist_ok=True)
+    with open(params["out"][0], "w") as f:
+        # compounds of each sample are read once, for the consensus features it is the best sample of
+        for i, (ms, s) in enumerate(zip(ms_files, samples)):
+            rows = np.flatnonzero(best == i)
+            if not len(rows):
+                continue
+            fids = df[f"{s}_IDs"].to_numpy()[rows]
+            compounds = ms_entries(ms, set(fids))
+            for fid, cid in zip(fids, consensus_id[rows]):
+                f.write(renamed_compound(compounds[fid], cid))
+                n += 1
+    print(f"{n} consensus features exported for SIRIUS")
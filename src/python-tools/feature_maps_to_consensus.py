@@ -0,0 +1,85 @@
+import json
+import sys
+from pathlib import Path
+import pyopenms as poms
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "featureXML files", "hide": True},
+    {"key": "out", "value": [], "help": "consensusXML files", "hide": True},
+]
+
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+def consensus_map_from_feature_map(feature_map, filename):
+    """
+    Consensus map with one consensus feature per feature of a single sample, annotated like
+    features linked by FeatureLinkerUnlabeledKD (e.g. "best ion"), so a single sample can be
+    linked with existing consensus maps.
+
+    Args:
+        feature_map (poms.FeatureMap): Feature map of the sample.
+        filename (str): File name for the column header of the sample.
+
+    Returns:
+        poms.ConsensusMap: The consensus map.
+    """
+    # the grouping algorithm needs at least two maps, the empty one does not add any features
+    grouped = poms.ConsensusMap()
+    poms.FeatureGroupingAlgorithmKD().group([feature_map, poms.FeatureMap()], grouped)
+    consensus_map = poms.ConsensusMap()
+    header = poms.ColumnHeader()
+    header.filename = filename
+    header.size = feature_map.size()
+    consensus_map.setColumnHeaders({0: header})
+    consensus_map.setExperimentType("label-free")
+    consensus_map.ensureUniqueId()
+    for cf in grouped:
+        cf.ensureUniqueId()
+        consensus_map.push_back(cf)
+    return consensus_map
+
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    for featureXML, consensusXML in zip(params["in"], params["out"]):
+        feature_map = poms.FeatureMap()
+        poms.FeatureXMLFile().load(featureXML, feature_map)
+        # column header file name like FeatureLinkerUnlabeledKD (the mzML file of the sample)
+        ms_runs = []
+        feature_map.getPrimaryMSRunPath(ms_runs)
+        filename = (
+            ms_runs[0].decode()
+            if ms_runs
+            else str(Path(featureXML).with_suffix(".mzML"))
+        )
+        Path(consensusXML).parent.mkdir(parents=True, exist_ok=True)
+        poms.ConsensusXMLFile().store(
+            consensusXML, consensus_map_from_feature_map(feature_map, filename)
+        )
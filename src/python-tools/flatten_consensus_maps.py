@@ -0,0 +1,142 @@
+import json
+import sys
+import pyopenms as poms
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {
+        "key": "in",
+        "value": [],
+        "help": "consensusXML files linked from batch consensus maps, flattened in place",
+        "hide": True,
+    },
+    {
+        "key": "batches",
+        "value": [],
+        "help": "for each input file the list of batch consensusXML files it was linked from (in linking order)",
+        "hide": True,
+    },
+]
+
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+def flatten_consensus_map(consensus_map, batch_maps):
+    """
+    Replaces the handles of a consensus map linked from batch consensus maps (one handle per batch)
+    with the sub-elements of the linked batch consensus features, so the result has one column per
+    sample like a consensus map linked from all feature maps at once. Column headers are taken from
+    the batch maps in linking order. Consensus positions are re-computed from the sample features,
+    the adduct ("best ion") is taken from the highest quality batch consensus feature. Consensus
+    features which contain a consensus feature of the first batch map keep its unique ID.
+
+    Args:
+        consensus_map (poms.ConsensusMap): Consensus map linked from the batch maps.
+        batch_maps (list[poms.ConsensusMap]): Batch consensus maps, in the order they were linked.
+
+    Returns:
+        poms.ConsensusMap: The flattened consensus map.
+    """
+    # (batch map index, sample map index) -> map index in the flattened map
+    headers, map_index = {}, {}
+    for i, batch_map in enumerate(batch_maps):
+        for j, header in sorted(batch_map.getColumnHeaders().items()):
+            map_index[(i, j)] = len(headers)
+            headers[len(headers)] = header
+    # batch map index -> unique ID -> batch consensus feature
+    lookup = [{cf.getUniqueId(): cf for cf in batch_map} for batch_map in batch_maps]
+
+    flat = poms.ConsensusMap()
+    flat.setColumnHeaders(headers)
+    flat.setExperimentType(consensus_map.getExperimentType())
+    flat.setProteinIdentifications(consensus_map.getProteinIdentifications())
+    flat.setUnassignedPeptideIdentifications(
+        consensus_map.getUnassignedPeptideIdentifications()
+    )
+    flat.setUniqueId(consensus_map.getUniqueId())
+    for cf in consensus_map:
+        sub_features = [
+            (fh.getMapIndex(), lookup[fh.getMapIndex()][fh.getUniqueId()])
+            for fh in cf.getFeatureList()
+        ]
+        flat_cf = poms.ConsensusFeature()
+        for i, batch_cf in sub_features:
+            for fh in batch_cf.getFeatureList():
+                feature = poms.BaseFeature()
+                feature.setRT(fh.getRT())
+                feature.setMZ(fh.getMZ())
+                feature.setIntensity(fh.getIntensity())
+                feature.setCharge(fh.getCharge())
+                feature.setWidth(fh.getWidth())
+                feature.setUniqueId(fh.getUniqueId())
+                flat_cf.insert(map_index[(i, fh.getMapIndex())], feature)
+        flat_cf.computeConsensus()
+        flat_cf.setQuality(cf.getQuality())
+        flat_cf.setCharge(cf.getCharge())
+        # consensus features of the first batch map keep their ID (e.g. the existing consensus map
+        # when appending samples, re-quantified features refer to it)
+        first = [batch_cf for i, batch_cf in sub_features if i == 0]
+        flat_cf.setUniqueId(first[0].getUniqueId() if first else cf.getUniqueId())
+        flat_cf.setPeptideIdentifications(
+            [
+                peptide_id
+                for _, batch_cf in sub_features
+                for peptide_id in batch_cf.getPeptideIdentifications()
+            ]
+        )
+        annotated = [
+            batch_cf for _, batch_cf in sub_features if batch_cf.metaValueExists("best ion")
+        ]
+        if annotated:
+            best = max(annotated, key=lambda batch_cf: batch_cf.getQuality())
+            flat_cf.setMetaValue("best ion", best.getMetaValue("best ion"))
+        linked_groups = [
+            group
+            for _, batch_cf in sub_features
+            if batch_cf.metaValueExists("LinkedGroups")
+            for group in batch_cf.getMetaValue("LinkedGroups")
+        ]
+        if linked_groups:
+            flat_cf.setMetaValue("LinkedGroups", linked_groups)
+        flat.push_back(flat_cf)
+    return flat
+
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    for path, batch_paths in zip(params["in"], params["batches"]):
+        consensus_map = poms.ConsensusMap()
+        poms.ConsensusXMLFile().load(path, consensus_map)
+        batch_maps = []
+        for batch_path in batch_paths:
+            batch_map = poms.ConsensusMap()
+            poms.ConsensusXMLFile().load(batch_path, batch_map)
+            batch_maps.append(batch_map)
+        poms.ConsensusXMLFile().store(
+            path, flatten_consensus_map(consensus_map, batch_maps)
+        )
@@ -0,0 +1,281 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.mzmlfiles import load_trafo, strip_compression_suffix
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "feature matrix parquet", "hide": True},
+    {"key": "in_mzML", "value": [], "help": "mzML files, file name as sample", "hide": True},
+    {"key": "trafo", "value": [], "help": "trafoXML files with the RT transformations of the mzML files (same order, optional)", "hide": True},
+    {"key": "mz-tolerance", "value": 10.0, "help": "m/z tolerance in ppm for the extracted ion chromatograms", "hide": True},
+    {"key": "rt-window", "value": 30.0, "help": "RT window in seconds (centered on the consensus feature RT)", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of files processed in parallel", "hide": True},
+]
+
+# Number of consensus features integrated at once (limits memory for dense m/z regions)
+CHUNK_SIZE = 2000
+
+# Mass difference of the first (13C) isotope, areas of the M and M+1 traces are summed (like FFM and FFMID)
+C13_DELTA = 1.003355
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def ms1_index(mzML, index_dir):
+    """
+    MS1 peaks of an mzML file as flat arrays sorted by m/z (m/z, intensity, spectrum index) plus the
+    RT of each MS1 spectrum. The index is stored in npz format and re-used as long as it is newer
+    than the mzML file.
+    """
+    path = Path(index_dir, Path(strip_compression_suffix(mzML)).stem + ".npz")
+    if path.exists() and path.stat().st_mtime > Path(mzML).stat().st_mtime:
+        with np.load(path) as index:
+            return {k: index[k] for k in index.files}
+    exp = poms.MSExperiment()
+    options = poms.PeakFileOptions()
+    options.setMSLevels([1])
+    f = poms.MzMLFile()
+    f.setOptions(options)
+    f.load(str(mzML), exp)
+    spectra = [spec for spec in exp if spec.getMSLevel() == 1]
+    peaks = [spec.get_peaks() for spec in spectra]
+    mz = np.concatenate([p[0] for p in peaks] + [np.empty(0)])
+    order = np.argsort(mz, kind="stable")
+    index = {
+        "mz": mz[order],
+        "intensity": np.concatenate([p[1] for p in peaks] + [np.empty(0)]).astype(np.float32)[order],
+        "scan": np.repeat(np.arange(len(peaks), dtype=np.int32), [len(p[0]) for p in peaks])[order],
+        "scan_rt": np.array([spec.getRT() for spec in spectra], dtype=float),
+    }
+    np.savez(path, **index)
+    return index
+
+def transform_index(index, transform):
+    """
+    Transforms the spectrum RTs of an MS1 index. Non-monotonic transformations (e.g. lowess or
+    interpolated models) can change the spectrum order, spectra are re-sorted by transformed RT
+    (scan_rt has to be sorted for the RT window search) and the peak spectrum indices remapped.
+    """
+    scan_rt = transform(index["scan_rt"])
+    order = np.argsort(scan_rt, kind="stable")
+    if (np.diff(scan_rt) < 0).any():
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        index["scan"] = rank[index["scan"]].astype(np.int32)
+    index["scan_rt"] = scan_rt[order]
+    return index
+
+def integrate(index, mz, rt, mz_tolerance, rt_window):
+    """
+    Extracts ion chromatograms (maximum intensity per MS1 spectrum within the m/z tolerance) for
+    all target m/z and RT values at once and integrates them within the RT window.
+
+    Args:
+        index (dict): MS1 index of the file (see ms1_index).
+        mz (np.ndarray): Target m/z values.
+        rt (np.ndarray): Target RT values (seconds).
+        mz_tolerance (float): m/z tolerance in ppm.
+        rt_window (float): RT window in seconds.
+
+    Returns:
+        dict: Per target the peak area ("intensity"), apex RT ("RT"), intensity weighted m/z ("mz"),
+        RT and m/z boundaries, the fraction of spectra with signal ("quality") and the chromatogram
+        as a matrix of RTs and intensities (zero intensity outside the RT window).
+    """
+    scan_rt = index["scan_rt"]
+    n_scans = len(scan_rt)
+    # spectrum range per target
+    scan_lo = np.searchsorted(scan_rt, rt - rt_window / 2, side="left")
+    scan_hi = np.searchsorted(scan_rt, rt + rt_window / 2, side="right")
+    width = max(int((scan_hi - scan_lo).max(initial=0)), 1)
+    # peak range per target, expanded to one entry per (target, peak) pair
+    mz_delta = mz * mz_tolerance * 1e-6
+    peak_lo = np.searchsorted(index["mz"], mz - mz_delta, side="left")
+    peak_hi = np.searchsorted(index["mz"], mz + mz_delta, side="right")
+    counts = peak_hi - peak_lo
+    target = np.repeat(np.arange(len(mz)), counts)
+    peak = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + peak_lo[target]
+    col = index["scan"][peak] - scan_lo[target]
+    in_window = (col >= 0) & (col < scan_hi[target] - scan_lo[target])
+    target, peak, col = target[in_window], peak[in_window], col[in_window]
+    # chromatograms (maximum per spectrum) and intensity weighted m/z
+    chrom = np.zeros((len(mz), width), dtype=np.float32)
+    np.maximum.at(chrom, (target, col), index["intensity"][peak])
+    weights = np.bincount(target, index["intensity"][peak], minlength=len(mz))
+    mz_weighted = np.bincount(target, index["intensity"][peak] * index["mz"][peak], minlength=len(mz))
+    # RT of each chromatogram point, points outside of the window are masked
+    scans = scan_lo[:, None] + np.arange(width)
+    valid = scans < scan_hi[:, None]
+    chrom_rt = scan_rt[np.minimum(scans, n_scans - 1)] if n_scans else np.zeros(scans.shape)
+    chrom[~valid] = 0
+    # trapezoidal peak area
+    area = (
+        np.diff(chrom_rt, axis=1) * (chrom[:, 1:] + chrom[:, :-1]) / 2 * valid[:, 1:]
+    ).sum(axis=1)
+    signal = chrom > 0
+    has_signal = signal.any(axis=1)
+    first = signal.argmax(axis=1)
+    last = width - 1 - signal[:, ::-1].argmax(axis=1)
+    rows = np.arange(len(mz))
+    return {
+        "intensity": area,
+        "RT": chrom_rt[rows, chrom.argmax(axis=1)],
+        "mz": np.divide(mz_weighted, weights, out=mz.astype(float), where=weights > 0),
+        "RTstart": chrom_rt[rows, first],
+        "RTend": chrom_rt[rows, last],
+        "MZstart": mz - mz_delta,
+        "MZend": mz + mz_delta,
+        "quality": signal.sum(axis=1) / np.maximum(valid.sum(axis=1), 1),
+        "has_signal": has_signal,
+        "chrom_RT": chrom_rt,
+        "chrom_intensity": chrom,
+        "valid": valid,
+    }
+
+def integrate_features(index, mz, charge, rt, mz_tolerance, rt_window):
+    """
+    Integrates the monoisotopic and first isotope traces of features (in chunks of CHUNK_SIZE).
+    Returns the monoisotopic trace results (see integrate) with the summed area as "intensity".
+    """
+    isotope_mz = mz + C13_DELTA / np.maximum(np.abs(charge), 1)
+    results = []
+    for i in range(0, len(mz), CHUNK_SIZE):
+        chunk = slice(i, i + CHUNK_SIZE)
+        result = integrate(index, mz[chunk], rt[chunk], mz_tolerance, rt_window)
+        result["intensity"] = (
+            result["intensity"]
+            + integrate(index, isotope_mz[chunk], rt[chunk], mz_tolerance, rt_window)["intensity"]
+        )
+        results.append(result)
+    return results
+
+def fill_sample(mzML, trafo, df, ffmid_df_dir, index_dir, mz_tolerance, rt_window):
+    """
+    Integrates the consensus features missing in one sample and adds them to the re-quantified
+    features of that sample (ffmid-df, same format as from FeatureFinderMetaboIdent). Spectrum
+    RTs are transformed with the map alignment transformation (trafoXML file, optional) to match
+    the consensus feature RTs. Returns the number of re-quantified features.
+    """
+    sample = strip_compression_suffix(mzML)
+    missing = df[df[sample] == 0]
+    path = Path(ffmid_df_dir, Path(sample).stem + ".parquet")
+    previous = pd.read_parquet(path) if path.exists() else None
+    # features re-quantified in a previous run (append mode) are kept
+    if previous is not None:
+        missing = missing[
+            ~missing["consensus_feature_id"].astype(str).isin(previous["consensus_feature_id"])
+        ]
+    if missing.empty:
+        return 0
+    index = ms1_index(mzML, index_dir)
+    if trafo:
+        index = transform_index(index, load_trafo(trafo))
+    results = integrate_features(
+        index,
+        missing["mz"].to_numpy(float),
+        missing["charge"].to_numpy(),
+        missing["RT"].to_numpy(float),
+        mz_tolerance,
+        rt_window,
+    )
+    found = np.concatenate([r["has_signal"] for r in results])
+    if not found.any():
+        return 0
+    columns = ["RT", "mz", "RTstart", "RTend", "MZstart", "MZend", "quality", "intensity"]
+    values = {c: np.concatenate([r[c] for r in results])[found] for c in columns}
+    chroms = [
+        (rts[v].tolist(), intys[v].astype(int).tolist())
+        for r in results
+        for rts, intys, v in zip(r["chrom_RT"], r["chrom_intensity"], r["valid"])
+    ]
+    chroms = [c for c, f in zip(chroms, found) if f]
+    # random feature IDs (like OpenMS unique IDs)
+    feature_ids = np.random.default_rng().integers(1, 2**63, found.sum(), dtype=np.int64)
+    new = pd.DataFrame(
+        {
+            "charge": missing["charge"].to_numpy()[found].astype(np.int32),
+            **{c: values[c] for c in columns[:6]},
+            "quality": values["quality"].astype(np.float32),
+            "intensity": values["intensity"].astype(np.float32),
+            "num_of_masstraces": np.ones(found.sum(), dtype=np.int32),
+            "adduct": "nan",
+            "FWHM": np.nan,
+            "consensus_feature_id": missing["consensus_feature_id"].astype(str).to_numpy()[found],
+            "chrom_RT": [c[0] for c in chroms],
+            "chrom_intensity": [c[1] for c in chroms],
+        },
+        index=pd.Index(feature_ids.astype(str), name="feature_id"),
+    )
+    new.insert(12, "metabolite", [
+        f"{round(m, 4)}@{round(r, 2)}@{a}" for m, r, a in zip(new["mz"], new["RT"], new["adduct"])
+    ])
+    new["re-quantified"] = True
+    new["quality ranked"] = np.linspace(0, 1, len(new))
+    new = new.sort_values("quality ranked", ascending=False)
+    if previous is not None:
+        new = pd.concat([previous, new])
+    new.to_parquet(path)
+    return int(found.sum())
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    in_path = Path(params["in"][0])
+    samples = [c for c in pq.read_schema(in_path).names if c.endswith(".mzML")]
+    df = pd.read_parquet(in_path, columns=["charge", "RT", "mz", "consensus_feature_id"] + samples)
+    ffmid_df_dir = Path(in_path.parent.parent, "ffmid-df")
+    ffmid_df_dir.mkdir(exist_ok=True)
+    index_dir = Path(in_path.parent.parent, "ms1-index")
+    index_dir.mkdir(exist_ok=True)
+    files = [
+        (m, t)
+        for m, t in zip(params["in_mzML"], params["trafo"] or [""] * len(params["in_mzML"]))
+        if strip_compression_suffix(m) in samples
+    ]
+    mzML, trafos = [m for m, _ in files], [t for _, t in files]
+    # files are processed in parallel worker processes
+    with ProcessPoolExecutor(max(1, min(int(params["num_threads"]), len(mzML)))) as executor:
+        n = list(
+            executor.map(
+                fill_sample,
+                mzML,
+                trafos,
+                [df[["charge", "RT", "mz", "consensus_feature_id", strip_compression_suffix(m)]] for m in mzML],
+                [ffmid_df_dir] * len(mzML),
+                [index_dir] * len(mzML),
+                [float(params["mz-tolerance"])] * len(mzML),
+                [float(params["rt-window"])] * len(mzML),
+            )
+        )
+    for m, count in zip(mzML, n):
+        print(f"{strip_compression_suffix(m)}: {count} features re-quantified")
@@ -1,7 +1,10 @@
 import json
 import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+import pyopenms as poms
 
 ############################
 # default paramter values #
@@ -24,10 +27,13 @@ import pandas as pd
 
 DEFAULTS = [
     {"key": "in", "value": [], "help": "feature matrix parquet", "hide": True},
-    {"key": "out", "value": [], "help": "FFMID library tsv file", "hide": True},
-    {"key": "out_ffm", "value": [], "help": "feature matrix with complete consensus features parquet file", "hide": True}
+    {"key": "out", "value": [], "help": "FFMID library tsv files, one per sample (file name as sample)", "hide": True},
+    {"key": "trafo", "value": [], "help": "trafoXML files of the samples (same order as out, optional), library RTs are transformed back to the raw data", "hide": True},
 ]
 
+# Mass of a proton, to calculate neutral masses from m/z
+PROTON_MASS = 1.007825
+
 def get_params():
     if len(sys.argv) > 1:
         with open(sys.argv[1], "r") as f:
@@ -35,31 +41,52 @@ def get_params():
     else:
         return {}
 
-if __name__ == "__main__":
-    params = get_params()
-    # Add code here:
-    df = pd.read_parquet(params["in"][0])
-    # Select columns ending with ".mzML"
-    mzml_columns = df.filter(like='.mzML')
-    # Create a boolean mask for rows with zero values in these columns
-    mask = (mzml_columns == 0).any(axis=1)
-    # Keep the consensus features which don't have to be re-quantified
-    df[~mask].to_parquet(params["out_ffm"][0])
-    df[~mask].to_csv(Path(params["out_ffm"][0]).with_suffix(".tsv"), sep="\t")
-    # Filter the DataFrame using this mask
-    df = df[mask]
-
-    lib = pd.DataFrame(
+def library(df):
+    """FFMID library (tsv format) with the consensus features of a feature matrix, named by consensus feature ID."""
+    charge = df["charge"].to_numpy()
+    mz = df["mz"].to_numpy()
+    return pd.DataFrame(
         {
-            "CompoundName": df.index,
+            "CompoundName": df["consensus_feature_id"].astype(str).to_numpy(),
             "SumFormula": "",
             # calculate neutral mass if charge is not zero, else assume charge = 1
-            "Mass": df.apply(lambda x: x["mz"] * x["charge"] - x["charge"] * 1.007825 if x["charge"] else x["mz"] - 1.007825, axis=1),
-            "Charge": df["charge"],
-            "RetentionTime": df["RT"],
+            "Mass": np.where(charge != 0, mz * charge - charge * PROTON_MASS, mz - PROTON_MASS),
+            "Charge": charge,
+            "RetentionTime": df["RT"].to_numpy(),
             "RetentionTimeRange": 0,
             "IsoDistribution": 0,
         }
     )
-    lib.to_csv(params["out"][0], sep="\t", index=False)
-    
\ No newline at end of file
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    samples = [c for c in pq.read_schema(params["in"][0]).names if c.endswith(".mzML")]
+    df = pd.read_parquet(
+        params["in"][0], columns=["charge", "RT", "mz", "consensus_feature_id"] + samples
+    )
+    # re-quantified features of previous runs (when appending samples) are kept, they don't have to be searched again
+    ffmid_df_dir = Path(Path(params["in"][0]).parent.parent, "ffmid-df")
+    for i, path in enumerate(map(Path, params["out"])):
+        sample = path.stem + ".mzML"
+        # one library per sample with only the consensus features missing in that sample
+        missing = df[df[sample] == 0] if sample in samples else df.iloc[:0]
+        previous = Path(ffmid_df_dir, path.stem + ".parquet")
+        if previous.exists():
+            requantified = pd.read_parquet(previous, columns=["consensus_feature_id"])
+            missing = missing[
+                ~missing["consensus_feature_id"].astype(str).isin(requantified["consensus_feature_id"])
+            ]
+        # no library file for samples without missing values, FFMID is not run for them
+        if missing.empty:
+            path.unlink(missing_ok=True)
+        else:
+            df_library = library(missing)
+            if params["trafo"]:
+                trafo = poms.TransformationDescription()
+                poms.TransformationXMLFile().load(params["trafo"][i], trafo, True)
+                trafo.invert()
+                df_library["RetentionTime"] = np.vectorize(trafo.apply, otypes=[float])(
+                    df_library["RetentionTime"].to_numpy()
+                )
+            df_library.to_csv(path, sep="\t", index=False)
@@ -0,0 +1,155 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyopenms as poms
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.mzmlfiles import load_trafo
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "featureXML files", "hide": True},
+    {"key": "in_mzML", "value": [], "help": "mzML files with the MS2 spectra (same order as in)", "hide": True},
+    {"key": "in_precursors", "value": [], "help": "precursor correction tables (tsv) of the mzML files, read instead of the mzML files (same order, optional)", "hide": True},
+    {"key": "trafo", "value": [], "help": "trafoXML files with the RT transformations of the mzML files (same order, optional)", "hide": True},
+    {"key": "out", "value": [], "help": "MS2 spectrum to feature assignments (parquet), one per featureXML file", "hide": True},
+    {"key": "rt_tolerance", "value": 5.0, "help": "RT tolerance in seconds around the feature convex hull", "hide": True},
+    {"key": "mz_tolerance", "value": 20.0, "help": "m/z tolerance around the feature centroid m/z", "hide": True},
+    {"key": "mz_measure", "value": "ppm", "help": "unit of the m/z tolerance (ppm or Da)", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of files processed in parallel", "hide": True},
+]
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def precursors(mzML, precursor_table=""):
+    """
+    Index, native ID, RT and precursor m/z of the MS2 spectra. Taken from the precursor correction
+    table if available, otherwise from the mzML file without loading any peak data.
+    """
+    if precursor_table and Path(precursor_table).exists():
+        df = pd.read_csv(precursor_table, sep="\t")
+        if "spectrum_index" in df.columns:
+            return df.rename(columns={"corrected_mz": "mz"})[
+                ["spectrum_index", "native_id", "RT", "mz"]
+            ]
+    options = poms.PeakFileOptions()
+    options.setFillData(False)
+    mzML_file = poms.MzMLFile()
+    mzML_file.setOptions(options)
+    exp = poms.MSExperiment()
+    mzML_file.load(str(mzML), exp)
+    ms2 = [
+        (i, spec)
+        for i, spec in enumerate(exp)
+        if spec.getMSLevel() == 2 and spec.getPrecursors()
+    ]
+    return pd.DataFrame(
+        {
+            "spectrum_index": [i for i, _ in ms2],
+            "native_id": [spec.getNativeID() for _, spec in ms2],
+            "RT": [spec.getRT() for _, spec in ms2],
+            "mz": [spec.getPrecursors()[0].getMZ() for _, spec in ms2],
+        }
+    )
+
+def map_spectra(features, spectra, rt_tolerance, mz_tolerance, ppm):
+    """
+    Assigns MS2 spectra to features like IDMapper (feature centroid m/z, RT within the convex hull),
+    all spectra of a file at once: candidate features per spectrum from an m/z sorted index, then
+    filtered by RT. Spectra matching multiple features are assigned to the first one in feature
+    map order (as IDMapper does for spectra without identifications).
+
+    Args:
+        features (pd.DataFrame): Features (feature ID as index) with mz, RTstart and RTend.
+        spectra (pd.DataFrame): MS2 spectra with RT and (precursor) mz.
+        rt_tolerance (float): RT tolerance in seconds around the convex hull.
+        mz_tolerance (float): m/z tolerance around the feature m/z.
+        ppm (bool): m/z tolerance in ppm, otherwise in Da.
+
+    Returns:
+        pd.DataFrame: The assigned spectra with the feature_id they are assigned to.
+    """
+    order = np.argsort(features["mz"].to_numpy(), kind="stable")
+    feature_mz = features["mz"].to_numpy()[order]
+    mz = spectra["mz"].to_numpy()
+    tolerance = mz * mz_tolerance * 1e-6 if ppm else np.full(len(mz), mz_tolerance)
+    lo = np.searchsorted(feature_mz, mz - tolerance, side="left")
+    hi = np.searchsorted(feature_mz, mz + tolerance, side="right")
+    counts = hi - lo
+    # (spectrum, candidate feature) pairs
+    spectrum = np.repeat(np.arange(len(spectra)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    feature = order[np.repeat(lo, counts) + offsets]
+    rt = spectra["RT"].to_numpy()[spectrum]
+    in_hull = (rt >= features["RTstart"].to_numpy()[feature] - rt_tolerance) & (
+        rt <= features["RTend"].to_numpy()[feature] + rt_tolerance
+    )
+    spectrum, feature = spectrum[in_hull], feature[in_hull]
+    # first matching feature of each spectrum
+    first = np.lexsort((feature, spectrum))
+    first = first[np.unique(spectrum[first], return_index=True)[1]]
+    df = spectra.iloc[spectrum[first]].reset_index(drop=True)
+    df.insert(0, "feature_id", features.index.to_numpy()[feature[first]])
+    return df
+
+def map_sample(featureXML, mzML, precursor_table, trafo, out, rt_tolerance, mz_tolerance, ppm):
+    fm = poms.FeatureMap()
+    poms.FeatureXMLFile().load(str(featureXML), fm)
+    features = fm.get_df(meta_values=[], export_peptide_identifications=False)
+    spectra = precursors(mzML, precursor_table)
+    # features are RT aligned, spectra are transformed to the aligned RTs
+    spectra["raw_RT"] = spectra["RT"]
+    if trafo and len(spectra):
+        spectra["RT"] = load_trafo(trafo)(spectra["raw_RT"].to_numpy())
+    df = map_spectra(features, spectra, rt_tolerance, mz_tolerance, ppm)
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(out, index=False)
+    return len(df), len(spectra)
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    n = len(params["in"])
+    # files are processed in parallel worker processes
+    with ProcessPoolExecutor(max(1, min(int(params["num_threads"]), n))) as executor:
+        results = list(
+            executor.map(
+                map_sample,
+                params["in"],
+                params["in_mzML"],
+                params["in_precursors"] or [""] * n,
+                params["trafo"] or [""] * n,
+                params["out"],
+                [float(params["rt_tolerance"])] * n,
+                [float(params["mz_tolerance"])] * n,
+                [params["mz_measure"] == "ppm"] * n,
+            )
+        )
+    for featureXML, (assigned, total) in zip(params["in"], results):
+        print(f"{Path(featureXML).stem}: {assigned} of {total} MS2 spectra assigned to features")
@@ -0,0 +1,162 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix, write_annotations
+from src.common.spectrallibrary import library_index, load_index, load_metadata
+from src.common.spectralsimilarity import gnps_spectra, mgf_feature_ids, ranges, score_batch
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in_mgf", "value": [], "help": "GNPS mgf file with the MS2 spectra of the consensus features", "hide": True},
+    {"key": "in_lib", "value": [], "help": "spectral library files (mgf or msp)", "hide": True},
+    {"key": "cache", "value": "", "help": "directory with the cached library indices", "hide": True},
+    {"key": "out", "value": [], "help": "feature matrix parquet file, the matches are stored as annotation sidecar", "hide": True},
+    {"key": "in_clusters", "value": [], "help": "MS2 cluster membership (parquet) if in_mgf has cluster consensus spectra (optional)", "hide": True},
+    {"key": "prec_mass_error_value", "value": 100.0, "help": "precursor m/z tolerance", "hide": True},
+    {"key": "frag_mass_error_value", "value": 500.0, "help": "fragment m/z tolerance", "hide": True},
+    {"key": "mass_error_unit", "value": "ppm", "help": "unit of the m/z tolerances (ppm or Da)", "hide": True},
+    {"key": "report_mode", "value": "top3", "help": "report the top three or only the best match of each spectrum (top3 or best)", "hide": True},
+    {"key": "score", "value": "cosine", "help": "similarity score (cosine or modified cosine)", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of worker processes", "hide": True},
+]
+
+# Spectrum pairs scored at once
+BATCH_SIZE = 4096
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def library_peaks(index, rows):
+    """Spectrum (position in rows), m/z and intensity of the peaks of library spectra (index rows)."""
+    spectrum, position = ranges(index["offsets"][rows], index["offsets"][rows + 1])
+    return spectrum, index["mz"][position].astype(np.float64), index["intensity"][position]
+
+def match_library(index_dir, pmz, mz, intensity, prec_tolerance, frag_tolerance, ppm, modified, top):
+    """
+    Matches query spectra against a library index: candidates by precursor m/z from the sorted
+    precursor array (searchsorted), scored in batches.
+
+    Returns:
+        pd.DataFrame: The top matches (query, library_index, score, ppm_error) of each query spectrum.
+    """
+    index = load_index(index_dir)
+    library_mz = index["precursor_mz"]
+    tol = pmz * prec_tolerance * 1e-6 if ppm else np.full(len(pmz), prec_tolerance)
+    # (query, library spectrum) candidate pairs
+    query, library = ranges(
+        np.searchsorted(library_mz, pmz - tol, side="left"),
+        np.searchsorted(library_mz, pmz + tol, side="right"),
+    )
+    scores = np.zeros(len(query))
+    for start in range(0, len(query), BATCH_SIZE):
+        q, k = query[start : start + BATCH_SIZE], library[start : start + BATCH_SIZE]
+        scores[start : start + BATCH_SIZE] = score_batch(
+            mz[q],
+            intensity[q],
+            library_peaks(index, k),
+            pmz[q] - library_mz[k] if modified else None,
+            frag_tolerance,
+            ppm,
+        )[0]
+    df = pd.DataFrame(
+        {
+            "query": query,
+            "library_index": library,
+            "score": scores,
+            "ppm_error": (pmz[query] - library_mz[library]) / library_mz[library] * 1e6,
+        }
+    )
+    df = df[df["score"] > 0]
+    return df.sort_values(["query", "score"], ascending=[True, False]).groupby("query").head(top)
+
+def match_chunk(index_dir, pmz, mz, intensity, offset, *args):
+    df = match_library(index_dir, pmz, mz, intensity, *args)
+    df["query"] += offset
+    return df
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    spectra, pmz, mz, intensity = gnps_spectra(params["in_mgf"][0])
+    ppm = params["mass_error_unit"] == "ppm"
+    top = 3 if params["report_mode"] == "top3" else 1
+    settings = [
+        float(params["prec_mass_error_value"]),
+        float(params["frag_mass_error_value"]),
+        ppm,
+        params["score"] == "modified cosine",
+        top,
+    ]
+    num_threads = max(1, int(params["num_threads"]))
+    chunks = np.array_split(np.arange(len(pmz)), min(num_threads * 4, max(1, len(pmz))))
+    matches = []
+    # query spectra are split in chunks for the worker processes, library indices are memory-mapped
+    with ProcessPoolExecutor(num_threads) as executor:
+        for library in params["in_lib"]:
+            index_dir = library_index(library, params["cache"])
+            futures = [
+                executor.submit(match_chunk, index_dir, pmz[c], mz[c], intensity[c], c[0], *settings)
+                for c in chunks
+                if len(c)
+            ]
+            results = [f.result() for f in futures]
+            results = [r for r in results if not r.empty]
+            if results:
+                df = pd.concat(results, ignore_index=True)
+                metadata = load_metadata(index_dir, df["library_index"].tolist()).reset_index(drop=True)
+                matches.append(pd.concat([df.drop(columns=["library_index"]), metadata], axis=1))
+    columns = ["query", "score", "ppm_error", "name", "smiles", "inchi", "adduct"]
+    df = pd.concat(matches, ignore_index=True) if matches else pd.DataFrame(columns=columns)
+    # top matches of each spectrum over all libraries
+    df = df.sort_values("score", ascending=False).groupby("query", sort=False).head(top)
+    df["feature_id"] = spectra["feature_id"].to_numpy()[df["query"].to_numpy(dtype=int)]
+    print(f"{df['query'].nunique()} of {len(spectra)} MS2 spectra matched")
+
+    # mgf feature IDs are the (representative) consensus feature IDs of the feature matrix
+    hits = (
+        df.astype(str)
+        .groupby("feature_id")[["name", "smiles", "ppm_error", "score"]]
+        .agg(" ## ".join)
+    )
+    consensus_id = mgf_feature_ids(
+        read_feature_matrix(params["out"][0], columns=["consensus_feature_id"])[
+            "consensus_feature_id"
+        ].astype(str),
+        params.get("in_clusters", []),
+    )
+    annotations = pd.DataFrame(
+        {
+            "SpectralMatch": consensus_id.map(hits["name"]).fillna(""),
+            "SpectralMatch_smiles": consensus_id.map(hits["smiles"]).fillna(""),
+            "SpectralMatch_ppm_error": consensus_id.map(hits["ppm_error"]).fillna(""),
+            "SpectralMatch_score": consensus_id.map(hits["score"]).fillna(""),
+        }
+    )
+    write_annotations(params["out"][0], "spectral-matcher", annotations)
@@ -23,8 +23,7 @@ from pathlib import Path
 # advanced: whether or not the parameter is advanced (default: False)
 
 DEFAULTS = [
-    {"key": "in", "value": [], "help": "consensus df ffm complete, consensus df ffmid", "hide": True},
-    {"key": "out", "value": [], "help": "consensus df merged parquet file", "hide": True}
+    {"key": "in", "value": [], "help": "consensus df parquet file (from FFM), re-quantified values are filled in place", "hide": True},
 ]
 
 def get_params():
@@ -34,18 +33,40 @@ def get_params():
     else:
         return {}
 
+def fill_requantified(df, ffmid_df_dir):
+    """
+    Fills missing sample intensities (and feature IDs) of the consensus features with the features
+    re-quantified by FFMID in that sample. FFMID features are labeled with their consensus feature ID,
+    samples without re-quantified features (no ffmid-df file) are left as they are.
+    Consensus features with at least one re-quantified value are flagged as re-quantified.
+    """
+    consensus_ids = df["consensus_feature_id"].astype(str)
+    requantified = df["re-quantified"].to_numpy(copy=True)
+    for sample in [c for c in df.columns if c.endswith(".mzML")]:
+        path = Path(ffmid_df_dir, Path(sample).stem + ".parquet")
+        if not path.exists():
+            continue
+        ffmid = pd.read_parquet(path, columns=["consensus_feature_id", "intensity", "quality"])
+        # best feature per consensus feature, if FFMID found more than one
+        ffmid = (
+            ffmid[ffmid["intensity"] > 0]
+            .sort_values("quality", ascending=False)
+            .reset_index()
+            .drop_duplicates("consensus_feature_id")
+            .set_index("consensus_feature_id")
+        )
+        missing = (df[sample] == 0).to_numpy() & consensus_ids.isin(ffmid.index).to_numpy()
+        matched = ffmid.loc[consensus_ids[missing]]
+        df.loc[missing, sample] = matched["intensity"].to_numpy()
+        df.loc[missing, sample + "_IDs"] = matched["feature_id"].to_numpy()
+        requantified |= missing
+    df["re-quantified"] = requantified
+    return df
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
-    df_ffm = pd.read_parquet(params["in"][0])
-    df_ffmid = pd.read_parquet(params["in"][1])
-    
-    df_ffm["re-quantified"] = False
-    df_ffmid["re-quantified"] = True
-    
-    df = pd.concat([df_ffm, df_ffmid])# .reset_index(drop=True)
-    
-    path = Path(params["out"][0])
+    path = Path(params["in"][0])
+    df = fill_requantified(pd.read_parquet(path), Path(path.parent.parent, "ffmid-df"))
+    # the tsv file is only written on export (with annotations)
     df.to_parquet(path)
-    # save additionally as tsv file
-    df.to_csv(path.with_suffix(".tsv"), sep="\t")
\ No newline at end of file
@@ -0,0 +1,54 @@
+import json
+import sys
+import shutil
+from pathlib import Path
+import pyopenms as poms
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "featureXML files, features are added in place (created if they don't exist)", "hide": True},
+    {"key": "in_add", "value": [], "help": "featureXML files with the features to add (same order as in)", "hide": True},
+]
+
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    for path, path_add in zip(params["in"], params["in_add"]):
+        if not Path(path).exists():
+            shutil.move(path_add, path)
+            continue
+        fm = poms.FeatureMap()
+        poms.FeatureXMLFile().load(path, fm)
+        fm_add = poms.FeatureMap()
+        poms.FeatureXMLFile().load(path_add, fm_add)
+        for f in fm_add:
+            fm.push_back(f)
+        fm.updateRanges()
+        poms.FeatureXMLFile().store(path, fm)
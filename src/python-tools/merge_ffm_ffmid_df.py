@@ -55,18 +55,21 @@ if __name__ == "__main__":
                 Path(file).stem + ".parquet",
             )
         )
-        # Keep only rows in df_ffm where index is in df[file+"_IDs"]
+        # Keep only features which are part of the feature matrix
         df_ffm = df_ffm.loc[df_ffm.index.isin(df[file + "_IDs"])]
-        # Open the ffmid df
-        df_ffmid = pd.read_parquet(
-            Path(
-                Path(in_path).parent.parent,
-                "ffmid-df",
-                Path(file).stem + ".parquet",
-            )
+        # Re-quantified features, only for samples with missing values
+        path_ffmid = Path(
+            Path(in_path).parent.parent,
+            "ffmid-df",
+            Path(file).stem + ".parquet",
         )
-        # Concat both dataframes
-        df_merged = pd.concat([df_ffm, df_ffmid])
+        if path_ffmid.exists():
+            df_ffmid = pd.read_parquet(path_ffmid)
+            df_ffmid = df_ffmid.loc[df_ffmid.index.isin(df[file + "_IDs"])]
+            # Concat both dataframes
+            df_merged = pd.concat([df_ffm, df_ffmid])
+        else:
+            df_merged = df_ffm
 
         # Save dataframe
         df_merged.to_parquet(
@@ -0,0 +1,283 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix, write_annotations
+from src.common.spectralsimilarity import (
+    connected_components,
+    flat_peaks,
+    gnps_spectra,
+    mgf_feature_ids,
+    ranges,
+    score_batch,
+)
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in_mgf", "value": [], "help": "GNPS mgf file with the MS2 spectra of the consensus features", "hide": True},
+    {"key": "out", "value": [], "help": "feature matrix parquet file, network components and neighbours are stored as annotation sidecar", "hide": True},
+    {"key": "out_edges", "value": [], "help": "network edges (parquet)", "hide": True},
+    {"key": "in_clusters", "value": [], "help": "MS2 cluster membership (parquet) if in_mgf has cluster consensus spectra (optional)", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of worker processes", "hide": True},
+    {
+        "key": "min_score",
+        "name": "minimum cosine",
+        "value": 0.7,
+        "min": 0.0,
+        "max": 1.0,
+        "step_size": 0.05,
+        "help": "Minimum modified cosine score of an edge.",
+    },
+    {
+        "key": "min_matched_peaks",
+        "name": "minimum matched peaks",
+        "value": 6,
+        "min": 1,
+        "help": "Minimum number of matched fragment peaks of an edge.",
+    },
+    {
+        "key": "fragment_tolerance",
+        "name": "fragment tolerance (Da)",
+        "value": 0.02,
+        "min": 0.001,
+        "step_size": 0.005,
+        "help": "Fragment m/z tolerance in Da.",
+    },
+    {
+        "key": "max_shift",
+        "name": "maximum precursor shift (Da)",
+        "value": 500.0,
+        "min": 0.0,
+        "step_size": 10.0,
+        "help": "Maximum precursor m/z difference of connected spectra.",
+    },
+    {
+        "key": "top_k",
+        "name": "top K",
+        "value": 10,
+        "min": 1,
+        "help": "An edge is kept if it is among the top K edges of both of its nodes.",
+    },
+    {
+        "key": "top_peaks",
+        "name": "indexed peaks",
+        "value": 10,
+        "min": 1,
+        "help": "Most intense peaks (and their neutral losses) of each spectrum in the index for candidate pairs. Only spectra sharing some of them are scored.",
+        "advanced": True,
+    },
+    {
+        "key": "min_shared",
+        "name": "minimum shared index entries",
+        "value": 3,
+        "min": 1,
+        "help": "Minimum number of index entries (indexed peaks and neutral losses, binned by the fragment tolerance) shared by a candidate pair. A peak in the same bin counts twice, in a neighbouring bin once.",
+        "advanced": True,
+    },
+]
+
+# Spectrum pairs scored at once
+BATCH_SIZE = 4096
+
+# Index entries expanded to candidate pairs at once
+SHARD_SIZE = 100000
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def candidate_pairs(pmz, mz, intensity, tolerance, max_shift, top_peaks, min_shared=1):
+    """
+    Spectrum pairs worth scoring, instead of all pairs: the precursor m/z difference is at most
+    max_shift and the spectra share some of their top peaks as fragment or neutral loss (shifted
+    spectra still share neutral losses). Peaks are binned by tolerance, each peak is also registered
+    in the next bin so peaks within tolerance always share a bin (two if in the same bin).
+
+    Args:
+        pmz (np.ndarray): Precursor m/z of the spectra.
+        mz (np.ndarray): Padded peak m/z of the spectra.
+        intensity (np.ndarray): Padded peak intensities of the spectra.
+        tolerance (float): Fragment tolerance in Da.
+        max_shift (float): Maximum precursor m/z difference.
+        top_peaks (int): Peaks per spectrum in the index.
+        min_shared (int): Minimum number of shared index entries.
+
+    Returns:
+        tuple: Arrays with the first and second spectrum of each pair (first < second).
+    """
+    n = len(pmz)
+    top = np.argsort(-intensity, axis=1, kind="stable")[:, :top_peaks]
+    top_mz = mz[np.arange(n)[:, None], top]
+    spectrum, k = np.nonzero(~np.isnan(top_mz) & ~np.isnan(pmz)[:, None])
+    if not len(spectrum):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    peak_mz = top_mz[spectrum, k].astype(np.float64)
+    bins = np.floor(
+        np.concatenate([peak_mz, pmz[spectrum] - peak_mz]) / tolerance
+    ).astype(np.int64)
+    kind = np.repeat([0, 1], len(peak_mz))
+    key = np.concatenate([bins, bins + 1]) * 2 + np.tile(kind, 2)
+    spectrum = np.tile(spectrum, 4)
+    # entries sorted by key and precursor m/z, partners are the following entries of the same key
+    # within max_shift
+    value = np.unique(key, return_inverse=True)[1] * (np.nanmax(pmz) + max_shift + 1) + pmz[spectrum]
+    order = np.argsort(value, kind="stable")
+    value, spectrum = value[order], spectrum[order]
+    hi = np.searchsorted(value, value + max_shift, side="right")
+    pairs, counts = [], []
+    for start in range(0, len(value), SHARD_SIZE):
+        entry, partner = ranges(
+            np.arange(start, min(start + SHARD_SIZE, len(value))) + 1, hi[start : start + SHARD_SIZE]
+        )
+        a, b = spectrum[start + entry], spectrum[partner]
+        pair, count = np.unique(
+            np.minimum(a, b)[a != b] * n + np.maximum(a, b)[a != b], return_counts=True
+        )
+        pairs.append(pair)
+        counts.append(count)
+    pair, inverse = np.unique(np.concatenate(pairs), return_inverse=True)
+    shared = np.bincount(inverse, np.concatenate(counts))
+    return np.divmod(pair[shared >= min_shared], n)
+
+def init_worker(*args):
+    global SPECTRA
+    SPECTRA = args
+
+def score_pairs(i, j):
+    """Modified cosine scores and matched peaks of spectrum pairs (spectra set by init_worker)."""
+    pmz, mz, intensity, tolerance = SPECTRA
+    scores, matched = np.zeros(len(i)), np.zeros(len(i), dtype=np.int64)
+    for start in range(0, len(i), BATCH_SIZE):
+        a, b = i[start : start + BATCH_SIZE], j[start : start + BATCH_SIZE]
+        scores[start : start + BATCH_SIZE], matched[start : start + BATCH_SIZE] = score_batch(
+            mz[a], intensity[a], flat_peaks(mz[b], intensity[b]), pmz[a] - pmz[b], tolerance, False
+        )
+    return scores, matched
+
+def top_k_edges(node_1, node_2, score, k):
+    """Edges which are among the k best edges (by score) of both their nodes."""
+    node = np.concatenate([node_1, node_2])
+    edge = np.tile(np.arange(len(node_1)), 2)
+    order = np.lexsort((-np.tile(score, 2), node))
+    starts = np.unique(node[order], return_index=True)[1]
+    rank = np.empty(len(node), dtype=np.int64)
+    rank[order] = np.arange(len(node)) - np.repeat(starts, np.diff(np.append(starts, len(node))))
+    worst = np.zeros(len(node_1), dtype=np.int64)
+    np.maximum.at(worst, edge, rank)
+    return worst < k
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    spectra, pmz, mz, intensity = gnps_spectra(params["in_mgf"][0])
+    tolerance = float(params["fragment_tolerance"])
+    i, j = candidate_pairs(
+        pmz,
+        mz,
+        intensity,
+        tolerance,
+        float(params["max_shift"]),
+        int(params["top_peaks"]),
+        int(params["min_shared"]),
+    )
+    print(f"{len(i)} candidate pairs of {len(pmz) * (len(pmz) - 1) // 2} spectrum pairs")
+    num_threads = max(1, int(params["num_threads"]))
+    shards = [s for s in np.array_split(np.arange(len(i)), num_threads * 4) if len(s)]
+    # spectra are sent to each worker process once, candidate pairs are scored in shards
+    with ProcessPoolExecutor(
+        num_threads, initializer=init_worker, initargs=(pmz, mz, intensity, tolerance)
+    ) as executor:
+        results = list(executor.map(score_pairs, [i[s] for s in shards], [j[s] for s in shards]))
+    scores = np.concatenate([r[0] for r in results] + [np.zeros(0)])
+    matched = np.concatenate([r[1] for r in results] + [np.zeros(0, dtype=np.int64)])
+    keep = (scores >= float(params["min_score"])) & (matched >= int(params["min_matched_peaks"]))
+    i, j = i[keep], j[keep]
+    feature_id = spectra["feature_id"].to_numpy()
+    edges = pd.DataFrame(
+        {
+            "consensus_feature_id_1": feature_id[i],
+            "consensus_feature_id_2": feature_id[j],
+            "mz_difference": np.abs(pmz[i] - pmz[j]),
+            "cosine": scores[keep],
+            "matched_peaks": matched[keep],
+        }
+    )
+    # features are the nodes, spectra of the same feature are not linked and features with
+    # multiple spectra are linked by their best spectrum pair
+    edges = edges[edges["consensus_feature_id_1"] != edges["consensus_feature_id_2"]]
+    swap = edges["consensus_feature_id_1"] > edges["consensus_feature_id_2"]
+    edges.loc[swap, ["consensus_feature_id_1", "consensus_feature_id_2"]] = edges.loc[
+        swap, ["consensus_feature_id_2", "consensus_feature_id_1"]
+    ].to_numpy()
+    edges = edges.sort_values("cosine", ascending=False).drop_duplicates(
+        ["consensus_feature_id_1", "consensus_feature_id_2"]
+    )
+    nodes, node = np.unique(
+        edges[["consensus_feature_id_1", "consensus_feature_id_2"]].to_numpy().ravel(),
+        return_inverse=True,
+    )
+    node_1, node_2 = node.reshape(-1, 2).T
+    keep = top_k_edges(node_1, node_2, edges["cosine"].to_numpy(), int(params["top_k"]))
+    edges, node_1, node_2 = edges[keep], node_1[keep], node_2[keep]
+    # components numbered by size, nodes without edges are not part of a component
+    labels = connected_components(len(nodes), node_1, node_2)
+    label, inverse, size = np.unique(labels, return_inverse=True, return_counts=True)
+    rank = np.empty(len(label), dtype=np.int64)
+    rank[np.argsort(-size, kind="stable")] = np.arange(1, len(label) + 1)
+    component = pd.Series(rank[inverse], index=nodes)
+    connected = np.zeros(len(nodes), dtype=bool)
+    connected[node_1] = connected[node_2] = True
+    component = component[connected]
+    edges["component"] = edges["consensus_feature_id_1"].map(component).to_numpy()
+
+    # join with the feature matrix by consensus feature ID (the GNPS mgf feature ID)
+    df = read_feature_matrix(params["out"][0], columns=["consensus_feature_id"])
+    consensus_id = df["consensus_feature_id"].astype(str)
+    name = pd.Series(df.index.to_numpy(), index=consensus_id.to_numpy())
+    edges.insert(0, "metabolite_1", edges["consensus_feature_id_1"].map(name).to_numpy())
+    edges.insert(1, "metabolite_2", edges["consensus_feature_id_2"].map(name).to_numpy())
+    Path(params["out_edges"][0]).parent.mkdir(parents=True, exist_ok=True)
+    edges.to_parquet(params["out_edges"][0], index=False)
+
+    both = pd.concat(
+        [
+            edges[["consensus_feature_id_1", "metabolite_2"]].set_axis(["id", "neighbour"], axis=1),
+            edges[["consensus_feature_id_2", "metabolite_1"]].set_axis(["id", "neighbour"], axis=1),
+        ]
+    )
+    neighbours = both.astype(str).groupby("id")["neighbour"].agg(" ## ".join)
+    # consensus features of a spectrum cluster share the node of its representative
+    node_id = mgf_feature_ids(consensus_id, params.get("in_clusters", []))
+    annotations = pd.DataFrame(
+        {
+            "MolecularNetwork_component": node_id.map(component).fillna(-1).astype(int),
+            "MolecularNetwork_neighbours": node_id.map(neighbours).fillna(""),
+        }
+    )
+    write_annotations(params["out"][0], "molecular-network", annotations)
+    print(f"{len(edges)} edges, {component.nunique()} components")
@@ -0,0 +1,184 @@
+import json
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyopenms as poms
+
+############################
+# default paramter values #
+###########################
+#
+# Mandatory keys for each parameter
+# key: a unique identifier
+# value: the default value
+#
+# Optional keys for each parameter
+# name: the name of the parameter
+# hide: don't show the parameter in the parameter section (e.g. for input/output files)
+# options: a list of valid options for the parameter
+# min: the minimum value for the parameter (int and float)
+# max: the maximum value for the parameter (int and float)
+# step_size: the step size for the parameter (int and float)
+# help: a description of the parameter
+# widget_type: the type of widget to use for the parameter (default: auto)
+# advanced: whether or not the parameter is advanced (default: False)
+
+DEFAULTS = [
+    {"key": "in", "value": [], "help": "feature matrix parquet, pruned features are removed in place", "hide": True},
+    {"key": "in_fm", "value": [], "help": "featureXML files to remove the pruned features from (optional)", "hide": True},
+    {"key": "out_fm", "value": [], "help": "featureXML files without the pruned features (same order as in_fm)", "hide": True},
+    {"key": "out", "value": [], "help": "pruned features with their blank ratio, detection frequency and QC CV (parquet)", "hide": True},
+    {"key": "blanks", "value": [], "help": "sample names (feature matrix columns) of the blanks", "hide": True},
+    {"key": "qcs", "value": [], "help": "sample names (feature matrix columns) of the QC samples", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of files processed in parallel", "hide": True},
+    {
+        "key": "blank_ratio",
+        "name": "minimum sample/blank ratio",
+        "value": 3.0,
+        "min": 0.0,
+        "step_size": 0.5,
+        "help": "Minimum ratio of the mean intensity in the samples (where detected) to the mean intensity in the blanks. Features detected in blanks only are always removed. 0 disables the blank filter.",
+    },
+    {
+        "key": "min_frequency",
+        "name": "minimum detection frequency",
+        "value": 0.0,
+        "min": 0.0,
+        "max": 1.0,
+        "step_size": 0.05,
+        "help": "Minimum fraction of the samples (without blanks and QCs) a feature has to be detected in. 0 disables the frequency filter.",
+    },
+    {
+        "key": "max_qc_cv",
+        "name": "maximum QC CV (%)",
+        "value": 30.0,
+        "min": 0.0,
+        "step_size": 5.0,
+        "help": "Maximum coefficient of variation of the intensities in the QC samples, missing values count as zero. Needs at least two QC samples. 0 disables the QC filter.",
+    },
+]
+
+def get_params():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+def pruning_statistics(intensities, blanks, qcs):
+    """
+    Blank ratio, detection frequency and QC CV of each feature, computed on the intensity matrix.
+
+    Args:
+        intensities (pd.DataFrame): Sample intensities (one column per sample, 0 if not detected).
+        blanks (list[str]): Blank columns.
+        qcs (list[str]): QC sample columns.
+
+    Returns:
+        pd.DataFrame: blank_ratio, frequency and qc_cv (NaN if there are no blanks/QCs) of each feature.
+    """
+    samples = [c for c in intensities.columns if c not in blanks and c not in qcs]
+    x = intensities[samples].to_numpy(dtype=np.float64)
+    detected = x > 0
+    n_detected = detected.sum(axis=1)
+    # mean intensity in the samples the feature was detected in
+    sample_mean = np.divide(x.sum(axis=1), n_detected, out=np.zeros(len(x)), where=n_detected > 0)
+    stats = pd.DataFrame(
+        {
+            "blank_ratio": np.nan,
+            "frequency": n_detected / max(1, len(samples)),
+            "qc_cv": np.nan,
+        },
+        index=intensities.index,
+    )
+    if blanks:
+        blank_mean = intensities[blanks].to_numpy(dtype=np.float64).mean(axis=1)
+        stats["blank_ratio"] = np.divide(
+            sample_mean, blank_mean, out=np.full(len(x), np.inf), where=blank_mean > 0
+        )
+    if len(qcs) > 1:
+        qc = intensities[qcs].to_numpy(dtype=np.float64)
+        qc_mean = qc.mean(axis=1)
+        stats["qc_cv"] = np.divide(
+            qc.std(axis=1, ddof=1) * 100, qc_mean, out=np.full(len(x), np.inf), where=qc_mean > 0
+        )
+    return stats
+
+def pruned_features(stats, blank_ratio, min_frequency, max_qc_cv):
+    """Mask and reason (first failed filter) of the features to remove."""
+    reasons = [
+        ("blank", (stats["blank_ratio"] < blank_ratio).to_numpy() if blank_ratio > 0 else None),
+        ("frequency", (stats["frequency"] < min_frequency).to_numpy() if min_frequency > 0 else None),
+        # NaN (less than two QCs) never fails
+        ("QC CV", (stats["qc_cv"] > max_qc_cv).to_numpy() if max_qc_cv > 0 else None),
+    ]
+    reasons = [(name, mask) for name, mask in reasons if mask is not None]
+    reason = np.full(len(stats), "", dtype=object)
+    for name, mask in reversed(reasons):
+        reason[mask] = name
+    return reason != "", reason
+
+def prune_feature_map(featureXML, out, feature_ids):
+    """Stores a copy of a feature map without the features with the given unique IDs."""
+    fm = poms.FeatureMap()
+    poms.FeatureXMLFile().load(featureXML, fm)
+    pruned = poms.FeatureMap(fm)
+    pruned.clear(False)
+    for f in fm:
+        if f.getUniqueId() not in feature_ids:
+            pruned.push_back(f)
+    pruned.updateRanges()
+    poms.FeatureXMLFile().store(out, pruned)
+    return fm.size() - pruned.size()
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    path = params["in"][0]
+    schema = pq.read_schema(path)
+    sample_columns = [c for c in schema.names if c.endswith(".mzML")]
+    blanks = [s for s in params["blanks"] if s in sample_columns]
+    qcs = [s for s in params["qcs"] if s in sample_columns]
+    df = pd.read_parquet(path, columns=["consensus_feature_id"] + sample_columns)
+    stats = pruning_statistics(df[sample_columns], blanks, qcs)
+    mask, reason = pruned_features(
+        stats,
+        float(params["blank_ratio"]),
+        float(params["min_frequency"]),
+        float(params["max_qc_cv"]),
+    )
+    stats.insert(0, "consensus_feature_id", df["consensus_feature_id"].to_numpy())
+    stats.insert(1, "reason", reason)
+    Path(params["out"][0]).parent.mkdir(parents=True, exist_ok=True)
+    stats[mask].to_parquet(params["out"][0])
+    print(
+        f"{mask.sum()} of {len(df)} features pruned ("
+        + ", ".join(f"{name}: {(reason == name).sum()}" for name in ["blank", "frequency", "QC CV"])
+        + ")"
+    )
+
+    # sample feature IDs of the pruned features, removed from the feature maps for the downstream steps
+    if params["in_fm"]:
+        id_columns = [s + "_IDs" for s in sample_columns if s + "_IDs" in schema.names]
+        ids = pd.read_parquet(path, columns=id_columns)[mask].to_numpy().ravel()
+        feature_ids = set(int(i) for i in ids[pd.notna(ids)])
+        Path(params["out_fm"][0]).parent.mkdir(parents=True, exist_ok=True)
+        num_threads = max(1, min(int(params["num_threads"]), len(params["in_fm"])))
+        with ProcessPoolExecutor(num_threads) as executor:
+            list(
+                executor.map(
+                    prune_feature_map,
+                    params["in_fm"],
+                    params["out_fm"],
+                    [feature_ids] * len(params["in_fm"]),
+                )
+            )
+
+    # the feature matrix keeps its schema (and row order), only the pruned rows are removed
+    if mask.any():
+        table = pq.read_table(path)
+        pq.write_table(table.filter(pa.array(~mask)), path)
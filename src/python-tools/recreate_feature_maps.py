@@ -1,9 +1,12 @@
 import sys
 import json
 
+import numpy as np
 import pandas as pd
 import pyopenms as poms
 
+from concurrent.futures import ProcessPoolExecutor
+
 from pathlib import Path
 
 ############################
@@ -27,6 +30,7 @@ from pathlib import Path
 
 DEFAULTS = [
     {"key": "in", "value": "", "help": "umetaflow results dir", "hide": True},
+    {"key": "num_threads", "value": 1, "help": "number of files processed in parallel", "hide": True},
 ]
 
 def get_params():
@@ -36,6 +40,55 @@ def get_params():
     else:
         return {}
 
+def feature_map_from_df(df, mzML_name):
+    """
+    Builds a FeatureMap from a feature DataFrame. Column values are extracted once as
+    Python lists instead of creating a Series per row and hull points are built as one array.
+    """
+    fm = poms.FeatureMap()
+    fm.setPrimaryMSRunPath([mzML_name.encode()])
+    # hull corner points for all features (ConvexHull2D stores float32 coordinates)
+    hulls = np.stack(
+        [
+            df[["RTstart", "RTend", "RTend", "RTstart"]].to_numpy(dtype=np.float32),
+            df[["MZstart", "MZend", "MZstart", "MZend"]].to_numpy(dtype=np.float32),
+        ],
+        axis=-1,
+    )
+    for uid, rt, mz, intensity, quality, charge, adduct, n_traces, hull_points in zip(
+        map(int, df.index.tolist()),
+        df["RT"].tolist(),
+        df["mz"].tolist(),
+        df["intensity"].tolist(),
+        df["quality"].tolist(),
+        df["charge"].tolist(),
+        df["adduct"].tolist(),
+        df["num_of_masstraces"].tolist(),
+        hulls,
+    ):
+        f = poms.Feature()
+        f.setRT(rt)
+        f.setMZ(mz)
+        f.setIntensity(intensity)
+        f.setOverallQuality(quality)
+        f.setCharge(charge)
+        if adduct != "nan":
+            f.setMetaValue("dc_charge_adducts", adduct)
+        f.setMetaValue("num_of_masstraces", n_traces)
+        f.setUniqueId(uid)
+        hull = poms.ConvexHull2D()
+        hull.addPoints(hull_points)
+        f.setConvexHulls([hull])
+        fm.push_back(f)
+    return fm
+
+def recreate_feature_map(f_df, fm_dir):
+    """Re-creates the feature map of one feature DataFrame and stores it in featureXML format."""
+    fm = feature_map_from_df(pd.read_parquet(f_df), f_df.stem + ".mzML")
+    out = Path(fm_dir, f_df.stem + ".featureXML")
+    poms.FeatureXMLFile().store(str(out), fm)
+    return out
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
@@ -47,38 +100,7 @@ if __name__ == "__main__":
     fm_df_dir = Path(dir, "feature-dfs")
 
     # For each fm in df dir, re-create a feature map in featureXML format and save to fm_dir
-    for f_df in fm_df_dir.iterdir():
-        df = pd.read_parquet(f_df)
-        # Create a new feature map
-        fm = poms.FeatureMap()
-        fm.setPrimaryMSRunPath([str(f_df.stem + ".mzML").encode()])
-        for i, row in df.iterrows():
-            # Create a new feature
-            f = poms.Feature()
-            # Set the position of the feature
-            f.setRT(row["RT"])
-            f.setMZ(row["mz"])
-            # Set the intensity of the feature
-            f.setIntensity(row["intensity"])
-            # Set the quality of the feature
-            f.setOverallQuality(row["quality"])
-            # Set the charge state of the feature
-            f.setCharge(row["charge"])
-            # Set the adduct of the feature
-            if row["adduct"] != "nan":
-                f.setMetaValue("dc_charge_adducts", row["adduct"])
-            # Set num masstraces
-            f.setMetaValue("num_of_masstraces", row["num_of_masstraces"])
-            # Set the unique id of the feature
-            f.setUniqueId(int(i))
-            # Set hull points
-            hull = poms.ConvexHull2D()
-            hull.addPoint([row["RTstart"], row["MZstart"]])
-            hull.addPoint([row["RTend"], row["MZend"]])
-            hull.addPoint([row["RTend"], row["MZstart"]])
-            hull.addPoint([row["RTstart"], row["MZend"]])
-            f.setConvexHulls([hull])
-            # Add the feature to the feature map
-            fm.push_back(f)
-        # Save the feature map to featureXML format
-        poms.FeatureXMLFile().store(str(Path(fm_dir, Path(f_df).stem + ".featureXML")), fm)
\ No newline at end of file
+    # (files are processed in parallel worker processes)
+    files = sorted(fm_df_dir.iterdir())
+    with ProcessPoolExecutor(max(1, min(int(params["num_threads"]), len(files)))) as executor:
+        list(executor.map(recreate_feature_map, files, [fm_dir] * len(files)))
@@ -4,6 +4,10 @@ from pathlib import Path
 import pandas as pd
 import shutil
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.common.featurematrix import read_feature_matrix, write_annotations
+from src.common.spectralsimilarity import mgf_feature_ids
+
 from ms2query.run_ms2query import (
     run_complete_folder,
     download_zenodo_files,
@@ -14,6 +18,7 @@ from ms2query.utils import SettingsRunMS2Query
 DEFAULTS = [
     {"key": "in", "value": [], "help": "Feature Matrix tsv file", "hide": True},
     {"key": "in_mgf", "value": [], "help": "GNPS mgf file", "hide": True},
+    {"key": "in_clusters", "value": [], "help": "MS2 cluster membership (parquet) if in_mgf has cluster consensus spectra (optional)", "hide": True},
     {
         "key": "out_m2query_csv",
         "value": [],
@@ -50,13 +55,10 @@ def download_ms2query_libraries(ms2query_library_files_directory, ion_mode, flag
     Path(flag_file).touch()
 
 
-def ms2query_annotations(feature_matrix, ms2query_csv):
-    df_gnps = pd.read_parquet(
-        Path(Path(feature_matrix).parent, "feature-matrix-gnps.parquet"))
-
+def ms2query_annotations(feature_matrix, ms2query_csv, clusters):
     df_ms2query = pd.read_csv(ms2query_csv)
-    df_ms2query["feature_id"] = df_ms2query["feature_id"].apply(lambda x: int(x[2:]))
-    df_ms2query = df_ms2query.set_index("feature_id")
+    df_ms2query["feature_id"] = df_ms2query["feature_id"].astype(str).str[2:]
+    df_ms2query = df_ms2query.drop_duplicates("feature_id").set_index("feature_id")
 
     ms2query_columns = [
         "ms2query_model_prediction",
@@ -74,18 +76,17 @@ def ms2query_annotations(feature_matrix, ms2query_csv):
         "npc_pathway_results",
     ]
 
-    df = pd.read_parquet(Path(feature_matrix).with_suffix(".parquet"))
-
-    for i in df_gnps["consensus_feature_id"]:
-        if i in df_ms2query.index:
-            for col in ms2query_columns:
-                df.loc[
-                    df_gnps.index[df_gnps["consensus_feature_id"] == i].tolist()[0],
-                    f"MS2Query_{col}",
-                ] = str(df_ms2query.loc[i, col])
+    # Only the metabolite names and IDs are needed, annotations are stored as sidecar of the feature matrix
+    df = read_feature_matrix(feature_matrix, columns=["consensus_feature_id"])
+    # mgf feature IDs are the (representative) consensus feature IDs
+    feature_id = mgf_feature_ids(df["consensus_feature_id"].astype(str), clusters)
+    found = feature_id.isin(df_ms2query.index)
+    df = df.drop(columns=["consensus_feature_id"])
+    if found.any():
+        for col in ms2query_columns:
+            df[f"MS2Query_{col}"] = feature_id.map(df_ms2query[col].astype(str)).where(found)
 
-    df.to_parquet(feature_matrix)
-    df.to_csv(Path(feature_matrix).with_suffix(".tsv"), sep="\t")
+    write_annotations(feature_matrix, "ms2query", df)
 
 
 if __name__ == "__main__":
@@ -119,4 +120,4 @@ if __name__ == "__main__":
         settings=SettingsRunMS2Query(additional_metadata_columns=("FEATURE_ID",)),
     )
 
-    ms2query_annotations(consensus_file, results_file)
\ No newline at end of file
+    ms2query_annotations(consensus_file, results_file, params.get("in_clusters", []))
\ No newline at end of file
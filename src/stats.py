@@ -4,6 +4,7 @@ import pandas as pd
 import numpy as np
 
 from src.common.common import *
+from src.common.resultcache import cache_result
 
 import plotly.express as px
 import plotly.graph_objects as go
@@ -23,7 +24,7 @@ Here, we provide simple statistics for the Extracted Ion Chromatograms workflow.
 """
 
 
-@st.cache_data
+@cache_result
 def scale_df(df):
     scaled = pd.DataFrame(
         StandardScaler().fit_transform(df)).set_index(df.index)
@@ -31,14 +32,14 @@ def scale_df(df):
     return scaled
 
 
-@st.cache_resource
+@cache_result
 def dendrogram(df):
     fig = ff.create_dendrogram(df, labels=list(df.index))
     fig.update_xaxes(side="top")
     return fig
 
 
-@st.cache_resource
+@cache_result
 def heatmap(df):
     fig = px.imshow(
         df,
@@ -59,7 +60,7 @@ def heatmap(df):
     return fig
 
 
-@st.cache_resource
+@cache_result
 def fold_change_plot(change):
     fig = px.bar(change)
     fig.update_layout(
@@ -72,7 +73,7 @@ def fold_change_plot(change):
     return fig
 
 
-@st.cache_resource
+@cache_result
 def mean_intensity_plot(samples, features, mean, std):
     fig = go.Figure()
     for feature in features:
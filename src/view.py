@@ -4,10 +4,16 @@ from pathlib import Path
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
+import pyarrow as pa
 import pyopenms as poms
-from src.common.common import show_fig, display_large_dataframe
+from src.common.common import show_fig, display_paginated_table, selected_x_range
+from src.common.downsample import downsample_frame
+from src.common.resultcache import cache_result, file_key
 from typing import Union
 
+# Columns of the spectrum table
+SPECTRUM_TABLE_COLUMNS = ["spectrum ID", "RT", "MS level", "max intensity m/z", "precursor m/z"]
+
 
 def get_df(file: Union[str, Path]) -> pd.DataFrame:
     """
@@ -42,6 +48,11 @@ def get_df(file: Union[str, Path]) -> pd.DataFrame:
         st.session_state["view_spectra"] = df_spectra
     else:
         st.session_state["view_spectra"] = pd.DataFrame()
+    # spectrum table without the peak arrays, displayed page by page
+    df_table = df_spectra.reindex(columns=SPECTRUM_TABLE_COLUMNS[1:])
+    df_table.insert(0, "spectrum ID", np.arange(1, len(df_table) + 1))
+    st.session_state["view_spectra_table"] = pa.Table.from_pandas(df_table, preserve_index=False)
+    st.session_state["view_spectra_key"] = file_key(file)
     exp_ms2 = poms.MSExperiment()
     exp_ms1 = poms.MSExperiment()
     for spec in exp:
@@ -67,8 +78,11 @@ def plot_bpc_tic() -> go.Figure:
     """
     fig = go.Figure()
     max_int = 0
+    # traces are downsampled, within the selected RT range if zoomed in
+    rt_range = selected_x_range("view_bpc_tic_selection")
     if st.session_state.view_tic:
         df = st.session_state.view_ms1.groupby("RT").sum().reset_index()
+        df = downsample_frame(df, "RT", "inty", x_range=rt_range)
         df["type"] = "TIC"
         if df["inty"].max() > max_int:
             max_int = df["inty"].max()
@@ -85,6 +99,7 @@ def plot_bpc_tic() -> go.Figure:
         )
     if st.session_state.view_bpc:
         df = st.session_state.view_ms1.groupby("RT").max().reset_index()
+        df = downsample_frame(df, "RT", "inty", x_range=rt_range)
         df["type"] = "BPC"
         if df["inty"].max() > max_int:
             max_int = df["inty"].max()
@@ -111,8 +126,9 @@ def plot_bpc_tic() -> go.Figure:
             df_eic = df[
                 (df["mz"] >= target_value - tolerance)
                 & (df["mz"] <= target_value + tolerance)
-            ].copy()
+            ]
             if not df_eic.empty:
+                df_eic = downsample_frame(df_eic, "RT", "inty", x_range=rt_range).copy()
                 df_eic["type"] = "XIC"
                 if df_eic["inty"].max() > max_int:
                     max_int = df_eic["inty"].max()
@@ -142,7 +158,7 @@ def plot_bpc_tic() -> go.Figure:
     return fig
 
 
-@st.cache_resource
+@cache_result
 def plot_ms_spectrum(df, title):
     fig = df.plot(
         kind="spectrum",
@@ -218,33 +234,22 @@ def view_peak_map():
 
 @st.fragment
 def view_spectrum():
-    df = st.session_state.view_spectra.copy()
-    df["spectrum ID"] = df.index + 1
-    event = st.dataframe(
-        df,
-        column_order=[
-            "spectrum ID",
-            "RT",
-            "MS level",
-            "max intensity m/z",
-            "precursor m/z",
-        ],
-        selection_mode="single-row",
-        on_select="rerun",
+    index = display_paginated_table(
+        st.session_state.view_spectra_table,
+        "view-spectra",
+        SPECTRUM_TABLE_COLUMNS,
+        cache_key=st.session_state.view_spectra_key,
         use_container_width=True,
-        hide_index=True,
-        height=300
+        height=300,
     )
-    if event["selection"]["rows"]:
-        index = event["selection"]["rows"][0]
-    else:
-        index = None
     if index is not None:
         df = st.session_state.view_spectra.iloc[index]
+        mz_range = None
         if "view_spectrum_selection" in st.session_state:
             box = st.session_state.view_spectrum_selection.selection.box
             if box:
-                mz_min, mz_max = sorted(box[0]["x"])
+                mz_range = tuple(sorted(box[0]["x"]))
+                mz_min, mz_max = mz_range
                 mask = (df["mzarray"] > mz_min) & (df["mzarray"] < mz_max)
                 df["intarray"] = df["intarray"][mask]
                 df["mzarray"] = df["mzarray"][mask]
@@ -265,9 +270,11 @@ def view_spectrum():
             df_selected["precursor m/z"] = df["precursor m/z"]
             df_selected["max intensity m/z"] = df["max intensity m/z"]
 
+            # cached by the mzML file, spectrum and selected m/z range
             fig = plot_ms_spectrum(
                 df_selected,
                 title,
+                key=st.session_state.view_spectra_key + (index, mz_range),
             )
 
             show_fig(fig, title.replace(" ", "_"), True, "view_spectrum_selection")
@@ -309,4 +316,5 @@ def view_bpc_tic():
         key="view_eic_ppm",
     )
     fig = plot_bpc_tic()
-    show_fig(fig, f"BPC-TIC-{st.session_state.view_selected_file}")
+    show_fig(fig, f"BPC-TIC-{st.session_state.view_selected_file}", True, "view_bpc_tic_selection")
+    st.info("💡 Select an RT range (box select) to zoom in at full resolution, double click to reset.")
@@ -143,8 +143,10 @@ class CommandExecutor:
 
         commands = []
 
-        # Load parameters for non-defaults
+        # Load parameters for non-defaults and the custom defaults of the workflow
+        # (stored as diff to the tool defaults, no ini file needed)
         params = self.parameter_manager.get_parameters_from_json()
+        custom_defaults = self.parameter_manager.get_custom_defaults(tool)
         # Construct commands for each process
         for i in range(n_processes):
             command = [tool]
@@ -163,15 +165,16 @@ class CommandExecutor:
                 # standard case, files was a list of strings, take the file name at index
                 else:
                     command += [value[i]]
-            # Add non-default TOPP tool parameters
-            if tool in params.keys():
-                for k, v in params[tool].items():
-                    command += [f"-{k}"]
-                    if v:
-                        if isinstance(v, str) and "\n" in v:
-                            command += v.split("\n")
-                        else:
-                            command += [str(v)]
+            # Add non-default TOPP tool parameters and custom defaults
+            for k, v in (custom_defaults | params.get(tool, {})).items():
+                command += [f"-{k}"]
+                if v:
+                    if isinstance(v, str) and "\n" in v:
+                        command += v.split("\n")
+                    elif isinstance(v, list):
+                        command += [str(x) for x in v]
+                    else:
+                        command += [str(v)]
             # Add custom parameters
             for k, v in custom_params.items():
                 command += [f"-{k}"]
@@ -182,11 +185,6 @@ class CommandExecutor:
                         command += [str(v)]
             commands.append(command)
 
-            # check if a ini file has been written, if yes use it (contains custom defaults)
-            ini_path = Path(self.parameter_manager.ini_dir, tool + ".ini")
-            if ini_path.exists():
-                command += ["-ini", str(ini_path)]
-
         # Run command(s)
         if len(commands) == 1:
             self.run_command(commands[0])
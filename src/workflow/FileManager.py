@@ -88,7 +88,7 @@ class FileManager:
     def _set_type(self, files: List[str], set_file_type: str) -> List[str]:
         """
         Sets or changes the file extension for all files in the collection to the
-        specified file type.
+        specified file type. Compression suffixes (.gz, .bz2) are replaced as well.
 
         Args:
             files (List[str]): The list of file paths to change the type for.
@@ -99,7 +99,11 @@ class FileManager:
         """
 
         def change_extension(file_path, new_ext):
-            return Path(file_path).with_suffix("." + new_ext)
+            file_path = Path(file_path)
+            # compressed files (e.g. sample.mzML.gz) get the new extension instead of both suffixes
+            if file_path.suffix in (".gz", ".bz2"):
+                file_path = file_path.with_suffix("")
+            return file_path.with_suffix("." + new_ext)
 
         for i in range(len(files)):
             if isinstance(files[i], list):  # If the item is a list
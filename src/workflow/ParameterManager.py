@@ -1,9 +1,51 @@
 import pyopenms as poms
+import copy
 import json
+import os
 import shutil
+import subprocess
+import tempfile
 import streamlit as st
 from pathlib import Path
 
+# Name of the directory (within the workspaces directory) with the default ini files of the
+# TOPP tools, shared by all workspaces and kept per OpenMS version
+TOPP_SCHEMA_DIR_NAME = ".topp-ini"
+
+# Parsed TOPP tool parameter schemas, (OpenMS version, tool) -> list of parameter entries.
+# Ini files are parsed once per process instead of on every render.
+_TOPP_SCHEMAS = {}
+
+def parse_topp_schema(ini_file: Path) -> list:
+    """
+    Parses a TOPP tool ini file into a list of parameter entries (dicts with key, name, value,
+    valid_strings, description, advanced, file and section_description).
+    """
+    param = poms.Param()
+    poms.ParamXMLFile().load(str(ini_file), param)
+    schema = []
+    for key in param.keys():
+        entry = param.getEntry(key)
+        tags = param.getTags(key)
+        value = entry.value
+        if isinstance(value, list):
+            value = [v.decode() if isinstance(v, bytes) else v for v in value]
+        schema.append(
+            {
+                "key": key,
+                "name": entry.name.decode(),
+                "value": value,
+                "valid_strings": [v.decode() for v in entry.valid_strings],
+                "description": entry.description.decode(),
+                "advanced": b"advanced" in tags,
+                "file": b"input file" in tags or b"output file" in tags,
+                "section_description": param.getSectionDescription(
+                    ":".join(key.decode().split(":")[:-1])
+                ),
+            }
+        )
+    return schema
+
 class ParameterManager:
     """
     Manages the parameters for a workflow, including saving parameters to a JSON file,
@@ -12,7 +54,8 @@ class ParameterManager:
     general parameters stored in Streamlit's session state.
 
     Attributes:
-        ini_dir (Path): Directory path where .ini files for TOPP tools are stored.
+        ini_dir (Path): Directory with the custom defaults of the TOPP tools (<tool>.json) of this workflow.
+        schema_dir (Path): Directory with the default .ini files of the TOPP tools, shared by all workspaces.
         params_file (Path): Path to the JSON file where parameters are saved.
         param_prefix (str): Prefix for general parameter keys in Streamlit's session state.
         topp_param_prefix (str): Prefix for TOPP tool parameter keys in Streamlit's session state.
@@ -21,61 +64,127 @@ class ParameterManager:
     def __init__(self, workflow_dir: Path):
         self.ini_dir = Path(workflow_dir, "ini")
         self.ini_dir.mkdir(parents=True, exist_ok=True)
+        self.openms_version = poms.VersionInfo.getVersion()
+        self.schema_dir = Path(
+            Path(workflow_dir).parent.parent, TOPP_SCHEMA_DIR_NAME, self.openms_version
+        )
         self.params_file = Path(workflow_dir, "params.json")
         self.param_prefix = f"{workflow_dir.stem}-param-"
         self.topp_param_prefix = f"{workflow_dir.stem}-TOPP-"
 
+    def topp_schema(self, tool: str) -> list:
+        """
+        Returns the parameter entries of a TOPP tool. The default ini file is written once per
+        OpenMS version for all workspaces and parsed once per process.
+
+        Args:
+            tool (str): Name of the TOPP tool.
+
+        Returns:
+            list: Parameter entries (see parse_topp_schema), None if the tool is not found.
+        """
+        cache_key = (self.openms_version, tool)
+        if cache_key not in _TOPP_SCHEMAS:
+            ini_file = Path(self.schema_dir, f"{tool}.ini")
+            if not ini_file.exists():
+                self.schema_dir.mkdir(parents=True, exist_ok=True)
+                # written to a temporary file first, concurrent sessions never see partial files
+                fd, tmp = tempfile.mkstemp(suffix=".ini", dir=self.schema_dir)
+                os.close(fd)
+                try:
+                    subprocess.call([tool, "-write_ini", tmp])
+                    if Path(tmp).stat().st_size == 0:
+                        return None
+                    os.replace(tmp, ini_file)
+                except FileNotFoundError:
+                    return None
+                finally:
+                    Path(tmp).unlink(missing_ok=True)
+            _TOPP_SCHEMAS[cache_key] = parse_topp_schema(ini_file)
+        return _TOPP_SCHEMAS[cache_key]
+
+    def get_custom_defaults(self, tool: str) -> dict:
+        """
+        Custom defaults of a TOPP tool in this workflow (set by the workflow when the tool is shown),
+        parameter name (without tool prefix) -> value. Empty if the tool has not been shown yet.
+        """
+        path = Path(self.ini_dir, f"{tool}.json")
+        if not path.exists():
+            # workspaces of previous versions have a full copy of the ini file, reduced to the diff once
+            ini_file = Path(self.ini_dir, f"{tool}.ini")
+            if not ini_file.exists():
+                return {}
+            defaults = {p["key"]: p["value"] for p in self.topp_schema(tool) or []}
+            custom_defaults = {
+                p["key"].decode().split(":1:")[1]: p["value"]
+                for p in parse_topp_schema(ini_file)
+                if not p["file"] and defaults.get(p["key"]) != p["value"]
+            }
+            self.set_custom_defaults(tool, custom_defaults)
+            ini_file.unlink()
+            return custom_defaults
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def set_custom_defaults(self, tool: str, custom_defaults: dict) -> None:
+        """Stores the custom defaults of a TOPP tool for this workflow (only the diff to the tool defaults)."""
+        with open(Path(self.ini_dir, f"{tool}.json"), "w", encoding="utf-8") as f:
+            json.dump(custom_defaults, f, indent=4)
+
+    def init_custom_defaults(self, tool: str, custom_defaults: dict) -> None:
+        """
+        Stores the custom defaults of a TOPP tool when it is shown for the first time in this workflow.
+        Later changes of the custom defaults do not affect existing workflows.
+        """
+        # migrates ini files of previous versions
+        self.get_custom_defaults(tool)
+        if not Path(self.ini_dir, f"{tool}.json").exists():
+            self.set_custom_defaults(tool, custom_defaults)
+
+    def get_topp_defaults(self, tool: str) -> dict:
+        """
+        Default values of a TOPP tool in this workflow: tool defaults updated with the custom defaults,
+        parameter name (without tool prefix) -> value.
+        """
+        schema = self.topp_schema(tool) or []
+        defaults = {p["key"].decode().split(":1:")[1]: p["value"] for p in schema}
+        return defaults | self.get_custom_defaults(tool)
+
     def save_parameters(self) -> None:
         """
         Saves the current parameters from Streamlit's session state to a JSON file.
         It handles both general parameters and parameters specific to TOPP tools,
-        ensuring that only non-default values are stored.
+        ensuring that only non-default values are stored. Defaults come from the parsed
+        TOPP schemas, the file is only written if parameters changed.
         """
-        # Everything in session state which begins with self.param_prefix is saved to a json file
-        json_params = {
-            k.replace(self.param_prefix, ""): v
-            for k, v in st.session_state.items()
-            if k.startswith(self.param_prefix)
-        }
+        # Everything in session state which begins with self.param_prefix is saved to a json file,
+        # TOPP tool parameters (prefix self.topp_param_prefix) are collected per tool in the same pass
+        json_params, topp_params = {}, {}
+        for k, v in st.session_state.items():
+            if k.startswith(self.param_prefix):
+                json_params[k.replace(self.param_prefix, "")] = v
+            elif k.startswith(self.topp_param_prefix):
+                tool, name = k.replace(self.topp_param_prefix, "").split(":1:")
+                topp_params.setdefault(tool, {})[name] = v
 
         # Merge with parameters from json
         # Advanced parameters are only in session state if the view is active
-        json_params = self.get_parameters_from_json() | json_params
-
-        # get a list of TOPP tools which are in session state
-        current_topp_tools = list(
-            set(
-                [
-                    k.replace(self.topp_param_prefix, "").split(":1:")[0]
-                    for k in st.session_state.keys()
-                    if k.startswith(f"{self.topp_param_prefix}")
-                ]
-            )
-        )
-        # for each TOPP tool, open the ini file
-        for tool in current_topp_tools:
+        previous = self.get_parameters_from_json()
+        # deep copy, the TOPP tool sections are updated below and compared with previous
+        json_params = copy.deepcopy(previous) | json_params
+
+        for tool, values in topp_params.items():
             if tool not in json_params:
                 json_params[tool] = {}
-            # load the param object
-            param = poms.Param()
-            poms.ParamXMLFile().load(str(Path(self.ini_dir, f"{tool}.ini")), param)
-            # get all session state param keys and values for this tool
-            for key, value in st.session_state.items():
-                if key.startswith(f"{self.topp_param_prefix}{tool}:1:"):
-                    # get ini_key
-                    ini_key = key.replace(self.topp_param_prefix, "").encode()
-                    # get ini (default) value by ini_key
-                    ini_value = param.getValue(ini_key)
-                    # check if value is different from default
-                    if (
-                        (ini_value != value) 
-                        or (key.split(":1:")[1] in json_params[tool])
-                    ):
-                        # store non-default value
-                        json_params[tool][key.split(":1:")[1]] = value
+            defaults = self.get_topp_defaults(tool)
+            for name, value in values.items():
+                # store non-default values (and values which have been stored before)
+                if (defaults.get(name) != value) or (name in json_params[tool]):
+                    json_params[tool][name] = value
         # Save to json file
-        with open(self.params_file, "w", encoding="utf-8") as f:
-            json.dump(json_params, f, indent=4)
+        if json_params != previous or not self.params_file.exists():
+            with open(self.params_file, "w", encoding="utf-8") as f:
+                json.dump(json_params, f, indent=4)
 
     def get_parameters_from_json(self) -> None:
         """
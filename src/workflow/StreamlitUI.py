@@ -9,8 +9,6 @@ import os
 import sys
 import importlib.util
 import time
-from io import BytesIO
-import zipfile
 from datetime import datetime
 from streamlit_js_eval import streamlit_js_eval
 
@@ -18,9 +16,11 @@ from streamlit_js_eval import streamlit_js_eval
 from src.common.common import (
     OS_PLATFORM,
     TK_AVAILABLE,
+    download_archive,
     tk_directory_dialog,
     tk_file_dialog,
 )
+from src.common.zipstream import collect_files
 
 
 class StreamlitUI:
@@ -544,7 +544,7 @@ class StreamlitUI:
     ) -> None:
         """
         Generates input widgets for TOPP tool parameters dynamically based on the tool's
-        .ini file. Supports excluding specific parameters and adjusting the layout.
+        parameter schema (cached .ini file). Supports excluding specific parameters and adjusting the layout.
         File input and output parameters are excluded.
 
         Args:
@@ -563,32 +563,19 @@ class StreamlitUI:
         if display_subsection_tabs:
             display_subsections = True
 
-        # write defaults ini files
-        ini_file_path = Path(self.parameter_manager.ini_dir, f"{topp_tool_name}.ini")
-        if not ini_file_path.exists():
-            try:
-                subprocess.call([topp_tool_name, "-write_ini", str(ini_file_path)])
-            except FileNotFoundError:
-                st.error(f"TOPP tool **'{topp_tool_name}'** not found.")
-                return
-            # update custom defaults if necessary
-            if custom_defaults:
-                param = poms.Param()
-                poms.ParamXMLFile().load(str(ini_file_path), param)
-                for key, value in custom_defaults.items():
-                    encoded_key = f"{topp_tool_name}:1:{key}".encode()
-                    if encoded_key in param.keys():
-                        param.setValue(encoded_key, value)
-                poms.ParamXMLFile().store(str(ini_file_path), param)
-
-        # read into Param object
-        param = poms.Param()
-        poms.ParamXMLFile().load(str(ini_file_path), param)
+        # parameter schema of the tool (parsed once, shared by all workspaces)
+        schema = self.parameter_manager.topp_schema(topp_tool_name)
+        if schema is None:
+            st.error(f"TOPP tool **'{topp_tool_name}'** not found.")
+            return
+        # store custom defaults (diff to the tool defaults) if the tool is shown for the first time
+        self.parameter_manager.init_custom_defaults(topp_tool_name, custom_defaults)
+
         if include_parameters:
             valid_keys = [
-                key
-                for key in param.keys()
-                if any([k.encode() in key for k in include_parameters])
+                p["key"]
+                for p in schema
+                if any([k.encode() in p["key"] for k in include_parameters])
             ]
         else:
             excluded_keys = [
@@ -601,28 +588,18 @@ class StreamlitUI:
                 "test",
             ] + exclude_parameters
             valid_keys = [
-                key
-                for key in param.keys()
+                p["key"]
+                for p in schema
                 if not (
-                    b"input file" in param.getTags(key)
-                    or b"output file" in param.getTags(key)
-                    or any([k.encode() in key for k in excluded_keys])
+                    p["file"]
+                    or any([k.encode() in p["key"] for k in excluded_keys])
                 )
             ]
+        entries = {p["key"]: p for p in schema}
         params = []
         for key in valid_keys:
-            entry = param.getEntry(key)
-            p = {
-                "name": entry.name.decode(),
-                "key": key,
-                "value": entry.value,
-                "valid_strings": [v.decode() for v in entry.valid_strings],
-                "description": entry.description.decode(),
-                "advanced": (b"advanced" in param.getTags(key)),
-                "section_description": param.getSectionDescription(
-                    ":".join(key.decode().split(":")[:-1])
-                ),
-            }
+            # copy, the cached schema entries are shared
+            p = dict(entries[key])
             # Parameter sections and subsections as string (e.g. "section:subsection")
             if display_subsections:
                 p["sections"] = ":".join(
@@ -887,7 +864,9 @@ class StreamlitUI:
         """
         Creates a zip archive of all files within a specified directory,
         including files in subdirectories, and offers it as a download
-        button in a Streamlit application.
+        button in a Streamlit application. The archive is written to disk
+        next to the directory in chunks, compressing files in parallel, and
+        deleted once read.
 
         Args:
             directory (str): The directory whose files are to be zipped.
@@ -898,39 +877,21 @@ class StreamlitUI:
             st.error("No files to compress.")
             return
 
-        bytes_io = BytesIO()
-        files = list(directory.rglob("*"))  # Use list comprehension to find all files
+        members = collect_files([directory])
 
         # Check if there are any files to zip
-        if not files:
+        if not members:
             st.error("Directory is empty or contains no files.")
             return
 
-        n_files = len(files)
-
         c1, _ = st.columns(2)
-        # Initialize Streamlit progress bar
-        my_bar = c1.progress(0)
-
-        with zipfile.ZipFile(bytes_io, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for i, file_path in enumerate(files):
-                if (
-                    file_path.is_file()
-                ):  # Ensure we're only adding files, not directories
-                    # Preserve directory structure relative to the original directory
-                    zip_file.write(file_path, file_path.relative_to(directory.parent))
-                    my_bar.progress((i + 1) / n_files)  # Update progress bar
-
-        my_bar.empty()  # Clear progress bar after operation is complete
-        bytes_io.seek(0)  # Reset buffer pointer to the beginning
-
-        # Display a download button for the zip file in Streamlit
-        c1.download_button(
-            label="⬇️ Download Now",
-            data=bytes_io,
-            file_name="input-files.zip",
-            mime="application/zip",
-            use_container_width=True,
+        # Input files are mostly mzML files, which are already in the workspace
+        download_archive(
+            members,
+            Path(directory.parent, directory.name + ".zip"),
+            "input-files.zip",
+            keep_archive=False,
+            container=c1,
         )
 
     def file_upload_section(self, custom_upload_function) -> None:
@@ -1116,7 +1077,7 @@ class StreamlitUI:
         markdown = []
 
         url = f"https://github.com/{st.session_state.settings['github-user']}/{st.session_state.settings['repository-name']}"
-        tools = [p.stem for p in Path(self.parameter_manager.ini_dir).iterdir()]
+        tools = sorted(set(p.stem for p in Path(self.parameter_manager.ini_dir).iterdir()))
         if len(tools) > 1:
             tools = ", ".join(tools[:-1]) + " and " + tools[-1]
 
@@ -1142,19 +1103,41 @@ DOI: 10.1021/acs.jproteome.4c00872
         markdown.append(self.non_default_params_summary())
         return "\n".join(markdown)
     
-    def simple_file_uploader(self, key: str, file_type: str, name: str = "") -> None:
+    def simple_file_uploader(
+        self,
+        key: str,
+        file_type: Union[str, List[str]],
+        name: str = "",
+        multiple: bool = False,
+    ) -> None:
+        """
+        File uploader for a single input file, which replaces the previous one. With multiple,
+        uploaded files are added to the previous ones and can be removed all at once.
+        """
+        # a new uploader widget (key) is created after removing files, it would upload them again
+        uploader_id = st.session_state.get(f"{key}-uploader-id", 0)
         upload = st.file_uploader(
-            name, file_type, False
+            name, file_type, multiple, key=f"{key}-uploader-{uploader_id}"
         )
         dir_path = Path(self.workflow_dir, "input-files", key)
         if upload:
-            if dir_path.exists():
+            uploads = upload if multiple else [upload]
+            if dir_path.exists() and not multiple:
                 shutil.rmtree(dir_path)
             dir_path.mkdir(parents=True, exist_ok=True)
-            path = Path(dir_path, upload.name)
-            with open(path, "wb") as f:
-                f.write(upload.getbuffer())
-        if dir_path.exists():
-            st.info([p.name for p in dir_path.iterdir()][0])
+            for upload in uploads:
+                path = Path(dir_path, upload.name)
+                with open(path, "wb") as f:
+                    f.write(upload.getbuffer())
+        if dir_path.exists() and any(dir_path.iterdir()):
+            if multiple:
+                c1, c2 = st.columns([0.75, 0.25])
+                c1.info(", ".join(sorted(p.name for p in dir_path.iterdir())))
+                if c2.button("Remove all", key=f"{key}-remove-all"):
+                    shutil.rmtree(dir_path)
+                    st.session_state[f"{key}-uploader-id"] = uploader_id + 1
+                    st.rerun()
+            else:
+                st.info([p.name for p in dir_path.iterdir()][0])
         else:
             st.warning(f"No {name} file in workspace.")
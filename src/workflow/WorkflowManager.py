@@ -43,9 +43,9 @@ class WorkflowManager:
         try:
             self.logger.log("STARTING WORKFLOW")
             results_dir = Path(self.workflow_dir, "results")
-            if results_dir.exists():
+            if results_dir.exists() and not self.keep_results():
                 shutil.rmtree(results_dir)
-            results_dir.mkdir(parents=True)
+            results_dir.mkdir(parents=True, exist_ok=True)
             self.execution()
             self.logger.log("WORKFLOW FINISHED")
         except Exception as e:
@@ -53,6 +53,13 @@ class WorkflowManager:
         # Delete pid dir path to indicate workflow is done
         shutil.rmtree(self.executor.pid_dir, ignore_errors=True)
 
+    def keep_results(self) -> bool:
+        """
+        Whether the results of the previous run are kept when the workflow is started
+        (e.g. to add new samples to them). By default, results are deleted.
+        """
+        return False
+
     def show_file_upload_section(self) -> None:
         """
         Shows the file upload section of the UI with content defined in self.upload().
@@ -1,8 +1,299 @@
+import importlib.util
+import json
+import os
+import tempfile
 import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from src.common import blobstore, zipstream
+from src.common.downsample import downsample, lttb
+from src.common.spectralsimilarity import score_batch
+
+try:
+    from src.workflow.ParameterManager import ParameterManager
+except ImportError:  # streamlit or pyopenms not installed
+    ParameterManager = None
+
+
+def load_script(path):
+    """Loads a script (e.g. a python tool or benchmark) as module."""
+    path = Path(path)
+    spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 class TestDummy(unittest.TestCase):
     def test_dummy(self):
         self.assertEqual(1, 1)
 
+@unittest.skipIf(ParameterManager is None, "requires streamlit and pyopenms")
+class TestSaveParameters(unittest.TestCase):
+    def test_topp_changes_are_saved_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pm = ParameterManager(Path(tmp, "workspace", "workflow"))
+            key = pm.topp_param_prefix + "Tool:1:"
+            session_state = {key + "a": 2.0}
+            defaults = {"a": 1.0, "b": "x"}
+            with mock.patch("src.workflow.ParameterManager.st") as st, mock.patch.object(
+                pm, "get_topp_defaults", return_value=defaults
+            ):
+                st.session_state = session_state
+                pm.save_parameters()
+                # changes after the first save have to reach the parameter file as well
+                session_state.update({key + "a": 3.0, key + "b": "y"})
+                pm.save_parameters()
+            with open(pm.params_file, "r", encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["Tool"], {"a": 3.0, "b": "y"})
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = blobstore.get_store_dir(self.tmp.name)
+        self.workspaces = [Path(self.tmp.name, name, "mzML-files") for name in ["a", "b"]]
+        for ws in self.workspaces:
+            ws.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shared_blob_survives(self):
+        blobs = [
+            blobstore.add_buffer(b"spectra", Path(ws, "sample.mzML"), self.store)
+            for ws in self.workspaces
+        ]
+        self.assertEqual(blobs[0], blobs[1])
+        Path(self.workspaces[0], "sample.mzML").unlink()
+        self.assertEqual(blobstore.remove_unreferenced(self.store), [])
+        self.assertEqual(Path(self.workspaces[1], "sample.mzML").read_bytes(), b"spectra")
+
+    def test_unreferenced_blob_is_removed(self):
+        blob = blobstore.add_buffer(b"spectra", Path(self.workspaces[0], "sample.mzML"), self.store)
+        Path(self.workspaces[0], "sample.mzML").unlink()
+        self.assertEqual(blobstore.remove_unreferenced(self.store), [blob])
+        self.assertFalse(blob.exists())
+
+    def test_move_keeps_content(self):
+        path = Path(self.tmp.name, "upload.mzML")
+        path.write_bytes(b"spectra")
+        blob = blobstore.add_file(path, Path(self.workspaces[0], "sample.mzML"), self.store, move=True)
+        self.assertFalse(path.exists())
+        self.assertEqual(blob.stat().st_nlink, 2)
+        self.assertEqual(Path(self.workspaces[0], "sample.mzML").read_bytes(), b"spectra")
+
+    def test_copy_without_hard_links(self):
+        with mock.patch("os.link", side_effect=PermissionError):
+            blobstore.add_buffer(b"spectra", Path(self.workspaces[0], "sample.mzML"), self.store)
+        self.assertEqual(Path(self.workspaces[0], "sample.mzML").read_bytes(), b"spectra")
+        self.assertEqual(Path(self.workspaces[0], "sample.mzML").stat().st_nlink, 1)
+
+    def test_blob_removed_before_linking_is_stored_again(self):
+        link = os.link
+
+        def remove_first(src, dst):
+            # clean-up removes the blob between the existence check and linking
+            if Path(src).parent == self.store and not hasattr(remove_first, "done"):
+                remove_first.done = True
+                Path(src).unlink()
+            link(src, dst)
+
+        blobstore.add_buffer(b"spectra", Path(self.workspaces[0], "sample.mzML"), self.store)
+        with mock.patch("os.link", side_effect=remove_first):
+            blob = blobstore.add_buffer(b"spectra", Path(self.workspaces[1], "sample.mzML"), self.store)
+        self.assertTrue(blob.exists())
+        self.assertEqual(Path(self.workspaces[1], "sample.mzML").read_bytes(), b"spectra")
+
+class TestZipStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name, "results")
+        Path(self.dir, "sub").mkdir(parents=True)
+        self.files = {
+            "results/table.tsv": b"mz\trt\n" + b"100.5\t60.2\n" * 10000,  # deflated
+            "results/sub/table.parquet": os.urandom(50000),  # stored
+            "results/sub/empty.txt": b"",
+        }
+        for name, data in self.files.items():
+            Path(self.tmp.name, name).write_bytes(data)
+        self.archive = Path(self.tmp.name, "results.zip")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        zipstream.write_zip(zipstream.collect_files([self.dir]), self.archive, num_threads=2)
+        with zipfile.ZipFile(self.archive) as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual({name: f.read(name) for name in f.namelist()}, self.files)
+            types = {info.filename: info.compress_type for info in f.infolist()}
+        self.assertEqual(types["results/table.tsv"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types["results/sub/table.parquet"], zipfile.ZIP_STORED)
+
+    def test_up_to_date(self):
+        zipstream.write_zip(zipstream.collect_files([self.dir]), self.archive)
+        self.assertTrue(zipstream.is_up_to_date(self.archive, zipstream.collect_files([self.dir])))
+
+    def test_added_file_is_not_up_to_date(self):
+        zipstream.write_zip(zipstream.collect_files([self.dir]), self.archive)
+        added = Path(self.dir, "added.tsv")
+        added.write_bytes(b"mz\n")
+        # a copied file can be older than the archive
+        mtime = self.archive.stat().st_mtime - 60
+        os.utime(added, (mtime, mtime))
+        self.assertFalse(zipstream.is_up_to_date(self.archive, zipstream.collect_files([self.dir])))
+
+    def test_removed_file_is_not_up_to_date(self):
+        zipstream.write_zip(zipstream.collect_files([self.dir]), self.archive)
+        Path(self.dir, "sub", "empty.txt").unlink()
+        self.assertFalse(zipstream.is_up_to_date(self.archive, zipstream.collect_files([self.dir])))
+
+class TestGapFilling(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.tool = load_script("src/python-tools/gap_filling.py")
+        except ImportError:
+            raise unittest.SkipTest("requires pyopenms")
+
+    def setUp(self):
+        # one MS1 spectrum per second, a Gaussian peak at m/z 300 and RT 200 s and a second trace
+        scan_rt = np.arange(0.0, 601.0)
+        self.height, self.sigma = 1e5, 5.0
+        mz = np.concatenate([np.full(len(scan_rt), 300.0), np.full(len(scan_rt), 400.0)])
+        intensity = np.concatenate(
+            [
+                self.height * np.exp(-((scan_rt - 200) ** 2) / (2 * self.sigma**2)),
+                np.full(len(scan_rt), 1e3),
+            ]
+        )
+        scan = np.tile(np.arange(len(scan_rt), dtype=np.int32), 2)
+        order = np.argsort(mz, kind="stable")
+        self.index = {
+            "mz": mz[order],
+            "intensity": intensity[order].astype(np.float32),
+            "scan": scan[order],
+            "scan_rt": scan_rt,
+        }
+        self.area = self.height * self.sigma * np.sqrt(2 * np.pi)
+
+    def integrate(self, rt):
+        return self.tool.integrate(self.index, np.array([300.0]), np.array([rt]), 10.0, 120.0)
+
+    def test_area(self):
+        result = self.integrate(200.0)
+        self.assertAlmostEqual(result["intensity"][0] / self.area, 1.0, places=3)
+        self.assertEqual(result["RT"][0], 200.0)
+
+    def test_monotonic_transformation(self):
+        self.tool.transform_index(self.index, lambda rt: 1.02 * rt + 10)
+        result = self.integrate(214.0)
+        # the peak is stretched along with the RT axis
+        self.assertAlmostEqual(result["intensity"][0] / (1.02 * self.area), 1.0, places=3)
+        self.assertAlmostEqual(result["RT"][0], 214.0)
+
+    def test_non_monotonic_transformation(self):
+        # reverses the spectrum order, the peaks have to move with their spectra
+        self.tool.transform_index(self.index, lambda rt: 1000 - rt)
+        self.assertTrue((np.diff(self.index["scan_rt"]) > 0).all())
+        result = self.integrate(800.0)
+        self.assertAlmostEqual(result["intensity"][0] / self.area, 1.0, places=3)
+        self.assertEqual(result["RT"][0], 800.0)
+
+class TestSpectralSimilarity(unittest.TestCase):
+    # peaks (m/z, intensity) of query and library spectra, one pair per row, with ties: two query
+    # peaks matching the same library peak with the same product (and vice versa)
+    QUERY = [
+        [(100.0, 0.5), (150.0, 0.3), (200.0, 0.6), (200.02, 0.6), (300.0, 0.2)],
+        [(80.0, 0.4), (120.0, 0.4), (160.0, 0.7), (230.0, 0.3)],
+        [(50.0, 0.9), (70.0, 0.1)],
+    ]
+    LIBRARY = [
+        [(100.005, 0.5), (150.0, 0.4), (200.01, 0.7), (299.99, 0.1), (300.01, 0.1)],
+        [(80.0, 0.4), (110.0, 0.4), (150.0, 0.7), (220.0, 0.3), (240.0, 0.2)],
+        [(60.0, 1.0)],
+    ]
+    # query minus library precursor m/z, library peaks also match shifted (modified cosine)
+    SHIFT = np.array([0.0, 10.0, -10.0])
+    TOLERANCE = 100.0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.benchmark = load_script("benchmarks/ms2-library-matching.py")
+
+    def setUp(self):
+        n = max(len(peaks) for peaks in self.QUERY)
+        self.query_mz = np.full((len(self.QUERY), n), np.nan, dtype=np.float32)
+        self.query_intensity = np.zeros((len(self.QUERY), n), dtype=np.float32)
+        for row, peaks in enumerate(self.QUERY):
+            self.query_mz[row, : len(peaks)], self.query_intensity[row, : len(peaks)] = zip(*peaks)
+        library = [(pair, mz, x) for pair, peaks in enumerate(self.LIBRARY) for mz, x in peaks]
+        pair, mz, intensity = map(np.array, zip(*library))
+        self.library = (pair, mz.astype(np.float64), intensity.astype(np.float32))
+
+    def reference(self, shift):
+        scores = []
+        for row in range(len(self.QUERY)):
+            query, library = np.array(self.QUERY[row]), np.array(self.LIBRARY[row])
+            scores.append(
+                self.benchmark.cosine_loop(
+                    query[:, 0].astype(np.float32).astype(np.float64),
+                    query[:, 1].astype(np.float32),
+                    library[:, 0],
+                    library[:, 1].astype(np.float32),
+                    self.TOLERANCE,
+                    None if shift is None else shift[row],
+                )
+            )
+        return np.array(scores)
+
+    def test_cosine(self):
+        scores, matched = score_batch(
+            self.query_mz, self.query_intensity, self.library, None, self.TOLERANCE, True
+        )
+        np.testing.assert_allclose(scores, self.reference(None), rtol=1e-6)
+        np.testing.assert_array_equal(matched, [4, 1, 0])
+
+    def test_modified_cosine(self):
+        scores, matched = score_batch(
+            self.query_mz, self.query_intensity, self.library, self.SHIFT, self.TOLERANCE, True
+        )
+        np.testing.assert_allclose(scores, self.reference(self.SHIFT), rtol=1e-6)
+        # shifted matches add to the scores of pairs with different precursor m/z
+        self.assertTrue((scores[1:] > self.reference(None)[1:]).all())
+        np.testing.assert_array_equal(matched, [4, 4, 1])
+
+class TestDownsample(unittest.TestCase):
+    def setUp(self):
+        # chromatogram with a narrow peak (apex at 300.0 s) on noise
+        rng = np.random.default_rng(42)
+        self.x = np.arange(0.0, 600.0, 0.1)
+        self.y = rng.uniform(0, 100, len(self.x)) + 1e5 * np.exp(-((self.x - 300) ** 2) / 0.5)
+
+    def test_lttb(self):
+        i = lttb(self.x, self.y, 500)
+        self.assertEqual(len(i), 500)
+        self.assertEqual((i[0], i[-1]), (0, len(self.x) - 1))
+        self.assertTrue((np.diff(i) > 0).all())
+        self.assertIn(np.argmax(self.y), i)
+
+    def test_short_trace_is_kept(self):
+        np.testing.assert_array_equal(lttb(self.x[:100], self.y[:100], 500), np.arange(100))
+
+    def test_x_range(self):
+        i = downsample(self.x, self.y, 500, x_range=(250.0, 350.0))
+        self.assertEqual(len(i), 500)
+        self.assertIn(np.argmax(self.y), i)
+        # one point beyond the range on each side
+        self.assertEqual(self.x[i[0]], 249.9)
+        self.assertAlmostEqual(self.x[i[-1]], 350.1)
+
+    def test_narrow_x_range_at_full_resolution(self):
+        i = downsample(self.x, self.y, 500, x_range=(299.0, 301.0))
+        np.testing.assert_array_equal(self.x[i], self.x[(self.x >= 298.85) & (self.x <= 301.15)])
+
 if __name__ == '__main__':
     unittest.main()